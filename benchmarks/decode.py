@@ -0,0 +1,89 @@
+"""
+Compares the time and peak memory needed to make a thumbnail of a large JPEG
+with and without ``fast_decode``. Each measurement runs in a new process so
+that its peak memory can be read from the operating system::
+
+    python -m benchmarks.decode
+
+"""
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from .utils import configure, report
+
+
+SOURCE_SIZE = (6000, 4000)
+THUMBNAIL_SIZE = (200, 200)
+
+
+def create_source(path):
+    from PIL import Image
+    # Noise doesn't compress well, like a real photo.
+    img = Image.effect_noise(SOURCE_SIZE, 64).convert('RGB')
+    img.save(path, 'JPEG', quality=90)
+
+
+def measure(path, fast_decode):
+    """
+    Makes a thumbnail of the image at ``path`` and prints the number of
+    seconds it took and the peak memory usage of the process (in KiB).
+
+    """
+    configure()
+    from django.core.files import File
+    from imagekit.processors import ResizeToFill
+    from imagekit.specs import ImageSpec
+
+    class Thumbnail(ImageSpec):
+        processors = [ResizeToFill(*THUMBNAIL_SIZE)]
+        format = 'JPEG'
+
+    Thumbnail.fast_decode = fast_decode
+    with open(path, 'rb') as f:
+        start = time.time()
+        Thumbnail(source=File(f)).generate()
+        elapsed = time.time() - start
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        maxrss //= 1024  # Bytes on macOS, KiB elsewhere.
+    print('%f %d' % (elapsed, maxrss))
+
+
+def run(path, mode):
+    return subprocess.check_output([
+        sys.executable, '-m', 'benchmarks.decode', path, mode])
+
+
+def main():
+    fd, path = tempfile.mkstemp(suffix='.jpg')
+    os.close(fd)
+    try:
+        # The peak memory of a process includes that of its parent when it
+        # was started, so even the source is created in another process.
+        run(path, 'create')
+        full, fast = [[float(value) for value in run(path, mode).split()]
+                      for mode in ('full', 'fast')]
+    finally:
+        os.remove(path)
+
+    title = '%sx%s JPEG to a %sx%s thumbnail' % (SOURCE_SIZE + THUMBNAIL_SIZE)
+    report('%s: time (ms)' % title, [
+        ('full decode', '%.1f' % (full[0] * 1000)),
+        ('fast decode', '%.1f' % (fast[0] * 1000)),
+    ])
+    report('%s: peak memory of the process (MiB)' % title, [
+        ('full decode', '%.1f' % (full[1] / 1024.0)),
+        ('fast decode', '%.1f' % (fast[1] / 1024.0)),
+    ])
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3 and sys.argv[2] == 'create':
+        create_source(sys.argv[1])
+    elif len(sys.argv) == 3:
+        measure(sys.argv[1], sys.argv[2] == 'fast')
+    else:
+        main()
@@ -0,0 +1,57 @@
+"""
+Compares the task payloads of the Celery and RQ cache file backends: the
+pickled ``(backend, file)`` arguments that used to be sent for each file and
+the compact jobs that are sent now (see ``imagekit.cachefiles.jobs``).
+
+"""
+import pickle
+from .utils import setup, timeit, report
+
+
+def main():
+    teardown = setup()
+    try:
+        from imagekit.cachefiles import jobs
+        from imagekit.cachefiles.backends import Simple
+        from tests.utils import create_photo
+
+        photo = create_photo('benchmark-payload.jpg')
+        file = photo.thumbnail
+        backend = Simple()
+
+        legacy = pickle.dumps((backend, file), pickle.HIGHEST_PROTOCOL)
+        job = pickle.dumps(jobs.describe(file), pickle.HIGHEST_PROTOCOL)
+
+        def enqueue_legacy():
+            pickle.dumps((backend, file), pickle.HIGHEST_PROTOCOL)
+
+        def enqueue_job():
+            pickle.dumps(jobs.describe(file), pickle.HIGHEST_PROTOCOL)
+
+        def dequeue_legacy():
+            backend, file = pickle.loads(legacy)
+            # The source is loaded lazily, so include that in the measurement.
+            file.generator.source
+
+        def dequeue_job():
+            jobs.load(pickle.loads(job))
+
+        report('Payload size (bytes)', [
+            ('pickled backend and file', len(legacy)),
+            ('job', len(job)),
+        ])
+        report('Enqueue (ms)', [
+            ('pickled backend and file', '%.3f' % (timeit(enqueue_legacy) * 1000)),
+            ('job', '%.3f' % (timeit(enqueue_job) * 1000)),
+        ])
+        report('Dequeue, including loading the source (ms)', [
+            ('pickled backend and file', '%.3f' % (timeit(dequeue_legacy) * 1000)),
+            ('job', '%.3f' % (timeit(dequeue_job) * 1000)),
+        ])
+        photo.original_image.delete()
+    finally:
+        teardown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""
+Measures the overhead of ImageKit's ``post_init`` receiver when iterating over
+querysets, for a model with an image source field and for an unrelated model,
+with the receivers connected and disconnected (as if ImageKit weren't
+installed). The receivers are only connected to models with source fields, so
+unrelated models shouldn't be affected::
+
+    python -m benchmarks.signals
+
+"""
+from .utils import setup, timeit, report
+
+
+ROWS = 10000
+
+
+def main():
+    teardown = setup()
+    try:
+        from django.contrib.auth.models import Group
+        from django.db.models.signals import post_init, post_save
+        from imagekit.specs.sourcegroups import signal_router
+        from tests.models import ImageModel
+
+        ImageModel.objects.bulk_create(
+            ImageModel(image='b/image-%s.jpg' % i) for i in range(ROWS))
+        Group.objects.bulk_create(
+            Group(name='group-%s' % i) for i in range(ROWS))
+
+        uid = 'ik_spec_field_receivers'
+
+        def iterate(model):
+            return lambda: list(model.objects.all())
+
+        rows = []
+        for label, model in [('model with a source', ImageModel),
+                             ('unrelated model', Group)]:
+            with_imagekit = timeit(iterate(model), repeat=10)
+            post_init.disconnect(sender=model, dispatch_uid=uid)
+            post_save.disconnect(sender=model, dispatch_uid=uid)
+            try:
+                without_imagekit = timeit(iterate(model), repeat=10)
+            finally:
+                if signal_router.get_class_source_fields(model):
+                    signal_router.connect_model(model)
+            rows.extend([
+                ('%s, with ImageKit' % label, '%.1f' % (with_imagekit * 1000)),
+                ('%s, without ImageKit' % label,
+                 '%.1f' % (without_imagekit * 1000)),
+            ])
+        report('Iterating over %s rows (ms)' % ROWS, rows)
+    finally:
+        teardown()
+
+
+if __name__ == '__main__':
+    main()
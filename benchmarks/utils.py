@@ -0,0 +1,62 @@
+"""
+Helpers for the benchmarks. The benchmarks use the test project's settings and
+run against a temporary test database, so they can be run from the root of the
+repository like this::
+
+    python -m benchmarks.payloads
+
+"""
+import os
+import sys
+import time
+
+
+def configure():
+    """
+    Configure Django with the test project's settings.
+
+    """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.settings')
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    import django
+    django.setup()
+
+
+def setup():
+    """
+    Configure Django and create the test database. Returns a function that
+    destroys it.
+
+    """
+    configure()
+
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0)
+
+    def teardown():
+        from tests.utils import clear_imagekit_cache
+        clear_imagekit_cache()
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    return teardown
+
+
+def timeit(fn, repeat=1000):
+    """
+    Returns the average number of seconds that calling ``fn`` takes.
+
+    """
+    start = time.time()
+    for i in range(repeat):
+        fn()
+    return (time.time() - start) / repeat
+
+
+def report(title, rows):
+    print(title)
+    for label, value in rows:
+        print('  %-40s %s' % (label, value))
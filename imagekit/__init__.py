@@ -4,3 +4,4 @@ from . import generatorlibrary
 from .specs import ImageSpec
 from .pkgmeta import *
 from .registry import register, unregister
+from .bulk import generate_for_queryset, invalidate
@@ -0,0 +1,258 @@
+"""
+Functions that generate or invalidate the cache files of many model instances
+at once. ``bulk_create()``, ``QuerySet.update()`` and data migrations don't send
+the signals that ImageKit relies on, so they can be followed by::
+
+    imagekit.invalidate(Photo.objects.filter(pk__in=pks))
+
+or, to generate the files right away::
+
+    imagekit.generate_for_queryset(Photo.objects.all(), workers=4)
+
+The instances are loaded in chunks (of ``IMAGEKIT_BULK_CHUNK_SIZE`` rows), the
+states of each chunk's files are looked up together, and the specs of each
+source share its decoded image.
+
+"""
+from collections import OrderedDict
+from django.conf import settings
+from .cachefiles import ImageCacheFile, prefetch_states
+from .cachefiles.backends import CacheFileState, batch_generation
+from .registry import generator_registry, source_group_registry
+from .utils import (call_strategy_method, get_logger, share_processor_prefixes,
+                    share_source_image)
+
+
+def generate_for_queryset(queryset, spec_ids=None, workers=None, force=False,
+                          chunk_size=None):
+    """
+    Generates the cache files of the model instances in ``queryset`` for the
+    specs with the given ids (by default, all of the specs whose sources are
+    fields of the model). Files that exist are skipped, unless ``force`` is
+    true.
+
+    The files are generated through their cache file backends, so
+    asynchronous backends schedule them (in batches). If ``workers`` is
+    given, the files of the other backends are generated in that many worker
+    processes (see ``imagekit.cachefiles.jobs.GenerationPool``), which load
+    the instances from the database--so the rows must have been committed.
+    Returns the number of files that were generated or scheduled.
+
+    """
+    from .cachefiles.jobs import GenerationPool, describe
+
+    pool = GenerationPool(processes=workers) if workers else None
+    count = 0
+    try:
+        for instances in _iter_chunks(queryset, chunk_size):
+            groups = _get_file_groups(instances, queryset.model, spec_ids)
+            states = prefetch_states(
+                [file for source, files in groups for file in files])
+            jobs = OrderedDict()
+            with batch_generation():
+                for source, files in groups:
+                    files = [file for file in files if force or
+                             states.get(file.name) != CacheFileState.EXISTS]
+                    if pool is not None:
+                        local = []
+                        for file in files:
+                            job = None
+                            if not getattr(file.cachefile_backend, 'is_async',
+                                           False):
+                                job = describe(file, force=force)
+                            if job is None:
+                                local.append(file)
+                            else:
+                                jobs.setdefault(id(source), []).append(job)
+                        files = local
+                    count += _generate_files(source, files, force)
+            if jobs:
+                count += pool.map_batches(jobs.values())
+            update_metadata(instances, queryset.model, spec_ids)
+    finally:
+        if pool is not None:
+            pool.close()
+    return count
+
+
+def invalidate(queryset, spec_ids=None, chunk_size=None):
+    """
+    Deletes the cache files of the model instances in ``queryset`` for the
+    specs with the given ids (by default, all of the specs whose sources are
+    fields of the model), forgets their states and tells their cache file
+    strategies that the sources were saved, as saving each instance would.
+    The files are generated again by their strategies (when they're needed,
+    for ``JustInTime``). Returns the number of files that were invalidated.
+
+    """
+    count = 0
+    for instances in _iter_chunks(queryset, chunk_size):
+        groups = _get_file_groups(instances, queryset.model, spec_ids)
+        by_backend = OrderedDict()
+        for source, files in groups:
+            for file in files:
+                # The files are deleted, since their names don't change if
+                # their sources' names don't; otherwise, they'd be found in
+                # storage once their states expired.
+                file.storage.delete(file.name)
+                backend = file.cachefile_backend
+                by_backend.setdefault(id(backend), (backend, []))[1].append(
+                    file)
+        for backend, files in by_backend.values():
+            set_states = getattr(backend, 'set_states', None)
+            if set_states is None:
+                continue
+            # The files remember their new states, so the strategies don't
+            # need to look them up again.
+            for file in files:
+                file._prefetched_state = {
+                    'state': CacheFileState.DOES_NOT_EXIST}
+            set_states(files, [CacheFileState.DOES_NOT_EXIST] * len(files))
+
+        with batch_generation():
+            for source, files in groups:
+                with share_source_image(source):
+                    share_processor_prefixes(
+                        source, [file.generator for file in files])
+                    for file in files:
+                        call_strategy_method(file, 'on_source_saved')
+                count += len(files)
+        update_metadata(instances, queryset.model, spec_ids)
+    return count
+
+
+def generate_files(files, force=False):
+    """
+    Generates cache files through their backends, grouping them by source so
+    that the specs of each source share its decoded image. A file that fails
+    to generate doesn't prevent the others from being generated. Returns the
+    number of files that were generated or scheduled.
+
+    """
+    groups = OrderedDict()
+    for file in files:
+        source = getattr(file.generator, 'source', None)
+        groups.setdefault(id(source), (source, []))[1].append(file)
+    count = 0
+    with batch_generation(on_commit=False):
+        for source, source_files in groups.values():
+            count += _generate_files(source, source_files, force)
+    return count
+
+
+def update_metadata(instances, model, spec_ids=None):
+    """
+    Updates the metadata fields of the instances (of ``model``) for the specs
+    with the given ids (by default, all of the model's specs that have
+    metadata fields). The states of the files are looked up together, and
+    the rows are updated in a single query if the version of Django allows
+    it.
+
+    """
+    from .models.fields import ImageSpecField
+
+    fields = []
+    for cls in model.__mro__:
+        for value in list(vars(cls).values()):
+            field = getattr(value, 'field', None)
+            if (isinstance(field, ImageSpecField) and field.metadata_field
+                    and (spec_ids is None or field.spec_id in spec_ids)
+                    and field not in fields):
+                fields.append(field)
+    if not fields or not instances:
+        return
+
+    files = [(field, instance, field.get_file(instance))
+             for field in fields for instance in instances]
+    prefetch_states([file for field, instance, file in files],
+                    check_if_unknown=False)
+    for field, instance, file in files:
+        if getattr(file, '_prefetched_state', None) is None:
+            # The state isn't known, so there's no metadata to store (and no
+            # need to look it up again).
+            file._prefetched_state = {'state': CacheFileState.DOES_NOT_EXIST}
+        field.update_metadata(instance, save=False, file=file)
+
+    attnames = [model._meta.get_field(field.metadata_field).attname
+                for field in fields]
+    manager = model._base_manager
+    if hasattr(manager, 'bulk_update'):  # Django >= 2.2
+        manager.bulk_update(instances, attnames)
+    else:
+        for instance in instances:
+            manager.filter(pk=instance.pk).update(**dict(
+                (attname, getattr(instance, attname)) for attname in attnames))
+
+
+def _iter_chunks(queryset, chunk_size=None):
+    # Rows are paginated by primary key, so that the files of each chunk can be
+    # generated (and the rows updated) between queries.
+    chunk_size = chunk_size or settings.IMAGEKIT_BULK_CHUNK_SIZE
+    if not queryset.query.can_filter():
+        # The queryset is sliced.
+        instances = list(queryset)
+        for i in range(0, len(instances), chunk_size):
+            yield instances[i:i + chunk_size]
+        return
+    queryset = queryset.order_by('pk')
+    last_pk = None
+    while True:
+        chunk = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        chunk = list(chunk[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last_pk = chunk[-1].pk
+
+
+def _get_source_groups(model, spec_ids):
+    source_groups = []
+    for source_group, ids in source_group_registry.get_model_source_groups(
+            model):
+        if spec_ids is not None:
+            ids = ids.intersection(spec_ids)
+        if ids:
+            source_groups.append((source_group, sorted(ids)))
+    return source_groups
+
+
+def _get_file_groups(instances, model, spec_ids):
+    """
+    Returns a list of ``(source, files)`` pairs for the cache files of the
+    instances, grouping the files of each source.
+
+    """
+    groups = OrderedDict()
+    source_groups = _get_source_groups(model, spec_ids)
+    for instance in instances:
+        for source_group, ids in source_groups:
+            get_source = getattr(source_group, 'get_source', None)
+            if get_source is None:
+                source = getattr(instance, source_group.image_field)
+            else:
+                source = get_source(instance)
+            if not source:
+                continue
+            files = [ImageCacheFile(generator_registry.get(id, source=source))
+                     for id in ids]
+            groups.setdefault(id(source), (source, []))[1].extend(
+                file for file in files if file.name)
+    return [(source, files) for source, files in groups.values() if files]
+
+
+def _generate_files(source, files, force):
+    count = 0
+    if not files:
+        return count
+    with share_source_image(source):
+        share_processor_prefixes(source, [file.generator for file in files])
+        for file in files:
+            try:
+                file.generate(force=force)
+            except Exception:
+                # The backend records the failure; the other files are still
+                # generated.
+                get_logger().exception('Error generating %s' % file.name)
+            else:
+                count += 1
+    return count
@@ -1,13 +1,15 @@
 from copy import copy
 from django.conf import settings
 from django.core.files import File
-from django.core.files.images import ImageFile
+from django.core.files.images import ImageFile, get_image_dimensions
 from django.utils.functional import SimpleLazyObject
 from django.utils.encoding import smart_str
 from ..files import BaseIKFile
+from .backends import CacheFileState
 from ..registry import generator_registry
 from ..signals import content_required, existence_required
-from ..utils import get_logger, get_singleton, generate, get_by_qname
+from ..utils import (get_logger, get_singleton, generate, get_by_qname,
+                     get_content_size, get_cache, sanitize_cache_key, LRUCache)
 
 
 class ImageCacheFile(BaseIKFile, ImageFile):
@@ -82,7 +84,74 @@ class ImageCacheFile(BaseIKFile, ImageFile):
 
     @property
     def url(self):
-        return self._storage_attr('url')
+        if getattr(self, '_file', None) is None:
+            existence_required.send(sender=self, file=self)
+            placeholder = self.get_placeholder_url()
+            if placeholder:
+                return placeholder
+        return self._get_storage_url()
+
+    def get_url_cache_timeout(self):
+        """
+        Returns the number of seconds for which the URL of the file may be
+        cached: the generator's ``cachefile_url_timeout``, the storage's
+        ``imagekit_url_timeout`` or ``IMAGEKIT_URL_CACHE_TIMEOUT``, in that
+        order. ``None`` or ``0`` means that the URL isn't cached.
+
+        """
+        for obj, attr in ((self.generator, 'cachefile_url_timeout'),
+                          (self.storage, 'imagekit_url_timeout')):
+            timeout = getattr(obj, attr, None)
+            if timeout is not None:
+                return timeout
+        return settings.IMAGEKIT_URL_CACHE_TIMEOUT
+
+    def _get_storage_url(self):
+        timeout = self.get_url_cache_timeout()
+        if not timeout:
+            return self.storage.url(self.name)
+        key = get_url_cache_key(self.storage, self.name)
+        url_cache = get_url_cache()
+        url = url_cache.get(key)
+        if url is None:
+            shared = settings.IMAGEKIT_URL_CACHE_SHARED
+            if shared:
+                url = get_cache().get(key)
+            if url is None:
+                url = self.storage.url(self.name)
+                if shared:
+                    get_cache().set(key, url, timeout)
+            url_cache.set(key, url, timeout)
+        return url
+
+    @property
+    def failed(self):
+        """
+        Whether the last attempt to generate this file failed (and the cache
+        file backend isn't ready to retry it yet).
+
+        """
+        should_generate = getattr(self.cachefile_backend, 'should_generate', None)
+        if should_generate is None:
+            return False
+        record = self.cachefile_backend.get_state_record(self, check_if_unknown=False)
+        return (record is not None and record['state'] == CacheFileState.FAILED
+                and not should_generate(record))
+
+    def get_placeholder_url(self):
+        """
+        Returns the URL of an image to use instead of this file if it failed to
+        generate. The cache file strategy can provide one with a
+        ``get_placeholder_url()`` method; otherwise the
+        ``IMAGEKIT_FAILED_PLACEHOLDER_URL`` setting is used. Returns ``None`` if
+        the file didn't fail or there's no placeholder.
+
+        """
+        fn = getattr(self.cachefile_strategy, 'get_placeholder_url', None)
+        placeholder = fn(self) if fn else settings.IMAGEKIT_FAILED_PLACEHOLDER_URL
+        if placeholder and self.failed:
+            return placeholder
+        return None
 
     def generate(self, force=False):
         """
@@ -94,19 +163,33 @@ class ImageCacheFile(BaseIKFile, ImageFile):
             self.cachefile_backend.generate(self, force)
 
     def _generate(self):
+        """
+        Generates and saves the file. Returns a dictionary with the dimensions
+        and size of the file, which the cache file backend records along with
+        its state so that they can be known without opening the file.
+
+        """
         # Generate the file
         content = generate(self.generator)
+        # Reading the dimensions from the generated content only parses its
+        # header, which is already in memory.
+        width, height = get_image_dimensions(content, close=False)
+        info = {'width': width, 'height': height,
+                'size': get_content_size(content)}
 
         actual_name = self.storage.save(self.name, content)
 
-        # We're going to reuse the generated file, so we need to reset the pointer.
-        content.seek(0)
+        if settings.IMAGEKIT_RETAIN_GENERATED_CONTENT:
+            # We're going to reuse the generated file, so we need to reset the pointer.
+            content.seek(0)
 
-        # Store the generated file. If we don't do this, the next time the
-        # "file" attribute is accessed, it will result in a call to the storage
-        # backend (in ``BaseIKFile._get_file``). Since we already have the
-        # contents of the file, what would the point of that be?
-        self.file = File(content)
+            # Store the generated file. If we don't do this, the next time the
+            # "file" attribute is accessed, it will result in a call to the storage
+            # backend (in ``BaseIKFile._get_file``). Since we already have the
+            # contents of the file, what would the point of that be?
+            self.file = File(content)
+        else:
+            content.close()
 
         if actual_name != self.name:
             get_logger().warning(
@@ -121,6 +204,63 @@ class ImageCacheFile(BaseIKFile, ImageFile):
                     self.cachefile_backend
                 )
             )
+            return None
+        if width is None:
+            del info['width'], info['height']
+        return info
+
+    def _get_recorded_info(self, *keys):
+        """
+        Returns the values of ``keys`` that the cache file backend recorded
+        along with the file's state when it was generated (see
+        ``_generate()``), or ``None`` if they weren't recorded.
+
+        """
+        if getattr(self, '_file', None) is None and self.name:
+            # Give the strategy a chance to create the file.
+            existence_required.send(sender=self, file=self)
+        return self._get_state_info(keys)
+
+    def _get_state_info(self, keys):
+        get_state_record = getattr(self.cachefile_backend, 'get_state_record',
+                                   None)
+        if get_state_record is None or not self.name:
+            return None
+        record = get_state_record(self, check_if_unknown=False)
+        if (record is None or record['state'] != CacheFileState.EXISTS
+                or any(key not in record for key in keys)):
+            return None
+        return tuple(record[key] for key in keys)
+
+    def predict_dimensions(self):
+        """
+        Returns the dimensions of the file if they're known without generating
+        or opening it: recorded with its state or predicted by its generator
+        (see ``ImageSpec.predict_dimensions()``). Returns ``None`` otherwise.
+
+        """
+        dimensions = getattr(self, '_dimensions_cache', None)
+        if dimensions is None:
+            # Recorded dimensions are exact, and usually cached locally.
+            dimensions = self._get_state_info(('width', 'height'))
+        if dimensions is None:
+            predict = getattr(self.generator, 'predict_dimensions', None)
+            dimensions = predict() if predict is not None else None
+        return dimensions
+
+    def _get_image_dimensions(self):
+        if not hasattr(self, '_dimensions_cache'):
+            dimensions = self._get_recorded_info('width', 'height')
+            if dimensions is not None:
+                self._dimensions_cache = dimensions
+        return super(ImageCacheFile, self)._get_image_dimensions()
+
+    @property
+    def size(self):
+        size = self._get_recorded_info('size')
+        if size is not None:
+            return size[0]
+        return super(ImageCacheFile, self).size
 
     def __bool__(self):
         if not self.name:
@@ -144,6 +284,9 @@ class ImageCacheFile(BaseIKFile, ImageFile):
         # file is hidden link to "file" attribute
         state.pop('_file', None)
 
+        # A prefetched state is only a snapshot for the current process.
+        state.pop('_prefetched_state', None)
+
         return state
 
     def __nonzero__(self):
@@ -156,6 +299,80 @@ class ImageCacheFile(BaseIKFile, ImageFile):
         )
 
 
+_url_cache = None
+
+
+def get_url_cache():
+    """
+    Returns the in-process cache of the URLs of cache files (see
+    ``IMAGEKIT_URL_CACHE_TIMEOUT``).
+
+    """
+    global _url_cache
+    if _url_cache is None:
+        _url_cache = LRUCache(settings.IMAGEKIT_URL_CACHE_SIZE)
+    return _url_cache
+
+
+def get_url_cache_key(storage, name):
+    """
+    Returns the key under which the URL of a file is cached. Storages are
+    identified by their class and the attributes that usually determine their
+    URLs; a storage can provide its own identifier with an
+    ``imagekit_cache_key`` attribute.
+
+    """
+    storage_key = getattr(storage, 'imagekit_cache_key', None)
+    if storage_key is None:
+        cls = storage.__class__
+        storage_key = '%s.%s%r' % (cls.__module__, cls.__name__, tuple(
+            getattr(storage, attr, None) for attr in
+            ('base_url', 'location', 'bucket_name', 'custom_domain')))
+    return sanitize_cache_key('%surl:%s:%s' % (
+        settings.IMAGEKIT_CACHE_PREFIX, storage_key, name))
+
+
+def prefetch_states(files, check_if_unknown=True):
+    """
+    Look up the states of many cache files at once and remember them on the
+    files, so that checking their truthiness (or generating them) doesn't
+    require a cache lookup per file. Files are grouped by cache file backend
+    and each group is resolved with the backend's ``get_states()`` method, if it
+    has one. Returns a dictionary mapping file names to states, which can also
+    be given to the template tags (see ``imagekit.templatetags.imagekit``).
+
+    """
+    by_backend = {}
+    for file in files:
+        if file.name:
+            backend = file.cachefile_backend
+            by_backend.setdefault(id(backend), (backend, []))[1].append(file)
+
+    states = {}
+    for backend, backend_files in by_backend.values():
+        get_state_records = getattr(backend, 'get_state_records', None)
+        if get_state_records is None:
+            continue
+        for file, record in zip(backend_files, get_state_records(
+                backend_files, check_if_unknown=check_if_unknown)):
+            if record is not None:
+                file._prefetched_state = record
+                states[file.name] = record['state']
+    return states
+
+
+def use_prefetched_state(file, states):
+    """
+    Give a cache file the state found for its name in ``states`` (a dictionary
+    returned by ``prefetch_states()``), if there is one.
+
+    """
+    state = states.get(file.name) if states and file.name else None
+    if state is not None:
+        file._prefetched_state = state
+    return file
+
+
 class LazyImageCacheFile(SimpleLazyObject):
     def __init__(self, generator_id, *args, **kwargs):
         def setup():
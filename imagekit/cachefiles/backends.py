@@ -1,14 +1,40 @@
-from ..utils import get_singleton, get_cache, sanitize_cache_key
+from ..utils import (get_by_qname, get_singleton, get_cache,
+                     sanitize_cache_key, LRUCache, get_logger)
+import atexit
+import six
+import threading
+import time
+import uuid
 import warnings
+from collections import OrderedDict
+from contextlib import contextmanager
 from copy import copy
 from django.core.exceptions import ImproperlyConfigured
 from django.conf import settings
+from six.moves import queue
+
+
+_lock_stats_lock = threading.Lock()
+_batch = threading.local()
 
 
 class CacheFileState(object):
     EXISTS = 'exists'
     GENERATING = 'generating'
     DOES_NOT_EXIST = 'does_not_exist'
+    FAILED = 'failed'
+
+
+def to_state_record(value):
+    """
+    Cache file states are stored either as plain strings or, when information
+    is recorded along with them, as dictionaries with a ``'state'`` key. This
+    function normalizes both to a dictionary (or ``None`` for unknown states).
+
+    """
+    if value is None or isinstance(value, dict):
+        return value
+    return {'state': value}
 
 
 def get_default_cachefile_backend():
@@ -39,6 +65,23 @@ class AbstractCacheFileBackend(object):
         raise NotImplementedError
 
 
+def _get_exception_classes(exceptions):
+    classes = []
+    for exception in exceptions:
+        if isinstance(exception, six.string_types):
+            if '.' not in exception:
+                exception = getattr(six.moves.builtins, exception)
+            else:
+                try:
+                    exception = get_by_qname(exception, 'exception')
+                except ImproperlyConfigured:
+                    # Older versions of Pillow don't define all of the
+                    # default ones.
+                    continue
+        classes.append(exception)
+    return tuple(classes)
+
+
 class CachedFileBackend(object):
     existence_check_timeout = 5
     """
@@ -50,52 +93,391 @@ class CachedFileBackend(object):
 
     """
 
+    generation_lock = None
+    """
+    Whether to make sure that only one process generates a given file at a
+    time. The lock is acquired with an atomic ``cache.add()``, so it works
+    across processes and machines as long as they share the cache. Defaults to
+    ``IMAGEKIT_GENERATION_LOCK``.
+
+    """
+
+    generation_lock_timeout = None
+    """
+    The number of seconds after which a generation lock expires, so that a
+    crashed process can't block the generation of a file forever. Defaults to
+    ``IMAGEKIT_GENERATION_LOCK_TIMEOUT``.
+
+    """
+
+    generation_lock_wait = None
+    """
+    The maximum number of seconds to wait for another process to finish
+    generating a file. Defaults to ``IMAGEKIT_GENERATION_LOCK_WAIT``.
+
+    """
+
+    generation_lock_poll_interval = 0.1
+    """
+    The number of seconds between checks while waiting for another process to
+    finish generating a file.
+
+    """
+
+    failure_exceptions = None
+    """
+    The exception classes (or their dotted paths) that mark a file as failed
+    when they're raised while generating it. Defaults to
+    ``IMAGEKIT_FAILURE_EXCEPTIONS``.
+
+    """
+
     @property
     def cache(self):
         if not getattr(self, '_cache', None):
             self._cache = get_cache()
         return self._cache
 
+    @property
+    def local_cache(self):
+        """
+        An in-process cache that sits in front of ``cache`` and remembers which
+        files exist for ``IMAGEKIT_LOCAL_STATE_CACHE_TIMEOUT`` seconds, so that
+        hot files don't require a cache query every time they're used. It's
+        disabled (``None``) unless ``IMAGEKIT_LOCAL_STATE_CACHE_SIZE`` is set.
+
+        """
+        if getattr(self, '_local_cache', None) is None:
+            if not settings.IMAGEKIT_LOCAL_STATE_CACHE_SIZE:
+                return None
+            self._local_cache = LRUCache(
+                settings.IMAGEKIT_LOCAL_STATE_CACHE_SIZE,
+                settings.IMAGEKIT_LOCAL_STATE_CACHE_TIMEOUT)
+        return self._local_cache
+
+    def get_local_cache_stats(self):
+        local_cache = self.local_cache
+        return local_cache.stats() if local_cache is not None else {}
+
     def get_key(self, file):
         from django.conf import settings
         return sanitize_cache_key('%s%s-state' %
                                   (settings.IMAGEKIT_CACHE_PREFIX, file.name))
 
+    def get_lock_key(self, file):
+        from django.conf import settings
+        return sanitize_cache_key('%s%s-lock' %
+                                  (settings.IMAGEKIT_CACHE_PREFIX, file.name))
+
     def get_state(self, file, check_if_unknown=True):
+        record = self.get_state_record(file, check_if_unknown)
+        return record and record['state']
+
+    def get_state_record(self, file, check_if_unknown=True):
+        """
+        Like ``get_state()``, but returns a dictionary containing the state
+        (under the ``'state'`` key) along with any information that was
+        recorded with it, or ``None`` if the state isn't known.
+
+        """
+        record = to_state_record(getattr(file, '_prefetched_state', None))
+        if record is not None:
+            return record
         key = self.get_key(file)
-        state = self.cache.get(key)
-        if state is None and check_if_unknown:
+        local_cache = self.local_cache
+        if local_cache is not None:
+            record = local_cache.get(key)
+            if record is not None:
+                return record
+        record = to_state_record(self.cache.get(key))
+        if record is None and check_if_unknown:
             exists = self._exists(file)
             state = CacheFileState.EXISTS if exists else CacheFileState.DOES_NOT_EXIST
             self.set_state(file, state)
-        return state
+            record = {'state': state}
+        elif record and record['state'] == CacheFileState.EXISTS and local_cache is not None:
+            local_cache.set(key, record)
+        return record
 
-    def set_state(self, file, state):
-        key = self.get_key(file)
-        if state == CacheFileState.DOES_NOT_EXIST:
-            self.cache.set(key, state, self.existence_check_timeout)
-        else:
-            self.cache.set(key, state, settings.IMAGEKIT_CACHE_TIMEOUT)
+    def get_states(self, files, check_if_unknown=True):
+        """
+        Get the states of several files at once. The cache is queried with a
+        single ``get_many()`` call and, if ``check_if_unknown`` is ``True``, the
+        existence of all of the files whose states aren't known is checked in
+        one batch. Returns a list of states in the same order as ``files``.
+
+        """
+        return [record and record['state'] for record in
+                self.get_state_records(files, check_if_unknown)]
+
+    def get_state_records(self, files, check_if_unknown=True):
+        """
+        Like ``get_states()``, but returns state records (see
+        ``get_state_record()``).
+
+        """
+        files = list(files)
+        records = [to_state_record(getattr(file, '_prefetched_state', None))
+                   for file in files]
+        keys = dict((i, self.get_key(file)) for i, file in enumerate(files)
+                    if records[i] is None)
+        local_cache = self.local_cache
+        if local_cache is not None:
+            for i, key in list(keys.items()):
+                records[i] = local_cache.get(key)
+                if records[i] is not None:
+                    del keys[i]
+        if keys:
+            cached = self.cache.get_many(list(set(keys.values())))
+            for i, key in keys.items():
+                records[i] = to_state_record(cached.get(key))
+                if (records[i] and records[i]['state'] == CacheFileState.EXISTS
+                        and local_cache is not None):
+                    local_cache.set(key, records[i])
+
+        if check_if_unknown:
+            unknown = [i for i, record in enumerate(records) if record is None]
+            if unknown:
+                existence = self._exists_many([files[i] for i in unknown])
+                for i, exists in zip(unknown, existence):
+                    records[i] = {'state': CacheFileState.EXISTS if exists
+                                  else CacheFileState.DOES_NOT_EXIST}
+                self.set_states([files[i] for i in unknown],
+                                [records[i]['state'] for i in unknown])
+        return records
+
+    def set_state(self, file, state, **info):
+        """
+        Set the state of the file. Any keyword arguments are recorded along
+        with the state (see ``get_state_record()``).
+
+        """
+        record = dict(info, state=state)
+        self.set_states([file], [record])
+
+    def set_states(self, files, states):
+        """
+        Set the states of several files at once, using (at most) one
+        ``set_many()`` call per cache timeout. Each state may be a state
+        record instead of a plain state.
+
+        """
+        missing, present = {}, {}
+        for file, state in zip(files, states):
+            record = to_state_record(state)
+            if getattr(file, '_prefetched_state', None) is not None:
+                file._prefetched_state = record
+            key = self.get_key(file)
+            self._update_local_cache(key, record)
+            values = (missing if record['state'] == CacheFileState.DOES_NOT_EXIST
+                      else present)
+            # Plain states are stored as strings, as they always have been.
+            values[key] = record if len(record) > 1 else record['state']
+        if missing:
+            self.cache.set_many(missing, self.existence_check_timeout)
+        if present:
+            self.cache.set_many(present, settings.IMAGEKIT_CACHE_TIMEOUT)
+
+    def _update_local_cache(self, key, record):
+        local_cache = self.local_cache
+        if local_cache is not None:
+            if record['state'] == CacheFileState.EXISTS:
+                local_cache.set(key, record)
+            else:
+                local_cache.delete(key)
 
     def __getstate__(self):
         state = copy(self.__dict__)
         # Don't include the cache when pickling. It'll be reconstituted based
         # on the settings.
         state.pop('_cache', None)
+        state.pop('_local_cache', None)
+        # Lock statistics only make sense for the current process.
+        state.pop('_lock_stats', None)
         return state
 
     def exists(self, file):
         return self.get_state(file) == CacheFileState.EXISTS
 
+    def exists_many(self, files):
+        return [state == CacheFileState.EXISTS for state in self.get_states(files)]
+
+    def _exists_many(self, files):
+        return [self._exists(file) for file in files]
+
     def generate(self, file, force=False):
         raise NotImplementedError
 
     def generate_now(self, file, force=False):
-        if force or self.get_state(file) not in (CacheFileState.GENERATING, CacheFileState.EXISTS):
-            self.set_state(file, CacheFileState.GENERATING)
-            file._generate()
-            self.set_state(file, CacheFileState.EXISTS)
-            file.close()
+        # Forced generations don't need to know whether the file exists, but
+        # the number of failed attempts is kept.
+        record = self._get_state_record(file, check_if_unknown=not force)
+        if force or self.should_generate(record):
+            token = None
+            if self._uses_generation_lock():
+                token = self.acquire_lock(file)
+                if token is None:
+                    self._handle_lock_contention(file)
+                    return
+                if not force and self._get_cached_state(file) == CacheFileState.EXISTS:
+                    # Somebody else generated the file while we were getting
+                    # the lock.
+                    self.release_lock(file, token)
+                    return
+            try:
+                self.set_state(file, CacheFileState.GENERATING)
+                try:
+                    # The file may return information (like its dimensions)
+                    # to record along with its state.
+                    info = file._generate()
+                except Exception as err:
+                    if self.is_failure(err):
+                        self.set_failed(file, err, record)
+                    else:
+                        # The error may be transient (like those of storages),
+                        # so the file is generated again when it's needed.
+                        self.set_state(file, CacheFileState.DOES_NOT_EXIST)
+                    raise
+                self.set_state(file, CacheFileState.EXISTS, **(info or {}))
+                file.close()
+            finally:
+                if token is not None:
+                    self.release_lock(file, token)
+
+    def _get_state_record(self, file, check_if_unknown=True):
+        # Backends that override ``get_state()`` are consulted through it, so
+        # that they don't need to implement ``get_state_record()`` too.
+        get_state = six.get_unbound_function(type(self).get_state)
+        if get_state is not six.get_unbound_function(CachedFileBackend.get_state):
+            return to_state_record(self.get_state(file, check_if_unknown))
+        return self.get_state_record(file, check_if_unknown)
+
+    def should_generate(self, record):
+        """
+        Whether a file with the given state record needs to be generated. Files
+        that failed to generate are only retried once their backoff period is
+        over.
+
+        """
+        state = record and record['state']
+        if state == CacheFileState.FAILED:
+            return record.get('retry_at', 0) <= time.time()
+        return state not in (CacheFileState.GENERATING, CacheFileState.EXISTS)
+
+    def set_failed(self, file, error, previous_record=None):
+        """
+        Record that generating the file failed. The number of attempts is
+        tracked so that retries can back off exponentially, starting with
+        ``IMAGEKIT_FAILURE_BACKOFF`` seconds and going up to
+        ``IMAGEKIT_FAILURE_BACKOFF_MAX``.
+
+        """
+        attempts = 1
+        if previous_record and previous_record['state'] == CacheFileState.FAILED:
+            attempts = previous_record.get('attempts', 0) + 1
+        backoff = min(settings.IMAGEKIT_FAILURE_BACKOFF * 2 ** (attempts - 1),
+                      settings.IMAGEKIT_FAILURE_BACKOFF_MAX)
+        error_class = error.__class__
+        self.set_state(file, CacheFileState.FAILED,
+                       error='%s.%s' % (error_class.__module__, error_class.__name__),
+                       attempts=attempts,
+                       retry_at=time.time() + backoff)
+
+    def is_failure(self, error):
+        """
+        Whether an error raised while generating a file means that the file
+        can't be generated (as opposed to a transient error, like those of
+        storages), so that it's marked as failed. The errors are given by
+        ``failure_exceptions``.
+
+        """
+        exceptions = self.failure_exceptions
+        if exceptions is None:
+            exceptions = settings.IMAGEKIT_FAILURE_EXCEPTIONS
+        return isinstance(error, _get_exception_classes(exceptions))
+
+    def _get_cached_state(self, file):
+        record = to_state_record(self.cache.get(self.get_key(file)))
+        return record and record['state']
+
+    def _uses_generation_lock(self):
+        if self.generation_lock is None:
+            return settings.IMAGEKIT_GENERATION_LOCK
+        return self.generation_lock
+
+    def acquire_lock(self, file):
+        """
+        Try to acquire the generation lock for the file. Returns a token that
+        must be passed to ``release_lock()`` if the lock was acquired, and
+        ``None`` otherwise.
+
+        """
+        timeout = self.generation_lock_timeout
+        if timeout is None:
+            timeout = settings.IMAGEKIT_GENERATION_LOCK_TIMEOUT
+        token = uuid.uuid4().hex
+        if self.cache.add(self.get_lock_key(file), token, timeout):
+            self._count_lock_event('acquired')
+            return token
+        self._count_lock_event('contended')
+        return None
+
+    def release_lock(self, file, token):
+        key = self.get_lock_key(file)
+        # Don't release a lock that expired and was acquired by somebody else.
+        if self.cache.get(key) == token:
+            self.cache.delete(key)
+
+    def _handle_lock_contention(self, file):
+        """
+        Called when another process holds the generation lock for the file.
+        Unless the cache file strategy says it doesn't need the file right away
+        (via a ``should_wait_for_generation()`` method), wait for the other
+        process to finish, up to ``generation_lock_wait`` seconds.
+
+        """
+        should_wait = getattr(file.cachefile_strategy,
+                              'should_wait_for_generation', None)
+        if should_wait is not None and not should_wait(file):
+            self._count_lock_event('skipped')
+            return
+
+        max_wait = self.generation_lock_wait
+        if max_wait is None:
+            max_wait = settings.IMAGEKIT_GENERATION_LOCK_WAIT
+        deadline = time.time() + max_wait
+        key, lock_key = self.get_key(file), self.get_lock_key(file)
+        while True:
+            record = to_state_record(self.cache.get(key))
+            if record and record['state'] == CacheFileState.EXISTS:
+                if getattr(file, '_prefetched_state', None) is not None:
+                    file._prefetched_state = record
+                self._count_lock_event('waited')
+                return
+            if self.cache.get(lock_key) is None:
+                # The other process gave up (or its lease expired).
+                self._count_lock_event('abandoned')
+                return
+            if time.time() >= deadline:
+                self._count_lock_event('wait_timeouts')
+                return
+            time.sleep(self.generation_lock_poll_interval)
+
+    def _count_lock_event(self, name):
+        with _lock_stats_lock:
+            stats = self.__dict__.setdefault('_lock_stats', {})
+            stats[name] = stats.get(name, 0) + 1
+
+    def get_lock_stats(self):
+        """
+        Returns a dictionary of counters describing the generation lock
+        activity in this process: how many times the lock was ``acquired`` or
+        ``contended``, and how the contended generations ended (``waited`` for
+        the file, ``skipped`` without waiting, ``abandoned`` by the lock
+        holder or ended in ``wait_timeouts``).
+
+        """
+        return dict(getattr(self, '_lock_stats', {}))
 
 
 class Simple(CachedFileBackend):
@@ -112,32 +494,204 @@ class Simple(CachedFileBackend):
         return bool(getattr(file, '_file', None)
                     or file.storage.exists(file.name))
 
+    def _exists_many(self, files):
+        """
+        Check the existence of several files, grouping them by storage. Storage
+        backends that can check many names at once may do so by defining an
+        ``exists_many(names)`` method that returns a boolean for each name;
+        otherwise, each unique name is checked with ``exists()``.
+
+        """
+        results = {}
+        by_storage = {}
+        for file in files:
+            if getattr(file, '_file', None):
+                results[(id(file.storage), file.name)] = True
+            else:
+                names = by_storage.setdefault(id(file.storage), (file.storage, []))[1]
+                if file.name not in names:
+                    names.append(file.name)
+
+        for storage_id, (storage, names) in by_storage.items():
+            exists_many = getattr(storage, 'exists_many', None)
+            if exists_many is not None:
+                existence = exists_many(names)
+            else:
+                existence = [storage.exists(name) for name in names]
+            for name, exists in zip(names, existence):
+                results.setdefault((storage_id, name), bool(exists))
+
+        return [results[(id(file.storage), file.name)] for file in files]
+
 
 def _generate_file(backend, file, force=False):
+    # Tasks used to be sent with pickled backends and files. This is kept so
+    # that tasks queued by older versions can still be run.
     backend.generate_now(file, force=force)
 
 
+def _run_job(job):
+    from .jobs import run
+    run(job)
+
+
+def _run_batch(jobs):
+    from .jobs import run_batch
+    run_batch(jobs)
+
+
+def begin_batch():
+    """
+    Start buffering the files scheduled by asynchronous backends in the
+    current thread. Batches can be nested; the files are only scheduled when
+    the outermost batch ends.
+
+    """
+    depth = getattr(_batch, 'depth', 0)
+    if not depth:
+        _batch.pending = OrderedDict()
+    _batch.depth = depth + 1
+
+
+def end_batch(on_commit=True):
+    """
+    End the current batch. If it was the outermost one, the buffered files are
+    handed to their backends' ``schedule_batch()`` method--right away or, if
+    ``on_commit`` is true and the database supports it, once the current
+    transaction is committed (so that workers can see the changes made by
+    it). If the transaction is rolled back, the files aren't scheduled.
+
+    """
+    depth = getattr(_batch, 'depth', 0)
+    if not depth:
+        return
+    _batch.depth = depth - 1
+    if depth > 1:
+        return
+    pending, _batch.pending = _batch.pending, None
+    if not pending:
+        return
+
+    def flush():
+        for backend, files in pending.values():
+            forced = [file for file, force in files.values() if force]
+            unforced = [file for file, force in files.values() if not force]
+            if forced:
+                backend.schedule_batch(forced, force=True)
+            if unforced:
+                backend.schedule_batch(unforced)
+
+    from django.db import transaction
+    defer = getattr(transaction, 'on_commit', None)  # Django >= 1.9
+    if on_commit and defer is not None:
+        defer(flush)
+    else:
+        flush()
+
+
+def end_all_batches(on_commit=True):
+    """
+    End all of the current thread's batches, scheduling the files they
+    buffered (see :func:`end_batch`), in case some of them were never ended.
+
+    """
+    while getattr(_batch, 'depth', 0):
+        end_batch(on_commit=on_commit)
+
+
+@contextmanager
+def batch_generation(on_commit=True):
+    """
+    A context manager that buffers the files scheduled by asynchronous
+    backends (like ``Celery`` and ``RQ``) and schedules them together when the
+    block exits, so that rendering many new thumbnails results in a few
+    batched tasks instead of one task per file::
+
+        with batch_generation():
+            for photo in photos:
+                urls.append(photo.thumbnail.url)
+
+    See :func:`end_batch` for the meaning of ``on_commit``. To batch the files
+    scheduled while handling requests, use
+    ``imagekit.middleware.BatchGenerationMiddleware``.
+
+    """
+    begin_batch()
+    try:
+        yield
+    finally:
+        end_batch(on_commit=on_commit)
+
+
+def _buffer_generation(backend, file, force):
+    pending = getattr(_batch, 'pending', None)
+    if pending is None:
+        return False
+    files = pending.setdefault(id(backend), (backend, OrderedDict()))[1]
+    previous = files.get(file.name)
+    files[file.name] = (file, force or bool(previous and previous[1]))
+    return True
+
+
 class BaseAsync(Simple):
     """
     Base class for cache file backends that generate files asynchronously.
     """
     is_async = True
 
+    batch_size = None
+    """
+    The maximum number of jobs sent in one batched task. Defaults to
+    ``IMAGEKIT_ASYNC_BATCH_SIZE``.
+
+    """
+
     def generate(self, file, force=False):
         # Schedule the file for generation, unless we know for sure we don't
         # need to. If an already-generated file sneaks through, that's okay;
         # ``generate_now`` will catch it. We just want to make sure we don't
         # schedule anything we know is unnecessary--but we also don't want to
         # force a costly existence check.
-        state = self.get_state(file, check_if_unknown=False)
-        if state not in (CacheFileState.GENERATING, CacheFileState.EXISTS):
-            self.schedule_generation(file, force=force)
+        record = self._get_state_record(file, check_if_unknown=False)
+        if self.should_generate(record):
+            if not _buffer_generation(self, file, force):
+                self.schedule_generation(file, force=force)
 
     def schedule_generation(self, file, force=False):
         # overwrite this to have the file generated in the background,
         # e. g. in a worker queue.
         raise NotImplementedError
 
+    def schedule_batch(self, files, force=False):
+        """
+        Schedule several files at once. By default, each file is scheduled
+        separately; backends that send tasks to a queue override this to send
+        them in batches (see :meth:`get_job_batches`).
+
+        """
+        for file in files:
+            self.schedule_generation(file, force=force)
+
+    def get_job_batches(self, files, force=False):
+        """
+        Describe the files as jobs and split them into batches of at most
+        ``batch_size`` jobs, keeping the jobs for the same source together.
+        Files that can't be described as jobs are scheduled separately.
+
+        """
+        from .jobs import describe
+        by_source = OrderedDict()
+        for file in files:
+            job = describe(file, force=force)
+            if job is None:
+                self.schedule_generation(file, force=force)
+            else:
+                by_source.setdefault(repr(job['source']), []).append(job)
+
+        jobs = [job for group in by_source.values() for job in group]
+        size = self.batch_size or settings.IMAGEKIT_ASYNC_BATCH_SIZE
+        return [jobs[i:i + size] for i in range(0, len(jobs), size)]
+
 
 try:
     from celery import task
@@ -145,6 +699,8 @@ except ImportError:
     pass
 else:
     _celery_task = task(ignore_result=True, serializer='pickle')(_generate_file)
+    _celery_job_task = task(ignore_result=True, serializer='pickle')(_run_job)
+    _celery_batch_task = task(ignore_result=True, serializer='pickle')(_run_batch)
 
 
 class Celery(BaseAsync):
@@ -160,7 +716,16 @@ class Celery(BaseAsync):
         super(Celery, self).__init__(*args, **kwargs)
 
     def schedule_generation(self, file, force=False):
-        _celery_task.delay(self, file, force=force)
+        from .jobs import describe
+        job = describe(file, force=force)
+        if job is None:
+            _celery_task.delay(self, file, force=force)
+        else:
+            _celery_job_task.delay(job)
+
+    def schedule_batch(self, files, force=False):
+        for jobs in self.get_job_batches(files, force=force):
+            _celery_batch_task.delay(jobs)
 
 
 # Stub class to preserve backwards compatibility and issue a warning
@@ -177,6 +742,8 @@ except ImportError:
     pass
 else:
     _rq_job = job('default', result_ttl=0)(_generate_file)
+    _rq_job_job = job('default', result_ttl=0)(_run_job)
+    _rq_batch_job = job('default', result_ttl=0)(_run_batch)
 
 
 class RQ(BaseAsync):
@@ -192,4 +759,285 @@ class RQ(BaseAsync):
         super(RQ, self).__init__(*args, **kwargs)
 
     def schedule_generation(self, file, force=False):
-        _rq_job.delay(self, file, force=force)
+        from .jobs import describe
+        job = describe(file, force=force)
+        if job is None:
+            _rq_job.delay(self, file, force=force)
+        else:
+            _rq_job_job.delay(job)
+
+    def schedule_batch(self, files, force=False):
+        for jobs in self.get_job_batches(files, force=force):
+            _rq_batch_job.delay(jobs)
+
+
+class ThreadPool(BaseAsync):
+    """
+    A backend that generates the images in a pool of background threads in the
+    current process, so that no task queue is required. Files that are already
+    waiting to be generated aren't scheduled again. If the queue is full, the
+    file is generated synchronously.
+
+    """
+    workers = None
+    """
+    The number of worker threads. Defaults to
+    ``IMAGEKIT_THREADPOOL_WORKERS``.
+
+    """
+
+    max_queue_size = None
+    """
+    The maximum number of files waiting to be generated. Defaults to
+    ``IMAGEKIT_THREADPOOL_QUEUE_SIZE``.
+
+    """
+
+    shutdown_timeout = 30
+    """
+    The number of seconds to wait for queued files to be generated when the
+    process exits.
+
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(ThreadPool, self).__init__(*args, **kwargs)
+        self._reset()
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        # The names of the scheduled files, mapped to whether their
+        # generation is forced.
+        self._pending = {}
+        self._threads = []
+        self._queue = None
+        self._stop = None
+        self._exit_handler_registered = False
+        self._stats = {
+            'processed': 0,
+            'deduplicated': 0,
+            'overflowed': 0,
+            'max_lag': 0,
+            'total_lag': 0,
+        }
+
+    def schedule_generation(self, file, force=False):
+        with self._lock:
+            if file.name in self._pending:
+                # A forced generation upgrades the one that's queued.
+                self._pending[file.name] = self._pending[file.name] or force
+                self._stats['deduplicated'] += 1
+                return
+            self._start()
+            try:
+                self._queue.put_nowait((file, force, time.time()))
+            except queue.Full:
+                self._stats['overflowed'] += 1
+                overflowed = True
+            else:
+                self._pending[file.name] = force
+                overflowed = False
+        if overflowed:
+            self.generate_now(file, force=force)
+
+    def _start(self):
+        if self._threads:
+            return
+        workers = self.workers or settings.IMAGEKIT_THREADPOOL_WORKERS
+        max_queue_size = self.max_queue_size
+        if max_queue_size is None:
+            max_queue_size = settings.IMAGEKIT_THREADPOOL_QUEUE_SIZE
+        self._queue = queue.Queue(max_queue_size)
+        self._stop = threading.Event()
+        for i in range(workers):
+            thread = threading.Thread(target=self._work,
+                                      args=(self._queue, self._stop),
+                                      name='imagekit-generator-%s' % i)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+        if not self._exit_handler_registered:
+            atexit.register(self.shutdown)
+            self._exit_handler_registered = True
+
+    def _work(self, work_queue, stop):
+        from django.db import close_old_connections
+        while not stop.is_set():
+            item = work_queue.get()
+            if item is None:
+                work_queue.task_done()
+                return
+            file, force, enqueued_at = item
+            lag = time.time() - enqueued_at
+            with self._lock:
+                force = self._pending.get(file.name, force)
+            try:
+                self.generate_now(file, force=force)
+            except Exception:
+                get_logger().exception('Error generating %s' % file.name)
+            finally:
+                close_old_connections()
+                with self._lock:
+                    self._pending.pop(file.name, None)
+                    self._stats['processed'] += 1
+                    self._stats['total_lag'] += lag
+                    self._stats['max_lag'] = max(self._stats['max_lag'], lag)
+                work_queue.task_done()
+
+    def join(self):
+        """
+        Block until all of the scheduled files have been generated.
+
+        """
+        if self._queue is not None:
+            self._queue.join()
+
+    def shutdown(self, timeout=None):
+        """
+        Let the workers finish generating the queued files (waiting at most
+        ``timeout`` seconds, which defaults to ``shutdown_timeout``) and stop
+        them. This is called automatically when the process exits.
+
+        """
+        with self._lock:
+            threads, self._threads = self._threads, []
+        if not threads:
+            return
+        deadline = time.time() + (self.shutdown_timeout if timeout is None
+                                  else timeout)
+        for thread in threads:
+            try:
+                self._queue.put(None, timeout=max(deadline - time.time(), 0))
+            except queue.Full:
+                # The workers are still busy with queued files; they stop
+                # after the file they're generating instead.
+                self._stop.set()
+                break
+        for thread in threads:
+            thread.join(max(deadline - time.time(), 0))
+        if self._stop.is_set():
+            # Forget the files that won't be generated, so that ``join()``
+            # doesn't wait for them.
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not None:
+                    with self._lock:
+                        self._pending.pop(item[0].name, None)
+                self._queue.task_done()
+
+    def get_stats(self):
+        """
+        Returns a dictionary describing the work queue: the number of files
+        waiting in the queue (``queue_depth``), the number of files scheduled
+        but not yet generated (``pending``), the number of files
+        ``processed``, ``deduplicated`` and ``overflowed`` (generated
+        synchronously because the queue was full), and the time files waited in
+        the queue before their generation started (``average_lag`` and
+        ``max_lag``, in seconds).
+
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['pending'] = len(self._pending)
+            stats['queue_depth'] = self._queue.qsize() if self._queue else 0
+        total_lag = stats.pop('total_lag')
+        stats['average_lag'] = (total_lag / stats['processed']
+                                if stats['processed'] else 0)
+        return stats
+
+    def __getstate__(self):
+        state = super(ThreadPool, self).__getstate__()
+        for attr in ('_lock', '_pending', '_threads', '_queue', '_stop',
+                     '_exit_handler_registered', '_stats'):
+            state.pop(attr, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset()
+
+
+class ProcessPool(BaseAsync):
+    """
+    A backend that generates the images in a pool of worker processes (see
+    ``imagekit.cachefiles.jobs.GenerationPool``), so that image processing
+    isn't limited to one core by the GIL. Only a compact description of each
+    file is sent to the workers. Files that can't be described that way (for
+    example, files whose sources aren't in a storage) are generated
+    synchronously.
+
+    """
+    def __init__(self, *args, **kwargs):
+        super(ProcessPool, self).__init__(*args, **kwargs)
+        self._reset()
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._pool = None
+        self._stats = {
+            'processed': 0,
+            'failed': 0,
+            'deduplicated': 0,
+            'synchronous': 0,
+            'total_lag': 0,
+        }
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            from .jobs import GenerationPool
+            self._pool = GenerationPool()
+        return self._pool
+
+    def schedule_generation(self, file, force=False):
+        from .jobs import describe
+        job = describe(file, force=force)
+        if job is None:
+            with self._lock:
+                self._stats['synchronous'] += 1
+            self.generate_now(file, force=force)
+            return
+        with self._lock:
+            if job['name'] in self._pending:
+                self._stats['deduplicated'] += 1
+                return
+            self._pending[job['name']] = time.time()
+        self.pool.submit(job, callback=self._job_done)
+
+    def _job_done(self, job, error):
+        with self._lock:
+            scheduled_at = self._pending.pop(job['name'], None)
+            self._stats['failed' if error else 'processed'] += 1
+            if scheduled_at is not None:
+                self._stats['total_lag'] += time.time() - scheduled_at
+
+    def get_stats(self):
+        """
+        Returns a dictionary describing the work: the number of files
+        scheduled but not yet generated (``pending``), the number of files
+        ``processed``, ``failed``, ``deduplicated`` and generated
+        ``synchronous``-ly, and the average time (in seconds) between
+        scheduling a file and its generation finishing (``average_lag``).
+
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['pending'] = len(self._pending)
+        total_lag = stats.pop('total_lag')
+        done = stats['processed'] + stats['failed']
+        stats['average_lag'] = total_lag / done if done else 0
+        return stats
+
+    def __getstate__(self):
+        state = super(ProcessPool, self).__getstate__()
+        for attr in ('_lock', '_pending', '_pool', '_stats'):
+            state.pop(attr, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset()
@@ -0,0 +1,360 @@
+"""
+Jobs are compact descriptions of the work needed to generate a cache file. They
+can be sent to other processes (worker processes, task queues, etc.) instead of
+pickled cache files, which drag along their generators, processors, source
+files and model instances.
+
+A job is a dictionary containing the id of the generator, the keyword
+arguments it was created with, a description of its source (a model field or a
+name in a storage) and the name of the cache file. The cache file is rebuilt
+from the generator registry by the process that runs the job.
+
+"""
+
+import atexit
+import multiprocessing
+import threading
+from collections import OrderedDict
+from django.conf import settings
+from django.core.files.storage import default_storage
+from ..registry import generator_registry
+from ..utils import (get_singleton, get_logger, share_processor_prefixes,
+                     share_source_image, _singletons)
+
+
+def get_storage_alias(storage):
+    """
+    Returns a string that another process can use to get the same storage, or
+    ``None`` if there is none: ``'default'`` for the default storage, or the
+    qualified class name of storages that were created as singletons (like
+    ``IMAGEKIT_DEFAULT_FILE_STORAGE``).
+
+    """
+    if storage is default_storage or storage is getattr(default_storage, '_wrapped', None):
+        return 'default'
+    cls = storage.__class__
+    if _singletons.get(cls) is storage:
+        return '%s.%s' % (cls.__module__, cls.__name__)
+    return None
+
+
+def get_storage(alias):
+    if alias == 'default':
+        return default_storage
+    return get_singleton(alias, 'file storage backend')
+
+
+def describe_source(source):
+    """
+    Returns a tuple describing where the source file can be found, or ``None``
+    if it can't be described. Files of saved model instances are described by
+    their model, primary key and field name; cache files (the sources of specs
+    derived from other specs) like jobs; other files with a storage by the
+    storage alias and file name.
+
+    """
+    from . import ImageCacheFile
+
+    if isinstance(source, ImageCacheFile):
+        job = describe(source)
+        if job is None:
+            return None
+        return ('cachefile', job['generator'], job['kwargs'], job['source'],
+                job['name'])
+
+    instance = getattr(source, 'instance', None)
+    field = getattr(source, 'field', None)
+    if instance is not None and field is not None and instance.pk is not None:
+        opts = instance._meta
+        return ('field', opts.app_label, opts.object_name, instance.pk,
+                field.attname)
+
+    storage = getattr(source, 'storage', None)
+    name = getattr(source, 'name', None)
+    if storage is not None and name:
+        alias = get_storage_alias(storage)
+        if alias is not None:
+            return ('storage', alias, name)
+    return None
+
+
+def load_source(description):
+    """
+    Returns the source file described by ``describe_source()``, or ``None`` if
+    it no longer exists.
+
+    """
+    from django.apps import apps
+    from django.core.files import File
+
+    kind = description[0]
+    if kind == 'field':
+        app_label, model_name, pk, attname = description[1:]
+        model = apps.get_model(app_label, model_name)
+        try:
+            instance = model._default_manager.get(pk=pk)
+        except model.DoesNotExist:
+            return None
+        return getattr(instance, attname) or None
+    elif kind == 'cachefile':
+        generator_id, kwargs, source, name = description[1:]
+        return load({'generator': generator_id, 'kwargs': kwargs,
+                     'source': source, 'name': name})
+    elif kind == 'storage':
+        alias, name = description[1:]
+        storage = get_storage(alias)
+        source = File(None, name=name)
+        source.storage = storage
+        source.file = storage.open(name, 'rb')
+        return source
+    raise ValueError('Unknown source description: %r' % (description,))
+
+
+def describe(file, force=False):
+    """
+    Returns a job for generating the cache file, or ``None`` if the file can't
+    be described compactly (for example, because its generator wasn't created
+    through the generator registry or its source isn't in a storage).
+
+    """
+    generator = file.generator
+    try:
+        generator_id, kwargs = generator._ik_generator
+    except (AttributeError, ValueError):
+        return None
+
+    source = getattr(generator, 'source', None)
+    source_description = None
+    if source is not None:
+        source_description = describe_source(source)
+        if source_description is None:
+            return None
+
+    return {
+        'generator': generator_id,
+        'kwargs': kwargs,
+        'source': source_description,
+        'name': file.name,
+        'force': force,
+    }
+
+
+def load(job, source=None):
+    """
+    Rebuilds the cache file described by a job. Returns ``None`` if the source
+    no longer exists or has changed in a way that changes the name of the
+    cache file (in which case the job is obsolete). If the source has already
+    been loaded (with ``load_source()``), it can be passed as ``source``.
+
+    """
+    from . import ImageCacheFile
+
+    kwargs = dict(job['kwargs'])
+    if job['source'] is not None:
+        if source is None:
+            source = load_source(job['source'])
+        if source is None:
+            return None
+        kwargs['source'] = source
+    generator = generator_registry.get(job['generator'], **kwargs)
+    file = ImageCacheFile(generator)
+    if file.name != job['name']:
+        return None
+    return file
+
+
+def run(job):
+    """
+    Generates the cache file described by a job. Returns ``True`` if the job
+    was run, or ``False`` if it was obsolete.
+
+    """
+    file = load(job)
+    if file is None:
+        get_logger().info('Skipping obsolete job for %s' % job['name'])
+        return False
+    try:
+        file.cachefile_backend.generate_now(file, force=job['force'])
+    finally:
+        source = getattr(file.generator, 'source', None)
+        if source is not None:
+            source.close()
+    return True
+
+
+class _JobError(object):
+    # The error raised by a job that was run by ``_run_returning_errors()``.
+
+    def __init__(self, error):
+        self.message = '%s: %s' % (error.__class__.__name__, error)
+
+    def __str__(self):
+        return self.message
+
+
+def _run_returning_errors(job):
+    try:
+        return run(job)
+    except Exception as error:
+        return _JobError(error)
+
+
+def run_batch(jobs):
+    """
+    Generates the cache files described by several jobs. The jobs are grouped
+    by source so that each source is loaded and decoded only once. A failed job
+    doesn't prevent the others from running. Returns the number of jobs that
+    were run.
+
+    """
+    groups = OrderedDict()
+    for job in jobs:
+        # Descriptions of cache files contain keyword arguments, which may not
+        # be hashable.
+        key = repr(job['source'])
+        groups.setdefault(key, (job['source'], []))[1].append(job)
+
+    count = 0
+    for description, group in groups.values():
+        source = None
+        if description is not None:
+            source = load_source(description)
+            if source is None:
+                get_logger().info('Skipping %s jobs for missing source %r'
+                                  % (len(group), description))
+                continue
+        try:
+            with share_source_image(source):
+                files = []
+                for job in group:
+                    file = load(job, source=source)
+                    if file is None:
+                        get_logger().info('Skipping obsolete job for %s'
+                                          % job['name'])
+                        continue
+                    files.append((job, file))
+                if source is not None:
+                    share_processor_prefixes(
+                        source, [file.generator for job, file in files])
+                for job, file in files:
+                    try:
+                        file.cachefile_backend.generate_now(file,
+                                                            force=job['force'])
+                    except Exception:
+                        get_logger().exception('Error generating %s'
+                                               % job['name'])
+                    else:
+                        count += 1
+        finally:
+            if source is not None:
+                source.close()
+    return count
+
+
+def _init_worker():
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+
+
+class GenerationPool(object):
+    """
+    Runs jobs in a pool of worker processes, so that image processing can use
+    all of the machine's cores. Worker processes are replaced after running
+    ``max_jobs_per_worker`` jobs, which bounds the memory leaked by image
+    decoders.
+
+    By default, workers are started with the "spawn" method (where available),
+    so that they don't share the parent process's database connections.
+
+    """
+    def __init__(self, processes=None, max_jobs_per_worker=None,
+                 start_method=None):
+        self.processes = processes or settings.IMAGEKIT_PROCESSPOOL_WORKERS
+        self.max_jobs_per_worker = (max_jobs_per_worker
+            or settings.IMAGEKIT_PROCESSPOOL_MAX_JOBS_PER_WORKER)
+        self.start_method = (start_method
+            or settings.IMAGEKIT_PROCESSPOOL_START_METHOD)
+        self._pool = None
+        self._lock = threading.Lock()
+
+    @property
+    def pool(self):
+        with self._lock:
+            if self._pool is None:
+                get_context = getattr(multiprocessing, 'get_context', None)
+                if get_context is not None and self.start_method:
+                    context = get_context(self.start_method)
+                else:
+                    context = multiprocessing
+                self._pool = context.Pool(
+                    self.processes, initializer=_init_worker,
+                    maxtasksperchild=self.max_jobs_per_worker)
+                atexit.register(self.close)
+            return self._pool
+
+    def submit(self, job, callback=None):
+        """
+        Run the job in a worker process. If provided, ``callback`` is called
+        (in the parent process) with the job and the exception raised by the
+        worker, or ``None`` if the job succeeded.
+
+        """
+        def on_success(result):
+            if isinstance(result, _JobError):
+                on_error(result)
+            elif callback is not None:
+                callback(job, None)
+
+        def on_error(error):
+            get_logger().error('Error generating %s: %s' % (job['name'], error))
+            if callback is not None:
+                callback(job, error)
+
+        pool = self.pool
+        try:
+            return pool.apply_async(run, (job,), callback=on_success,
+                                    error_callback=on_error)
+        except TypeError:
+            # Python 2 doesn't support error callbacks, so the errors are
+            # returned to the success callback instead.
+            return pool.apply_async(_run_returning_errors, (job,),
+                                    callback=on_success)
+
+    def map(self, jobs):
+        """
+        Run the jobs in the worker processes and wait for them to finish.
+
+        """
+        return self.pool.map(run, list(jobs))
+
+    def map_batches(self, batches):
+        """
+        Run batches of jobs (see ``run_batch()``) in the worker processes and
+        wait for them to finish. Returns the number of jobs that were run.
+
+        """
+        return sum(self.pool.map(run_batch, [list(jobs) for jobs in batches]))
+
+    def close(self, timeout=None):
+        """
+        Stop accepting jobs and wait (at most ``timeout`` seconds, if given)
+        for the submitted ones to finish before stopping the workers.
+
+        """
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is None:
+            return
+        pool.close()
+        if timeout is None:
+            pool.join()
+        else:
+            # ``Pool.join()`` doesn't accept a timeout, so join in a thread.
+            joiner = threading.Thread(target=pool.join)
+            joiner.daemon = True
+            joiner.start()
+            joiner.join(timeout)
+            if joiner.is_alive():
+                pool.terminate()
@@ -7,7 +7,7 @@ choices.
 
 from django.conf import settings
 import os
-from ..utils import format_to_extension, suggest_extension
+from ..utils import format_to_extension, get_source_digest, suggest_extension
 
 
 def source_name_as_path(generator):
@@ -89,3 +89,30 @@ def hash(generator):
     ext = format_to_extension(format) if format else ''
     return os.path.normpath(os.path.join(settings.IMAGEKIT_CACHEFILE_DIR,
                                          '%s%s' % (generator.get_hash(), ext)))
+
+
+def source_digest(generator):
+    """
+    A namer that, given a source file whose contents have the digest
+    ``3c9a7f1e0b5d4c2a8e6f1d0b9a8c7e6f``, will generate a name like this::
+
+        /path/to/generated/images/3c/3c9a7f1e0b5d4c2a8e6f1d0b9a8c7e6f/5ff3233527c5ac3e4b596343b440ff67.jpg
+
+    where "/path/to/generated/images/" is the value specified by the
+    ``IMAGEKIT_CACHEFILE_DIR`` setting. Since the name doesn't depend on the
+    source's name, sources with identical contents share their cache files.
+    The digest is computed once per file (see
+    :class:`imagekit.models.SourceDigestField`). Generators that aren't
+    specs are named with :func:`hash`.
+
+    """
+    source = getattr(generator, 'source', None)
+    get_hash_for = getattr(generator, 'get_hash_for', None)
+    if not source or get_hash_for is None:
+        return hash(generator)
+
+    digest = get_source_digest(source)
+    ext = suggest_extension(source.name or '', generator.format)
+    return os.path.normpath(os.path.join(
+        settings.IMAGEKIT_CACHEFILE_DIR, digest[:2], digest,
+        '%s%s' % (get_hash_for(digest), ext)))
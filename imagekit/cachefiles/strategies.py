@@ -1,5 +1,7 @@
 import six
+import weakref
 
+from collections import OrderedDict
 from django.utils.functional import LazyObject
 from ..lib import force_text
 from ..utils import get_singleton
@@ -32,6 +34,105 @@ class Optimistic(object):
     def should_verify_existence(self, file):
         return False
 
+    def should_wait_for_generation(self, file):
+        return False
+
+
+class OnCommit(Optimistic):
+    """
+    A strategy that, like ``Optimistic``, generates the cache files of sources
+    when they're saved--but only once the current database transaction has
+    been committed, so that the transaction (and its row locks) doesn't wait
+    for the images to be processed, and nothing is generated if it's rolled
+    back. The files of a transaction are generated together: a file is only
+    generated once per source and spec (however many times the source is
+    saved), the specs of each source share its decoded image, and
+    asynchronous backends schedule the files in a batch.
+
+    Outside of transactions, files are generated right away. The database
+    connection is given by the ``using`` attribute.
+
+    Files that are saved inside a savepoint (a nested ``atomic()`` block) are
+    generated with the other files saved inside it, after those of the
+    enclosing block; if the savepoint is rolled back, they aren't generated.
+
+    """
+    using = None
+
+    def on_source_saved(self, file):
+        from django.db import transaction
+
+        if getattr(transaction, 'on_commit', None) is None:  # Django < 1.9
+            file.generate()
+            return
+        connection = transaction.get_connection(self.using)
+        if not connection.in_atomic_block:
+            file.generate()
+            return
+        # Each savepoint has its own batch, whose hook Django discards if the
+        # savepoint is rolled back. Only the hooks refer to the batches, so
+        # discarded batches (and those of rolled back transactions) are
+        # forgotten along with them.
+        batches = getattr(connection, '_ik_generation_batches', None)
+        if batches is None:
+            batches = connection._ik_generation_batches = \
+                weakref.WeakValueDictionary()
+        key = tuple(sid for sid in connection.savepoint_ids if sid is not None)
+        batch = batches.get(key)
+        if batch is None or batch.done:
+            batch = batches[key] = _GenerationBatch()
+            transaction.on_commit(batch.run, using=self.using)
+        batch.add(file)
+
+
+class _GenerationBatch(object):
+    """
+    The cache files scheduled by the ``OnCommit`` strategy in a transaction
+    (or savepoint).
+
+    """
+    def __init__(self):
+        self.files = OrderedDict()
+        self.done = False
+
+    def add(self, file):
+        # The latest file of a source and spec replaces the earlier ones,
+        # which may be obsolete.
+        self.files[_get_generation_key(file)] = file
+
+    def run(self):
+        from ..bulk import generate_files, update_metadata
+
+        self.done = True
+        files, self.files = list(self.files.values()), OrderedDict()
+        generate_files(files)
+
+        # The metadata fields of the specs were cleared when the sources were
+        # saved, since the files didn't exist yet.
+        by_model = OrderedDict()
+        for file in files:
+            source = getattr(file.generator, 'source', None)
+            instance = getattr(source, 'instance', None)
+            if instance is not None:
+                instances = by_model.setdefault(type(instance), OrderedDict())
+                instances.setdefault(id(instance), instance)
+        for model, instances in by_model.items():
+            update_metadata(list(instances.values()), model)
+
+
+def _get_generation_key(file):
+    from .jobs import describe_source
+
+    generator = file.generator
+    source = getattr(generator, 'source', None)
+    source_key = describe_source(source) if source is not None else None
+    try:
+        generator_id = generator._ik_generator[0]
+    except (AttributeError, IndexError):
+        generator_id = None
+    return (repr(source_key) if source_key is not None else file.name,
+            generator_id or id(generator))
+
 
 class DictStrategy(object):
     def __init__(self, callbacks):
@@ -6,6 +6,7 @@ from django.core.exceptions import ImproperlyConfigured
 class ImageKitConf(AppConf):
     CACHEFILE_NAMER = 'imagekit.cachefiles.namers.hash'
     SPEC_CACHEFILE_NAMER = 'imagekit.cachefiles.namers.source_name_as_path'
+    HASH_FUNCTION = 'md5'
     CACHEFILE_DIR = 'CACHE/images'
     DEFAULT_CACHEFILE_BACKEND = 'imagekit.cachefiles.backends.Simple'
     DEFAULT_CACHEFILE_STRATEGY = 'imagekit.cachefiles.strategies.JustInTime'
@@ -16,6 +17,45 @@ class ImageKitConf(AppConf):
     CACHE_PREFIX = 'imagekit:'
     CACHE_TIMEOUT = None
     USE_MEMCACHED_SAFE_CACHE_KEY = True
+    LOCAL_STATE_CACHE_SIZE = 0
+    LOCAL_STATE_CACHE_TIMEOUT = 5
+    URL_CACHE_TIMEOUT = None
+    URL_CACHE_SHARED = False
+    URL_CACHE_SIZE = 10000
+
+    OUTPUT_MAX_MEMORY_SIZE = 2621440  # 2.5 MB
+
+    MAX_SOURCE_PIXELS = None
+    MAX_WORKING_SET = None
+    OVERSIZED_SOURCE_ACTION = 'reject'
+    RETAIN_GENERATED_CONTENT = True
+    INTERMEDIATE_CACHE_SIZE = 8
+
+    OPTIMIZE_PROCESSORS = False
+    OPTIMIZER_DEBUG = False
+    OPTIMIZER_TOLERANCE = 2.0
+
+    ASYNC_BATCH_SIZE = 50
+    BULK_CHUNK_SIZE = 500
+
+    THREADPOOL_WORKERS = 2
+    THREADPOOL_QUEUE_SIZE = 1000
+
+    PROCESSPOOL_WORKERS = None
+    PROCESSPOOL_MAX_JOBS_PER_WORKER = 100
+    PROCESSPOOL_START_METHOD = 'spawn'
+
+    FAILURE_BACKOFF = 60
+    FAILURE_BACKOFF_MAX = 60 * 60 * 24
+    FAILURE_EXCEPTIONS = (
+        'ValueError', 'SyntaxError', 'PIL.UnidentifiedImageError',
+        'PIL.Image.DecompressionBombError', 'pilkit.exceptions.UnknownFormat',
+        'pilkit.exceptions.UnknownExtension')
+    FAILED_PLACEHOLDER_URL = None
+
+    GENERATION_LOCK = False
+    GENERATION_LOCK_TIMEOUT = 60
+    GENERATION_LOCK_WAIT = 10
 
     def configure_cache_backend(self, value):
         if value is None:
@@ -17,6 +17,10 @@ class MissingSource(ValueError):
     pass
 
 
+class SourceTooLarge(ValueError):
+    pass
+
+
 # Aliases for backwards compatibility
 UnknownExtensionError = UnknownExtension
 UnknownFormatError = UnknownFormat
@@ -4,10 +4,25 @@ from .specs import ImageSpec
 
 
 class Thumbnail(ImageSpec):
+    fast_decode = True
+
     def __init__(self, width=None, height=None, anchor=None, crop=None, upscale=None, **kwargs):
         self.processors = [ThumbnailProcessor(width, height, anchor=anchor,
                                               crop=crop, upscale=upscale)]
+        self._args = (width, height, anchor, crop, upscale)
         super(Thumbnail, self).__init__(**kwargs)
 
+    def get_fingerprint_key(self):
+        # The processors are built from the arguments, so those identify them.
+        args = getattr(self, '_args', None)
+        if args is None or not self._uses_class_attrs('format', 'options',
+                                                      'autoconvert'):
+            return None
+        try:
+            hash(args)
+        except TypeError:
+            return None
+        return (type(self), args)
+
 
 register.generator('imagekit:thumbnail', Thumbnail)
@@ -1,6 +1,7 @@
 from copy import copy
-from hashlib import md5
-from pickle import MARK, DICT
+from functools import partial
+import hashlib
+from pickle import MARK, DICT, PUT
 try:
     from pickle import _Pickler
 except ImportError:
@@ -29,7 +30,71 @@ class CanonicalizingPickler(_Pickler):
     dispatch[dict] = save_dict
 
 
-def pickle(obj):
+def get_hash_function():
+    """
+    Returns a function that creates a hash object, as configured by
+    ``IMAGEKIT_HASH_FUNCTION``: either the name of a ``hashlib`` algorithm or
+    the import path of a function. BLAKE2 hashes are truncated to 16 bytes,
+    the size of an MD5 hash.
+
+    """
+    from django.conf import settings
+    from .utils import get_by_qname
+
+    name = settings.IMAGEKIT_HASH_FUNCTION
+    if '.' in name:
+        return get_by_qname(name, 'hash function')
+    if name in ('blake2b', 'blake2s'):
+        return partial(getattr(hashlib, name), digest_size=16)
+    return partial(hashlib.new, name)
+
+
+def _dumps(obj):
     file = StringIO()
     CanonicalizingPickler(file, 0).dump(obj)
-    return md5(file.getvalue()).hexdigest()
+    return file.getvalue()
+
+
+def _dumps_string(value):
+    # Pickle a string as it appears in the middle of a larger pickle: the
+    # pickler memoizes strings, which is stripped so that the result doesn't
+    # depend on the position of the string.
+    file = StringIO()
+    pickler = CanonicalizingPickler(file, 0)
+    pickler.save(value)
+    data = file.getvalue()
+    put = PUT + b'0\n'
+    if not data.endswith(put):
+        raise ValueError('%r is not pickled as a memoized string.' % (value,))
+    return data[:-len(put)]
+
+
+def pickle(obj):
+    hash = get_hash_function()()
+    hash.update(_dumps(obj))
+    return hash.hexdigest()
+
+
+class PickleTemplate(object):
+    """
+    The pickle of an object that contains a placeholder string, which is later
+    replaced by other strings. ``template.hash(value)`` returns the same hash
+    as ``pickle(obj)`` for the object with ``value`` in place of the
+    placeholder, but without pickling the rest of the object again.
+
+    """
+    def __init__(self, obj, placeholder):
+        data = _dumps(obj)
+        marker = _dumps_string(placeholder)
+        if data.count(marker) != 1:
+            raise ValueError('The placeholder must appear once in the object.')
+        index = data.index(marker)
+        self._prefix = get_hash_function()()
+        self._prefix.update(data[:index])
+        self._suffix = data[index + len(marker):]
+
+    def hash(self, value):
+        hash = self._prefix.copy()
+        hash.update(_dumps_string(value))
+        hash.update(self._suffix)
+        return hash.hexdigest()
@@ -1,7 +1,14 @@
+from collections import OrderedDict
 from django.core.management.base import BaseCommand
 import re
+import time
+from ...cachefiles import LazyImageCacheFile
+from ...cachefiles.backends import CacheFileState
 from ...registry import generator_registry, cachefile_registry
 from ...exceptions import MissingSource
+from ...specs.sourcegroups import (ImageFieldSourceGroup,
+                                   SourceGroupFilesGenerator)
+from ...utils import share_processor_prefixes, share_source_image
 
 
 class Command(BaseCommand):
@@ -16,6 +23,8 @@ well as "a:b" and "a:b:c".""")
 
     def add_arguments(self, parser):
         parser.add_argument('generator_id', nargs='*', help='<app_name>:<model>:<field> for model specs')
+        parser.add_argument('--retry-failed', action='store_true', dest='retry_failed',
+                            default=False, help='Retry files that recently failed to generate.')
 
     def handle(self, *args, **options):
         generators = generator_registry.get_ids()
@@ -25,17 +34,81 @@ well as "a:b" and "a:b:c".""")
             patterns = self.compile_patterns(generator_ids)
             generators = (id for id in generators if any(p.match(id) for p in patterns))
 
+        # Files of specs that share a source are generated source by source, so
+        # that each source image is only decoded once.
+        source_groups = OrderedDict()
+        other_cachefiles = OrderedDict()
         for generator_id in generators:
+            for cachefiles in cachefile_registry.get_cachefiles(generator_id):
+                if isinstance(cachefiles, SourceGroupFilesGenerator):
+                    source_group = cachefiles.source_group
+                    key = self.get_source_group_key(source_group)
+                    source_groups.setdefault(key, (source_group, []))[1].append(
+                        generator_id)
+                else:
+                    other_cachefiles.setdefault(generator_id,
+                                                []).append(cachefiles)
+
+        for source_group, ids in source_groups.values():
+            self.stdout.write('Validating generators: %s\n' % ', '.join(ids))
+            for source in source_group.files():
+                files = [LazyImageCacheFile(generator_id, source=source)
+                         for generator_id in ids]
+                with share_source_image(source):
+                    share_processor_prefixes(
+                        source, [file.generator for file in files if file.name])
+                    for file in files:
+                        self.generate_file(file, options)
+
+        for generator_id, cachefiles_list in other_cachefiles.items():
             self.stdout.write('Validating generator: %s\n' % generator_id)
-            for image_file in cachefile_registry.get(generator_id):
-                if image_file.name:
-                    self.stdout.write('  %s\n' % image_file.name)
-                    try:
-                        image_file.generate()
-                    except MissingSource as err:
-                        self.stdout.write('\t No source associated with\n')
-                    except Exception as err:
-                        self.stdout.write('\tFailed %s\n' % (err))
+            for cachefiles in cachefiles_list:
+                for image_file in cachefiles():
+                    self.generate_file(image_file, options)
+
+    def generate_file(self, image_file, options):
+        if not image_file.name:
+            return
+        self.stdout.write('  %s\n' % image_file.name)
+        failure = self.get_failure(image_file)
+        if failure and not options.get('retry_failed'):
+            self.stdout.write('\tSkipped: failed %s time(s) with %s;'
+                              ' will be retried in %ds\n' % (
+                                  failure.get('attempts', 1),
+                                  failure.get('error'),
+                                  failure.get('retry_at', 0) - time.time()))
+            return
+        try:
+            image_file.generate(force=bool(failure))
+        except MissingSource as err:
+            self.stdout.write('\t No source associated with\n')
+        except Exception as err:
+            self.stdout.write('\tFailed %s\n' % (err))
+
+    def get_source_group_key(self, source_group):
+        """
+        Each spec field registers its own source group, so source groups for
+        the same model field are grouped by their model and field.
+
+        """
+        if isinstance(source_group, ImageFieldSourceGroup):
+            return (source_group.model_class, source_group.image_field)
+        return source_group
+
+    def get_failure(self, image_file):
+        """
+        Returns the state record of the file if it failed to generate and isn't
+        due to be retried yet.
+
+        """
+        backend = image_file.cachefile_backend
+        if not hasattr(backend, 'get_state_record'):
+            return None
+        record = backend.get_state_record(image_file, check_if_unknown=False)
+        if (record and record['state'] == CacheFileState.FAILED
+                and not backend.should_generate(record)):
+            return record
+        return None
 
     def compile_patterns(self, generator_ids):
         return [self.compile_pattern(id) for id in generator_ids]
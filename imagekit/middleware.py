@@ -0,0 +1,41 @@
+import threading
+from .cachefiles.backends import begin_batch, end_batch, end_all_batches
+
+
+_requests = threading.local()
+
+
+class BatchGenerationMiddleware(object):
+    """
+    Buffers the files scheduled by asynchronous cache file backends while a
+    request is being handled and schedules them in batches once the response
+    has been produced. Works with both ``MIDDLEWARE`` and
+    ``MIDDLEWARE_CLASSES``.
+
+    """
+    def __init__(self, get_response=None):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        begin_batch()
+        try:
+            return self.get_response(request)
+        finally:
+            end_batch()
+
+    def process_request(self, request):
+        # With ``MIDDLEWARE_CLASSES``, ``process_response()`` isn't called if
+        # handling the previous request in this thread failed before it got
+        # there, so that request's batch may still be open. Its files are
+        # scheduled now, so that they aren't buffered forever.
+        end_all_batches()
+        begin_batch()
+        _requests.batching = True
+
+    def process_response(self, request, response):
+        # The batch is only ended if it was begun for this request (an
+        # earlier middleware may have returned the response instead).
+        if getattr(_requests, 'batching', False):
+            _requests.batching = False
+            end_batch()
+        return response
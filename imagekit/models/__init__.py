@@ -1,4 +1,5 @@
 # flake8: noqa
 
 from .. import conf
-from .fields import ImageSpecField, ProcessedImageField
+from .fields import ImageSpecField, ProcessedImageField, SourceDigestField
+from .query import ImageSpecManager, ImageSpecQuerySet, prefetch_specs
@@ -1,13 +1,19 @@
 from __future__ import unicode_literals
 
+import json
+import six
 from django.conf import settings
 from django.db import models
-from django.db.models.signals import class_prepared
+from django.db.models.signals import class_prepared, post_init
 from .files import ProcessedImageFieldFile
 from .utils import ImageSpecFileDescriptor
+from ...cachefiles import ImageCacheFile
+from ...cachefiles.backends import CacheFileState
+from ...signals import source_saved
 from ...specs import SpecHost
-from ...specs.sourcegroups import ImageFieldSourceGroup
+from ...specs.sourcegroups import ImageFieldSourceGroup, ImageSpecSourceGroup
 from ...registry import register
+from ...utils import get_source_digest, remember_source_digest
 
 
 class SpecHostField(SpecHost):
@@ -30,21 +36,29 @@ class ImageSpecField(SpecHostField):
     The heart and soul of the ImageKit library, ImageSpecField allows you to add
     variants of uploaded images to your models.
 
+    If ``metadata_field`` names a text (or JSON) field of the model, the name,
+    dimensions and size of the generated file are stored in it when the source
+    is saved, so that the file can be used without looking up its state.
+
     """
     def __init__(self, processors=None, format=None, options=None,
             source=None, cachefile_storage=None, autoconvert=None,
             cachefile_backend=None, cachefile_strategy=None, spec=None,
-            id=None):
+            id=None, fast_decode=None, optimize_processors=None,
+            cachefile_url_timeout=None, metadata_field=None):
 
         SpecHost.__init__(self, processors=processors, format=format,
                 options=options, cachefile_storage=cachefile_storage,
                 autoconvert=autoconvert,
                 cachefile_backend=cachefile_backend,
                 cachefile_strategy=cachefile_strategy, spec=spec,
-                spec_id=id)
+                spec_id=id, fast_decode=fast_decode,
+                optimize_processors=optimize_processors,
+                cachefile_url_timeout=cachefile_url_timeout)
 
         # TODO: Allow callable for source. See https://github.com/matthewwithanm/django-imagekit/issues/158#issuecomment-10921664
         self.source = source
+        self.metadata_field = metadata_field
 
     def contribute_to_class(self, cls, name):
         # If the source field name isn't defined, figure it out.
@@ -52,12 +66,36 @@ class ImageSpecField(SpecHostField):
         def register_source_group(source):
             setattr(cls, name, ImageSpecFileDescriptor(self, name, source))
             self._set_spec_id(cls, name)
+            self.attname = name
+            self.source_field_name = source
+
+            # Add the model and field as a source for this spec id. The source
+            # may also be another ImageSpecField, whose generated file is then
+            # used as the source of this spec.
+            if isinstance(getattr(cls, source, None), ImageSpecField):
+                source_group = ImageSpecSourceGroup(cls, source)
+            else:
+                source_group = ImageFieldSourceGroup(cls, source)
+            register.source_group(self.spec_id, source_group)
 
-            # Add the model and field as a source for this spec id
-            register.source_group(self.spec_id, ImageFieldSourceGroup(cls, source))
+            if self.metadata_field:
+                # Connected after the registry's receiver, so the file has
+                # been generated by the strategy (if it does so) by the time
+                # the metadata is updated.
+                source_saved.connect(self.source_saved_receiver,
+                                     sender=source_group, weak=False)
 
         if self.source:
-            register_source_group(self.source)
+            if (getattr(cls, self.source, None) is None
+                    and not cls._meta.abstract):
+                # The source hasn't been added to the class yet, so we can't
+                # tell whether it's an ImageSpecField.
+                def handle_source_preparation(sender, **kwargs):
+                    register_source_group(self.source)
+                class_prepared.connect(handle_source_preparation, sender=cls,
+                                       weak=False)
+            else:
+                register_source_group(self.source)
         else:
             # The source argument is not defined
             # Then we need to see if there is only one ImageField in that model
@@ -80,6 +118,92 @@ class ImageSpecField(SpecHostField):
 
             class_prepared.connect(handle_model_preparation, sender=cls, weak=False)
 
+    def get_file_from_metadata(self, instance, spec):
+        """
+        Returns the file described by the metadata stored on ``instance``, or
+        ``None`` if there isn't any or it doesn't match the spec's source and
+        configuration. The file's recorded state is trusted, so using it
+        doesn't require a cache lookup.
+
+        """
+        metadata = _load_metadata(getattr(instance, self.metadata_field))
+        if (not metadata or not metadata.get('name')
+                or metadata.get('source') != getattr(spec.source, 'name', None)):
+            return None
+        get_fingerprint = getattr(spec, 'get_fingerprint', None)
+        fingerprint = get_fingerprint() if get_fingerprint else None
+        if fingerprint is None or metadata.get('fingerprint') != fingerprint:
+            return None
+
+        file = ImageCacheFile(spec, name=metadata['name'])
+        record = {'state': CacheFileState.EXISTS}
+        for key in ('width', 'height', 'size'):
+            if metadata.get(key) is not None:
+                record[key] = metadata[key]
+        file._prefetched_state = record
+        if 'width' in record and 'height' in record:
+            file._dimensions_cache = (record['width'], record['height'])
+        return file
+
+    def get_file(self, instance):
+        """
+        Returns a new cache file for the field's spec of ``instance``.
+
+        """
+        source = getattr(instance, self.source_field_name)
+        return ImageCacheFile(self.get_spec(source=source))
+
+    def update_metadata(self, instance, save=True, file=None):
+        """
+        Stores the metadata of the field's file on ``instance`` and, if
+        ``save`` is true, on its row (if it's been saved, without sending any
+        signals). The metadata is cleared if the file hasn't been generated
+        yet. ``file`` is the field's cache file for ``instance``, if one was
+        created (with its state prefetched, for example).
+
+        """
+        if file is None:
+            file = self.get_file(instance)
+        spec = file.generator
+        info = file._get_state_info(('width', 'height', 'size'))
+        get_fingerprint = getattr(spec, 'get_fingerprint', None)
+        fingerprint = get_fingerprint() if get_fingerprint else None
+        metadata = None
+        if info is not None and fingerprint is not None:
+            width, height, size = info
+            metadata = {
+                'name': file.name,
+                'source': spec.source.name,
+                'fingerprint': fingerprint,
+                'width': width,
+                'height': height,
+                'size': size,
+            }
+
+        field = instance._meta.get_field(self.metadata_field)
+        if field.get_internal_type() != 'JSONField':
+            metadata = json.dumps(metadata, sort_keys=True) if metadata else ''
+        setattr(instance, field.attname, metadata)
+        # The file that was cached on the instance may be out of date.
+        instance.__dict__.pop(self.attname, None)
+        if save and instance.pk is not None:
+            type(instance)._base_manager.filter(pk=instance.pk).update(
+                **{field.attname: metadata})
+
+    def source_saved_receiver(self, sender, source, **kwargs):
+        instance = getattr(source, 'instance', None)
+        if instance is not None:
+            self.update_metadata(instance)
+
+
+def _load_metadata(value):
+    if isinstance(value, six.string_types):
+        try:
+            value = json.loads(value) if value else None
+        except ValueError:
+            return None
+    return value if isinstance(value, dict) else None
+
 
 class ProcessedImageField(models.ImageField, SpecHostField):
     """
@@ -116,6 +240,51 @@ class ProcessedImageField(models.ImageField, SpecHostField):
         return super(ProcessedImageField, self).contribute_to_class(cls, name)
 
 
+class SourceDigestField(models.CharField):
+    """
+    A field that stores a digest of the contents of one of the model's image
+    fields (``source``). It's updated when the model is saved, and used by the
+    ``imagekit.cachefiles.namers.source_digest`` namer so that the source
+    doesn't need to be read again to be named.
+
+    """
+    def __init__(self, source, *args, **kwargs):
+        self.source = source
+        kwargs.setdefault('max_length', 128)
+        kwargs.setdefault('blank', True)
+        kwargs.setdefault('editable', False)
+        super(SourceDigestField, self).__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super(SourceDigestField, self).deconstruct()
+        kwargs['source'] = self.source
+        return name, path, args, kwargs
+
+    def contribute_to_class(self, cls, name, **kwargs):
+        super(SourceDigestField, self).contribute_to_class(cls, name, **kwargs)
+        if not cls._meta.abstract:
+            post_init.connect(self.post_init_receiver, sender=cls, weak=False)
+
+    def post_init_receiver(self, sender, instance=None, **kwargs):
+        # Skip deferred fields, which would cause a query.
+        if self.attname in instance.__dict__ and self.source in instance.__dict__:
+            digest = instance.__dict__[self.attname]
+            if digest:
+                file = getattr(instance, self.source)
+                if file:
+                    remember_source_digest(file, digest)
+
+    def pre_save(self, model_instance, add):
+        # The source field saves its file first, so that the digest is
+        # remembered under the file's final name, whichever field is declared
+        # first. (Saving it again does nothing.)
+        source_field = model_instance._meta.get_field(self.source)
+        file = source_field.pre_save(model_instance, add)
+        digest = get_source_digest(file) if file else ''
+        setattr(model_instance, self.attname, digest)
+        return digest
+
+
 # If the project does not use south, then we will not try to add introspection
 if 'south' in settings.INSTALLED_APPS:
     try:
@@ -124,3 +293,6 @@ if 'south' in settings.INSTALLED_APPS:
         pass
     else:
         add_introspection_rules([], [r'^imagekit\.models\.fields\.ProcessedImageField$'])
+        add_introspection_rules([(
+            [SourceDigestField], [], {'source': ['source', {}]},
+        )], [r'^imagekit\.models\.fields\.SourceDigestField$'])
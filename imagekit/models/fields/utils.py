@@ -13,7 +13,11 @@ class ImageSpecFileDescriptor(object):
         else:
             source = getattr(instance, self.source_field_name)
             spec = self.field.get_spec(source=source)
-            file = ImageCacheFile(spec)
+            file = None
+            if self.field.metadata_field:
+                file = self.field.get_file_from_metadata(instance, spec)
+            if file is None:
+                file = ImageCacheFile(spec)
             instance.__dict__[self.attname] = file
             return file
 
@@ -0,0 +1,80 @@
+from django.db import models
+from ..cachefiles import prefetch_states
+from ..cachefiles.backends import CacheFileState, batch_generation
+from ..utils import (call_strategy_method, share_processor_prefixes,
+                     share_source_image)
+
+
+def prefetch_specs(instances, *spec_names):
+    """
+    Creates the cache files of the named ``ImageSpecField``s for many model
+    instances at once, so that accessing them later (for their URLs or
+    dimensions, for example) doesn't need a cache lookup per file:
+
+    * their states are looked up with one ``get_many()`` call per cache file
+      backend (see ``prefetch_states()``);
+    * the files that don't exist yet are handed to their cache file strategies
+      together, so that asynchronous backends schedule them in batches and
+      synchronous ones decode each source once;
+    * the files are attached to the instances.
+
+    Returns the list of instances.
+
+    """
+    instances = list(instances)
+    files = []
+    for instance in instances:
+        for name in spec_names:
+            # The descriptor attaches the file to the instance.
+            files.append((instance, getattr(instance, name)))
+
+    states = prefetch_states([file for instance, file in files])
+    missing = {}
+    for instance, file in files:
+        if file.name and states.get(file.name) != CacheFileState.EXISTS:
+            source = file.generator.source
+            missing.setdefault(id(source), (source, []))[1].append(file)
+
+    if missing:
+        with batch_generation():
+            for source, source_files in missing.values():
+                with share_source_image(source):
+                    share_processor_prefixes(
+                        source, [file.generator for file in source_files])
+                    for file in source_files:
+                        call_strategy_method(file, 'on_existence_required')
+    return instances
+
+
+class ImageSpecQuerySet(models.QuerySet):
+    """
+    A queryset with a ``prefetch_specs()`` method, which prefetches the cache
+    files of ``ImageSpecField``s (see :func:`prefetch_specs`) when the
+    queryset is evaluated::
+
+        for photo in Photo.objects.prefetch_specs('thumbnail', 'medium'):
+            print(photo.thumbnail.url)
+
+    """
+    _spec_names = ()
+
+    def prefetch_specs(self, *spec_names):
+        clone = self._chain() if hasattr(self, '_chain') else self._clone()
+        clone._spec_names = self._spec_names + spec_names
+        return clone
+
+    def _clone(self, *args, **kwargs):
+        clone = super(ImageSpecQuerySet, self)._clone(*args, **kwargs)
+        clone._spec_names = self._spec_names
+        return clone
+
+    def _fetch_all(self):
+        prefetch = self._result_cache is None and self._spec_names
+        super(ImageSpecQuerySet, self)._fetch_all()
+        if prefetch:
+            prefetch_specs([obj for obj in self._result_cache
+                            if isinstance(obj, models.Model)],
+                           *self._spec_names)
+
+
+ImageSpecManager = models.Manager.from_queryset(ImageSpecQuerySet)
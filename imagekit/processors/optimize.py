@@ -0,0 +1,173 @@
+"""
+Rewrites lists of processors into cheaper ones that produce the same image (or
+very nearly the same), for example by cropping before adjusting the colors of
+pixels that would be cropped anyway.
+
+Rules are declared by processor classes, with an ``optimize_with()`` method
+that's given the next processor and returns the processors to run instead of
+the two (or ``None`` if it can't be improved). Rules for pilkit's processors
+are registered with ``add_rule()``.
+
+"""
+from copy import copy
+from pilkit.processors import (Adjust, Anchor, Crop, MakeOpaque, Resize,
+                               ResizeToCover, ResizeToFill, ResizeToFit,
+                               Transpose)
+from ..lib import ImageChops, ImageStat
+from .sizes import _flatten, swaps_axes
+
+
+_rules = {}
+_MAX_PASSES = 100
+
+
+def add_rule(processor_class, rule):
+    """
+    Registers a rule for a processor class. ``rule`` is called with a
+    processor of that class and the processor that follows it, and returns
+    a list of processors to run instead of the two, or ``None``.
+
+    """
+    _rules.setdefault(processor_class, []).append(rule)
+
+
+def _get_rules(processor):
+    rules = list(_rules.get(type(processor), []))
+    optimize_with = getattr(processor, 'optimize_with', None)
+    if optimize_with is not None:
+        rules.append(lambda processor, next: optimize_with(next))
+    return rules
+
+
+def resolve_orientation(processors, img):
+    """
+    Replaces a leading ``Transpose(Transpose.AUTO)`` with the steps given by
+    the EXIF orientation of ``img``, so that it doesn't need to be run first
+    (the EXIF data is lost once the image has been processed).
+
+    """
+    if (not processors or type(processors[0]) is not Transpose
+            or Transpose.AUTO not in processors[0].methods):
+        return processors
+    steps = Transpose._EXIF_ORIENTATION_STEPS
+    try:
+        methods = steps[img._getexif()[0x0112]]
+    except (IndexError, KeyError, TypeError, AttributeError):
+        methods = []
+    rest = processors[1:]
+    return [Transpose(*methods)] + rest if methods else rest
+
+
+def optimize(processors, img=None):
+    """
+    Returns a list of processors that produces the same image as
+    ``processors``. If the image they'll process is given, it's used to
+    resolve processors that depend on its metadata.
+
+    """
+    processors = list(_flatten(processors or []))
+    if img is not None:
+        processors = resolve_orientation(processors, img)
+    for _ in range(_MAX_PASSES):
+        for i in range(len(processors) - 1):
+            replacement = None
+            for rule in _get_rules(processors[i]):
+                replacement = rule(processors[i], processors[i + 1])
+                if replacement is not None:
+                    break
+            if replacement is not None:
+                processors[i:i + 2] = replacement
+                break
+        else:
+            break
+    return processors
+
+
+def _keeps_whole_image(processor):
+    # Resizes that neither crop nor pad the image.
+    return (type(processor) in (Resize, ResizeToCover) or
+            (type(processor) is ResizeToFit and processor.mat_color is None))
+
+
+def _is_pixelwise(processor):
+    # Processors that change each pixel independently of the others.
+    if type(processor) is Adjust:
+        return processor.contrast == 1.0 and processor.sharpness == 1.0
+    return type(processor) is MakeOpaque
+
+
+def _min_output_size(processor):
+    # The size that a resize that keeps the whole image produces at least,
+    # whatever the size of its input; ``None`` if there's no such size.
+    if type(processor) in (Resize, ResizeToCover) and processor.upscale:
+        return processor.width, processor.height
+    return None
+
+
+def merge_resizes(processor, next):
+    """
+    A resize that keeps the whole image, followed by a ``Resize`` to a size no
+    larger than the first resize's output, is replaced by the second resize.
+    (If the second resize could enlarge the image, dropping the first would
+    change the result.)
+
+    """
+    if not (_keeps_whole_image(processor) and type(next) is Resize
+            and next.upscale):
+        return None
+    size = _min_output_size(processor)
+    if size is not None and next.width <= size[0] and next.height <= size[1]:
+        return [next]
+
+
+def crop_first(processor, next):
+    """
+    Crops are moved before processors that change pixels independently of the
+    others, so that those don't process the pixels that are cropped.
+
+    """
+    if _is_pixelwise(processor) and type(next) is Crop:
+        return [next, processor]
+
+
+def transpose_last(processor, next):
+    """
+    Rotations and flips are moved after resizes that don't depend on the
+    orientation of the image, so that they're applied to fewer pixels. (The
+    dimensions of the resize are swapped if the transposition swaps the axes
+    of the image.)
+
+    Transpositions whose methods aren't known (including ``Transpose.AUTO``)
+    aren't moved.
+
+    """
+    swapped = swaps_axes(processor)
+    if swapped is None:
+        return None
+    if not (_keeps_whole_image(next) or (type(next) is ResizeToFill and
+                                         next.anchor in (None, Anchor.CENTER))):
+        return None
+    resize = copy(next)
+    if swapped:
+        resize.width, resize.height = next.height, next.width
+    return [resize, processor]
+
+
+for cls in (Resize, ResizeToCover):
+    add_rule(cls, merge_resizes)
+add_rule(Adjust, crop_first)
+add_rule(MakeOpaque, crop_first)
+add_rule(Transpose, transpose_last)
+
+
+def get_difference(img1, img2):
+    """
+    Returns the mean difference between two images, per channel, on a scale of
+    0 to 255 (the largest of the channels' differences). Images of different
+    sizes differ by 255.
+
+    """
+    if img1.size != img2.size:
+        return 255.0
+    diff = ImageChops.difference(img1.convert('RGBA'), img2.convert('RGBA'))
+    return max(ImageStat.Stat(diff).mean)
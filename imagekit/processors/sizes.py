@@ -0,0 +1,207 @@
+"""
+Functions that tell how processors change the size of an image, without having
+to run them.
+
+"""
+from ..lib import Image
+from pilkit.processors import (ProcessorPipeline, Adjust, MakeOpaque,
+                               Transpose, Resize, ResizeToCover, ResizeToFill,
+                               SmartResize, ResizeToFit, Thumbnail, Crop,
+                               SmartCrop)
+
+
+def _cover_scale(processor, size):
+    width, height = size
+    return max(float(processor.width) / width,
+               float(processor.height) / height)
+
+
+def _fit_scale(processor, size):
+    width, height = size
+    if processor.width is not None and processor.height is not None:
+        return min(float(processor.width) / width,
+                   float(processor.height) / height)
+    elif processor.width is None:
+        return float(processor.height) / height
+    return float(processor.width) / width
+
+
+def _thumbnail_scale(processor, size):
+    if processor.crop:
+        return _cover_scale(processor, size)
+    return _fit_scale(processor, size)
+
+
+# Functions returning the factor by which a resizing processor scales an image
+# of the given size. (``Resize`` may change the aspect ratio, but its output
+# still needs the larger of its two factors.)
+_scale_functions = {
+    Resize: _cover_scale,
+    ResizeToCover: _cover_scale,
+    ResizeToFill: _cover_scale,
+    SmartResize: _cover_scale,
+    ResizeToFit: _fit_scale,
+    Thumbnail: _thumbnail_scale,
+}
+
+# Processors that neither change the size of an image nor depend on it.
+_size_independent = (Adjust, MakeOpaque)
+
+
+def _flatten(processors):
+    for processor in processors:
+        if isinstance(processor, ProcessorPipeline):
+            for p in _flatten(processor):
+                yield p
+        else:
+            yield processor
+
+
+def get_scale(processors, size):
+    """
+    Returns the factor by which the first resizing processor of a pipeline
+    scales an image of the given size. Only the processors before it that
+    don't depend on the size of the image (like ``Adjust`` and ``Transpose``)
+    are allowed; if another processor (a crop, for example) comes first, or if
+    there's no resizing processor, ``1.0`` is returned, meaning that the image
+    is needed at full resolution.
+
+    """
+    width, height = size
+    if not width or not height:
+        return 1.0
+    sizes = [size]
+    for processor in _flatten(processors):
+        if isinstance(processor, _size_independent):
+            continue
+        elif isinstance(processor, Transpose):
+            # Unless the image is flipped, its orientation may change, so
+            # consider both.
+            sizes = [size, (height, width)]
+            continue
+        fn = _scale_functions.get(type(processor))
+        if fn is None:
+            return 1.0
+        try:
+            return min(1.0, max(fn(processor, s) for s in sizes))
+        except (TypeError, ZeroDivisionError):
+            # The processor is missing dimensions; it will complain itself.
+            return 1.0
+    return 1.0
+
+
+def _resize_size(processor, size):
+    width, height = size
+    if processor.upscale or (processor.width < width and
+                             processor.height < height):
+        return processor.width, processor.height
+    return size
+
+
+def _resize_by(ratio, size, upscale):
+    width, height = size
+    new_size = int(round(width * ratio)), int(round(height * ratio))
+    return _resize_size(Resize(new_size[0], new_size[1], upscale), size)
+
+
+def _cover_size(processor, size):
+    return _resize_by(_cover_scale(processor, size), size, processor.upscale)
+
+
+def _crop_size(processor, size):
+    width, height = size
+    return min(width, processor.width), min(height, processor.height)
+
+
+def _fill_size(processor, size):
+    return _crop_size(processor, _cover_size(processor, size))
+
+
+def _fit_size(processor, size):
+    if processor.mat_color is not None:
+        return processor.width, processor.height
+    return _resize_by(_fit_scale(processor, size), size, processor.upscale)
+
+
+def _thumbnail_size(processor, size):
+    if processor.crop:
+        return _fill_size(processor, size)
+    return _fit_size(ResizeToFit(processor.width, processor.height,
+                                 upscale=processor.upscale), size)
+
+
+_transpositions = getattr(Image, 'Transpose', Image)
+
+# The methods of ``Transpose`` that keep the axes of the image, and those that
+# swap them.
+_AXES_KEPT = (Transpose.FLIP_HORIZONTAL, Transpose.FLIP_VERTICAL,
+              Transpose.ROTATE_180)
+_AXES_SWAPPED = (Transpose.ROTATE_90, Transpose.ROTATE_270,
+                 _transpositions.TRANSPOSE, _transpositions.TRANSVERSE)
+
+
+def swaps_axes(processor):
+    """
+    Whether a ``Transpose`` processor swaps the width and height of images,
+    or ``None`` if that isn't known (because it depends on the image's EXIF
+    data, or the processor has methods that aren't known).
+
+    """
+    swapped = False
+    for method in processor.methods:
+        if method in _AXES_SWAPPED:
+            swapped = not swapped
+        elif method not in _AXES_KEPT:
+            return None
+    return swapped
+
+
+def _transpose_size(processor, size):
+    swapped = swaps_axes(processor)
+    if swapped is None:
+        return None
+    return tuple(reversed(size)) if swapped else size
+
+
+# Functions returning the size of the image a processor produces from an image
+# of the given size.
+_size_functions = {
+    Resize: _resize_size,
+    ResizeToCover: _cover_size,
+    ResizeToFill: _fill_size,
+    SmartResize: _fill_size,
+    ResizeToFit: _fit_size,
+    Thumbnail: _thumbnail_size,
+    Crop: _crop_size,
+    SmartCrop: _crop_size,
+    Transpose: _transpose_size,
+}
+
+
+def get_output_size(processors, size):
+    """
+    Returns the size of the image that a pipeline produces from an image of
+    the given size, or ``None`` if it can't be known without running it.
+    Besides the processors above, processors can tell the size of their
+    output with a ``get_output_size(size)`` method (which may return
+    ``None``).
+
+    """
+    for processor in _flatten(processors):
+        if isinstance(processor, _size_independent):
+            continue
+        fn = getattr(processor, 'get_output_size', None)
+        if fn is None:
+            size_function = _size_functions.get(type(processor))
+            if size_function is None:
+                return None
+            fn = lambda size: size_function(processor, size)
+        try:
+            size = fn(size)
+        except (TypeError, ZeroDivisionError):
+            # The processor is missing dimensions; it will complain itself.
+            return None
+        if size is None:
+            return None
+        size = tuple(size)
+    return size
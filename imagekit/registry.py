@@ -38,7 +38,16 @@ class GeneratorRegistry(object):
             raise NotRegistered('The generator with id %s is not'
                                 ' registered' % id)
         if callable(generator):
-            return generator(**kwargs)
+            instance = generator(**kwargs)
+            try:
+                # Remember how the generator was created, so that the work of
+                # generating its file can be described compactly (see
+                # ``imagekit.cachefiles.jobs``).
+                instance._ik_generator = (id, dict(
+                    (k, v) for k, v in kwargs.items() if k != 'source'))
+            except AttributeError:
+                pass
+            return instance
         else:
             return generator
 
@@ -95,12 +104,24 @@ class SourceGroupRegistry(object):
             cachefile_registry.unregister(generator_id,
                     SourceGroupFilesGenerator(source_group, generator_id))
 
+    def get_model_source_groups(self, model_class):
+        """
+        Returns the source groups that represent fields of a model (or of its
+        parent classes), with the ids of their generators.
+
+        """
+        return [(source_group, set(ids)) for source_group, ids
+                in self._source_groups.items()
+                if ids and issubclass(model_class,
+                                      getattr(source_group, 'model_class', ()))]
+
     def source_group_receiver(self, sender, source, signal, **kwargs):
         """
         Relay source group signals to the appropriate spec strategy.
 
         """
         from .cachefiles import ImageCacheFile
+        from .utils import share_processor_prefixes, share_source_image
         source_group = sender
 
         # Ignore signals from unregistered groups.
@@ -111,9 +132,13 @@ class SourceGroupRegistry(object):
                 self._source_groups[source_group]]
         callback_name = self._signals[signal]
 
-        for spec in specs:
-            file = ImageCacheFile(spec)
-            call_strategy_method(file, callback_name)
+        # Specs that generate their files right away (e.g. with the optimistic
+        # strategy) share a single decoded copy of the source.
+        with share_source_image(source):
+            share_processor_prefixes(source, specs)
+            for spec in specs:
+                file = ImageCacheFile(spec)
+                call_strategy_method(file, callback_name)
 
 
 class CacheFileRegistry(object):
@@ -150,10 +175,17 @@ class CacheFileRegistry(object):
             pass
 
     def get(self, generator_id):
-        for k, v in self._cachefiles.items():
-            if generator_id in v:
-                for file in k():
-                    yield file
+        for cachefiles in self.get_cachefiles(generator_id):
+            for file in cachefiles():
+                yield file
+
+    def get_cachefiles(self, generator_id):
+        """
+        Returns the callables registered to provide the generated files of a
+        generator.
+
+        """
+        return [k for k, v in self._cachefiles.items() if generator_id in v]
 
 
 class Register(object):
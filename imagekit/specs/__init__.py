@@ -1,11 +1,20 @@
+import math
+import os
+import six
+import threading
 from copy import copy
 from django.conf import settings
 from django.db.models.fields.files import ImageFieldFile
+from ..cachefiles import ImageCacheFile
 from ..cachefiles.backends import get_default_cachefile_backend
 from ..cachefiles.strategies import load_strategy
 from .. import hashers
-from ..exceptions import AlreadyRegistered, MissingSource
-from ..utils import open_image, get_by_qname, process_image
+from ..exceptions import AlreadyRegistered, MissingSource, SourceTooLarge
+from ..processors import ProcessorPipeline
+from ..processors.optimize import get_difference, optimize
+from ..processors.sizes import get_output_size, get_scale
+from ..utils import (open_image, get_by_qname, process_image, copy_image,
+                     get_shared_intermediate, get_logger, LRUCache)
 from ..registry import generator_registry, register
 
 
@@ -26,6 +35,15 @@ class BaseImageSpec(object):
 
     """
 
+    cachefile_url_timeout = None
+    """
+    The number of seconds for which the URLs of cache files may be cached
+    (which should be shorter than the expiry of signed URLs), or ``0`` to not
+    cache them. Defaults to the ``imagekit_url_timeout`` attribute of the
+    storage, if it has one, or ``IMAGEKIT_URL_CACHE_TIMEOUT``.
+
+    """
+
     cachefile_strategy = settings.IMAGEKIT_DEFAULT_CACHEFILE_STRATEGY
     """
     A dictionary containing callbacks that allow you to customize how and when
@@ -83,13 +101,62 @@ class ImageSpec(BaseImageSpec):
 
     """
 
+    max_source_pixels = None
+    """
+    The maximum number of pixels (width times height) of a source image.
+    Defaults to ``IMAGEKIT_MAX_SOURCE_PIXELS``. See
+    ``oversized_source_action``.
+
+    """
+
+    max_working_set = None
+    """
+    The maximum number of bytes that decoding and processing a source image is
+    estimated to need. Defaults to ``IMAGEKIT_MAX_WORKING_SET``. See
+    ``oversized_source_action``.
+
+    """
+
+    oversized_source_action = None
+    """
+    What to do with a source image that exceeds ``max_source_pixels`` or
+    ``max_working_set`` (which is checked before the image is decoded):
+    ``'reject'`` (raise ``SourceTooLarge``, so that the generation is recorded
+    as failed), ``'draft'`` (decode JPEGs at a scale that fits the limits, or
+    reject other images), or the import path of a function that's called with
+    the spec, the image (not decoded yet) and the name of the exceeded limit,
+    and returns the generated file. Defaults to
+    ``IMAGEKIT_OVERSIZED_SOURCE_ACTION``.
+
+    """
+
+    fast_decode = False
+    """
+    Specifies whether JPEG sources may be decoded at a reduced scale (1/2, 1/4
+    or 1/8) when the processors shrink them a lot, which is much faster and
+    uses less memory than decoding every pixel. The image is still decoded
+    at (at least) twice the resolution the first resizing processor needs.
+    The output may differ slightly from that of a full decode.
+
+    """
+
+    optimize_processors = None
+    """
+    Specifies whether the processors should be rewritten into cheaper ones
+    that produce the same image before they're run, for example by cropping
+    before adjusting colors or by rotating after resizing (see
+    :mod:`imagekit.processors.optimize`). Defaults to
+    ``IMAGEKIT_OPTIMIZE_PROCESSORS``.
+
+    """
+
     def __init__(self, source):
         self.source = source
         super(ImageSpec, self).__init__()
 
     @property
     def cachefile_name(self):
-        if not self.source:
+        if not self.has_source():
             return None
         fn = get_by_qname(settings.IMAGEKIT_SPEC_CACHEFILE_NAMER, 'namer')
         return fn(self)
@@ -97,7 +164,7 @@ class ImageSpec(BaseImageSpec):
     @property
     def source(self):
         src = getattr(self, '_source', None)
-        if not src:
+        if src is None:
             field_data = getattr(self, '_field_data', None)
             if field_data:
                 src = self._source = getattr(field_data['instance'], field_data['attname'])
@@ -129,23 +196,129 @@ class ImageSpec(BaseImageSpec):
             state.pop('_source', None)
         return state
 
+    def has_source(self):
+        """
+        Whether the spec has a source file. When the source is the file of
+        another spec, this doesn't require that file to exist (or cause it to
+        be generated).
+
+        """
+        source = self.source
+        if isinstance(source, ImageCacheFile):
+            return bool(source.name)
+        return bool(source)
+
     def get_hash(self):
-        return hashers.pickle([
-            self.source.name,
-            self.processors,
+        return self.get_hash_for(self.source.name)
+
+    def get_hash_for(self, source_name):
+        """
+        Returns the hash of the spec's configuration combined with a string
+        identifying the source. ``get_hash()`` uses the source's name, but
+        namers can identify sources in other ways (by their contents, for
+        example).
+
+        """
+        key = self.get_fingerprint_key()
+        if key is None or not isinstance(source_name, six.string_types):
+            return hashers.pickle(self.get_fingerprint_data(source_name))
+
+        # Pickling the processors is slow, so the pickle of the spec's
+        # configuration is cached and only the source name is hashed for each
+        # file. The hash is the same as that of the whole pickle.
+        key = (key, settings.IMAGEKIT_HASH_FUNCTION)
+        template = _hash_templates.get(key)
+        if template is None:
+            template = hashers.PickleTemplate(
+                self.get_fingerprint_data(_SOURCE_NAME_PLACEHOLDER),
+                _SOURCE_NAME_PLACEHOLDER)
+            _hash_templates.set(key, template)
+        return template.hash(source_name)
+
+    def get_fingerprint_data(self, source_name):
+        """
+        Returns the data that's hashed to name the spec's files. Processors can
+        declare a ``fingerprint`` (a value, or a method returning one) to be
+        used instead of their pickled attributes, which keeps names stable if
+        the processor's implementation changes.
+
+        """
+        processors = self.processors
+        if any(hasattr(p, 'fingerprint') for p in processors or []):
+            processors = [get_processor_fingerprint(p) for p in processors]
+        return [
+            source_name,
+            processors,
             self.format,
             self.options,
             self.autoconvert,
-        ])
+        ]
+
+    def get_fingerprint_key(self):
+        """
+        Returns a hashable value identifying the spec's configuration (its
+        processors, format, options and autoconvert), under which its
+        fingerprint can be cached, or ``None`` if it can't be cached. By
+        default, the configuration of specs that only use class attributes is
+        cached per class; specs that set them on the instance or compute them
+        from the source are hashed every time.
+
+        """
+        if not self._uses_class_attrs('processors', 'format', 'options',
+                                      'autoconvert'):
+            return None
+        return type(self)
+
+    def get_fingerprint(self):
+        """
+        Returns a hash of the spec's configuration and of the namer that names
+        its files, which tells whether information recorded about a file (on a
+        model row, for example) still applies to the spec. Returns ``None`` if
+        the configuration can't be cached (see ``get_fingerprint_key()``), as
+        it may then depend on the source.
+
+        """
+        key = self.get_fingerprint_key()
+        if key is None:
+            return None
+        namer = settings.IMAGEKIT_SPEC_CACHEFILE_NAMER
+        key = (key, namer, settings.IMAGEKIT_HASH_FUNCTION)
+        fingerprint = _fingerprints.get(key)
+        if fingerprint is None:
+            fingerprint = hashers.pickle([self.get_fingerprint_data(None),
+                                          namer])
+            _fingerprints.set(key, fingerprint)
+        return fingerprint
+
+    def _uses_class_attrs(self, *attrs):
+        cls = type(self)
+        return not any(attr in self.__dict__ or
+                       not _is_plain_class_attr(cls, attr) for attr in attrs)
 
     def generate(self):
-        if not self.source:
+        if not self.has_source():
             raise MissingSource("The spec '%s' has no source file associated"
                                 " with it." % self)
 
+        if isinstance(self.source, ImageCacheFile):
+            # The source is the output of another spec, so it must be
+            # generated first--even if its backend would defer it.
+            backend = self.source.cachefile_backend
+            generate_now = getattr(backend, 'generate_now', None)
+            if generate_now is not None:
+                generate_now(self.source)
+            else:
+                self.source.generate()
+
         # TODO: Move into a generator base class
         # TODO: Factor out a generate_image function so you can create a generator and only override the PIL.Image creating part. (The tricky part is how to deal with original_format since generator base class won't have one.)
 
+        shared = get_shared_intermediate(self.source, self.processors,
+                                         check=self._can_share_image)
+        if shared is not None:
+            img, processors = shared
+            return self.generate_from_image(img, processors=processors)
+
         closed = self.source.closed
         if closed:
             # Django file object should know how to reopen itself if it was closed
@@ -154,17 +327,289 @@ class ImageSpec(BaseImageSpec):
 
         try:
             img = open_image(self.source)
-            new_image = process_image(img,
-                                      processors=self.processors,
-                                      format=self.format,
-                                      autoconvert=self.autoconvert,
-                                      options=self.options)
+            if self.fast_decode:
+                self.draft(img)
+            limit = self.get_exceeded_limit(img)
+            if limit:
+                new_image = self.handle_oversized_source(img, limit)
+            else:
+                new_image = self.generate_from_image(img)
         finally:
             if closed:
                 # We need to close the file if it was opened by us
                 self.source.close()
         return new_image
 
+    def draft(self, img):
+        """
+        Configures a JPEG image that hasn't been loaded yet to be decoded at
+        the smallest scale that gives the processors at least twice the
+        resolution they need. (See ``fast_decode``.)
+
+        """
+        if img.format != 'JPEG':
+            return
+        size = self._get_draft_request(img.size)
+        if size is not None:
+            img.draft(img.mode, size)
+
+    def get_draft_size(self, size):
+        """
+        Returns the size at which a JPEG source of the given size is decoded
+        (see ``fast_decode``), or ``None`` if it's decoded at full size.
+
+        """
+        request = self._get_draft_request(size)
+        if request is None:
+            return None
+        # Like Pillow, use the largest reduction offered by libjpeg that
+        # gives at least the requested size. libjpeg rounds the reduced size
+        # up.
+        width, height = size
+        reduction = min(width // request[0], height // request[1])
+        for scale in (8, 4, 2, 1):
+            if reduction >= scale:
+                break
+        return ((width + scale - 1) // scale, (height + scale - 1) // scale)
+
+    def _get_draft_request(self, size):
+        if not self.fast_decode:
+            return None
+        width, height = size
+        scale = get_scale(self.processors, size) * 2
+        if scale > 0.5:
+            return None
+        return (int(math.ceil(width * scale)), int(math.ceil(height * scale)))
+
+    def _can_share_image(self, img):
+        # Specs don't use the decoded image shared with other specs (see
+        # ``share_source_image()``) if it exceeds their limits, or if they'd
+        # decode it at a reduced scale themselves.
+        if img.format == 'JPEG' and self.get_draft_size(img.size) is not None:
+            return False
+        return not self.get_exceeded_limit(img)
+
+    def get_exceeded_limit(self, img, size=None):
+        """
+        Returns the name of the limit (``'pixels'`` or ``'working_set'``) that
+        an image exceeds, or ``None``. Only the image's header is needed. If
+        ``size`` is given, it's used instead of the image's size.
+
+        """
+        max_pixels = self.max_source_pixels
+        if max_pixels is None:
+            max_pixels = settings.IMAGEKIT_MAX_SOURCE_PIXELS
+        max_working_set = self.max_working_set
+        if max_working_set is None:
+            max_working_set = settings.IMAGEKIT_MAX_WORKING_SET
+
+        width, height = size or img.size
+        if max_pixels is not None and width * height > max_pixels:
+            return 'pixels'
+        if (max_working_set is not None
+                and estimate_working_set(img, size) > max_working_set):
+            return 'working_set'
+        return None
+
+    def handle_oversized_source(self, img, limit):
+        """
+        Generates the file for a source image that exceeds a limit, as
+        specified by ``oversized_source_action``.
+
+        """
+        action = (self.oversized_source_action
+                  or settings.IMAGEKIT_OVERSIZED_SOURCE_ACTION)
+        count_source_limit(limit)
+        get_logger().warning('Source %s of spec %s exceeds the %s limit (%sx%s)'
+                             % (self.source.name, self, limit, img.size[0],
+                                img.size[1]))
+
+        if action == 'draft' and img.format == 'JPEG':
+            # Use the smallest reduction offered by libjpeg that fits.
+            width, height = img.size
+            for scale in (2, 4, 8):
+                size = (int(math.ceil(float(width) / scale)),
+                        int(math.ceil(float(height) / scale)))
+                if not self.get_exceeded_limit(img, size):
+                    img.draft(img.mode, (width // scale, height // scale))
+                    break
+            # Images that have already been drafted can't be drafted again.
+            if not self.get_exceeded_limit(img):
+                count_source_limit('draft')
+                return self.generate_from_image(img)
+        elif action not in ('reject', 'draft'):
+            count_source_limit('custom')
+            return get_by_qname(action, 'oversized source action')(
+                self, img, limit)
+
+        count_source_limit('reject')
+        raise SourceTooLarge('The source of %s exceeds the %s limit (%sx%s).'
+                             % (self, limit, img.size[0], img.size[1]))
+
+    def predict_dimensions(self):
+        """
+        Returns the dimensions (a ``(width, height)`` tuple) of the image the
+        spec would generate, computed from the dimensions of the source (see
+        ``get_source_dimensions()``) without generating or opening anything,
+        or ``None`` if they can't be predicted (because a processor's output
+        depends on the contents of the image, for example).
+
+        """
+        if not self.has_source():
+            return None
+        size = self.get_source_dimensions()
+        if size is None:
+            return None
+        draft_size = self.get_draft_size(size)
+        if draft_size is None:
+            return get_output_size(self.processors, size)
+        # Only JPEGs are drafted. If the format of the source isn't known,
+        # the dimensions can only be predicted if drafting doesn't change
+        # them (as with pipelines that crop to a fixed size).
+        extension = os.path.splitext(getattr(self.source, 'name', None)
+                                     or '')[1].lower()
+        if extension in _JPEG_EXTENSIONS:
+            return get_output_size(self.processors, draft_size)
+        output_size = get_output_size(self.processors, size)
+        if extension in _NON_JPEG_EXTENSIONS:
+            return output_size
+        if output_size != get_output_size(self.processors, draft_size):
+            return None
+        return output_size
+
+    def get_source_dimensions(self):
+        """
+        Returns the dimensions of the source if they're known without opening
+        it: from the ``width_field`` and ``height_field`` of an
+        ``ImageField``, from a previous read or, for sources that are cache
+        files, from their prediction or recorded state. Returns ``None``
+        otherwise.
+
+        """
+        source = self.source
+        dimensions = getattr(source, '_dimensions_cache', None)
+        if dimensions:
+            return dimensions
+        field = getattr(source, 'field', None)
+        instance = getattr(source, 'instance', None)
+        width_field = getattr(field, 'width_field', None)
+        height_field = getattr(field, 'height_field', None)
+        if instance is not None and width_field and height_field:
+            dimensions = (getattr(instance, width_field),
+                          getattr(instance, height_field))
+            if all(dimensions):
+                return dimensions
+        if isinstance(source, ImageCacheFile):
+            return source.predict_dimensions()
+        return None
+
+    def generate_from_image(self, img, processors=None):
+        """
+        Runs the processors on a PIL image opened from the source and returns
+        the resulting file. The image may be modified. If ``processors`` is
+        given, it's run instead of the spec's processors (when the image is the
+        result of some of them, for example).
+
+        """
+        if processors is None:
+            processors = self.processors
+        optimize_processors = self.optimize_processors
+        if optimize_processors is None:
+            optimize_processors = settings.IMAGEKIT_OPTIMIZE_PROCESSORS
+        if optimize_processors:
+            img, processors = self.run_optimized(img, processors), []
+        return process_image(img,
+                             processors=processors,
+                             format=self.format,
+                             autoconvert=self.autoconvert,
+                             options=self.options)
+
+    def run_optimized(self, img, processors):
+        """
+        Runs an optimized version of ``processors`` on an image. In
+        ``IMAGEKIT_OPTIMIZER_DEBUG`` mode, the rewritten processors are logged
+        and the original ones are run too; if the images differ by more than
+        ``IMAGEKIT_OPTIMIZER_TOLERANCE``, a warning is logged and the image
+        produced by the original processors is used.
+
+        """
+        format = img.format
+        optimized = optimize(processors, img)
+        debug = settings.IMAGEKIT_OPTIMIZER_DEBUG
+        if debug:
+            expected = ProcessorPipeline(processors).process(copy_image(img))
+        new_image = ProcessorPipeline(optimized).process(img)
+        if debug:
+            logger = get_logger()
+            logger.debug('Optimized processors of %s: %r -> %r'
+                         % (self, list(processors), optimized))
+            difference = get_difference(new_image, expected)
+            if difference > settings.IMAGEKIT_OPTIMIZER_TOLERANCE:
+                logger.warning(
+                    'The optimized processors of %s produced an image that'
+                    ' differs by %.2f: %r -> %r' % (
+                        self, difference, list(processors), optimized))
+                new_image = expected
+        # The format of the source is used if the spec doesn't have one.
+        new_image.format = new_image.format or format
+        return new_image
+
+
+_SOURCE_NAME_PLACEHOLDER = '\x00imagekit:source-name\x00'
+_JPEG_EXTENSIONS = ('.jpg', '.jpeg', '.jpe', '.jfif')
+_NON_JPEG_EXTENSIONS = ('.png', '.gif', '.webp', '.bmp', '.tif', '.tiff')
+_hash_templates = LRUCache(1000)
+_fingerprints = LRUCache(1000)
+
+
+def _is_plain_class_attr(cls, name):
+    for klass in cls.__mro__:
+        if name in klass.__dict__:
+            return not hasattr(klass.__dict__[name], '__get__')
+    return False
+
+
+def get_processor_fingerprint(processor):
+    fingerprint = getattr(processor, 'fingerprint', None)
+    if fingerprint is None:
+        return processor
+    if callable(fingerprint):
+        fingerprint = fingerprint()
+    return fingerprint
+
+
+_source_limit_stats = {}
+_source_limit_stats_lock = threading.Lock()
+
+
+def count_source_limit(name):
+    with _source_limit_stats_lock:
+        _source_limit_stats[name] = _source_limit_stats.get(name, 0) + 1
+
+
+def get_source_limit_stats():
+    """
+    Returns a dictionary counting how many times source images exceeded the
+    ``pixels`` and ``working_set`` limits in this process, and how they were
+    handled (``reject``, ``draft`` or ``custom``).
+
+    """
+    with _source_limit_stats_lock:
+        return dict(_source_limit_stats)
+
+
+def estimate_working_set(img, size=None):
+    """
+    Estimates the number of bytes needed to decode and process an image, from
+    its header: the decoded image (PIL uses four bytes per pixel for all but
+    single band images) and one processed copy of the same size. If ``size``
+    is given, it's used instead of the image's size.
+
+    """
+    width, height = size or img.size
+    bytes_per_pixel = 1 if img.mode in ('1', 'L', 'P') else 4
+    return width * height * bytes_per_pixel * 2
+
 
 def create_spec_class(class_attrs):
 
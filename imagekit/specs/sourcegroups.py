@@ -10,12 +10,12 @@ have two responsibilities:
 
 """
 
-from django.db.models.signals import post_init, post_save
+from django.db.models.signals import class_prepared, post_init, post_save
 from django.utils.functional import wraps
 import inspect
 from ..cachefiles import LazyImageCacheFile
 from ..signals import source_saved
-from ..utils import get_nonabstract_descendants
+from ..utils import get_nonabstract_descendants, share_source_image
 
 
 def ik_model_receiver(fn):
@@ -26,18 +26,17 @@ def ik_model_receiver(fn):
     """
     @wraps(fn)
     def receiver(self, sender, **kwargs):
-        if not inspect.isclass(sender):
-            return
-        for src in self._source_groups:
-            if issubclass(sender, src.model_class):
-                fn(self, sender=sender, **kwargs)
-
-                # If we find a match, return. We don't want to handle the signal
-                # more than once.
-                return
+        if inspect.isclass(sender) and self.get_class_source_fields(sender):
+            fn(self, sender=sender, **kwargs)
     return receiver
 
 
+def hash_source(value):
+    # Field files hash their names. The values that fields are initialized
+    # with may be names or files.
+    return hash(getattr(value, 'name', value))
+
+
 class ModelSignalRouter(object):
     """
     Normally, ``ImageFieldSourceGroup`` would be directly responsible for
@@ -54,12 +53,33 @@ class ModelSignalRouter(object):
 
     def __init__(self):
         self._source_groups = []
-        uid = 'ik_spec_field_receivers'
-        post_init.connect(self.post_init_receiver, dispatch_uid=uid)
-        post_save.connect(self.post_save_receiver, dispatch_uid=uid)
+        self._class_source_fields = {}
+        class_prepared.connect(self.class_prepared_receiver,
+                               dispatch_uid='ik_spec_field_receivers')
 
     def add(self, source_group):
         self._source_groups.append(source_group)
+        self._class_source_fields.clear()
+        for model_class in get_nonabstract_descendants(source_group.model_class):
+            self.connect_model(model_class)
+
+    def connect_model(self, model_class):
+        """
+        Connects the receivers to the signals of a model. They're only
+        connected to the models that have source fields (and their subclasses,
+        as they're prepared), so that loading other models doesn't cost
+        anything.
+
+        """
+        uid = 'ik_spec_field_receivers'
+        post_init.connect(self.post_init_receiver, sender=model_class,
+                          dispatch_uid=uid)
+        post_save.connect(self.post_save_receiver, sender=model_class,
+                          dispatch_uid=uid)
+
+    def class_prepared_receiver(self, sender, **kwargs):
+        if not sender._meta.abstract and self.get_class_source_fields(sender):
+            self.connect_model(sender)
 
     def init_instance(self, instance):
         instance._ik = getattr(instance, '_ik', {})
@@ -75,42 +95,76 @@ class ModelSignalRouter(object):
         instance._ik['source_hashes'] = dict(
             (attname, hash(getattr(instance, attname)))
             for attname in self.get_source_fields(instance))
+        instance._ik.pop('initial_sources', None)
         return instance._ik['source_hashes']
 
+    def get_source_hashes(self, instance):
+        """
+        Returns the hashes of the source files as they were when the instance
+        was loaded (or last saved). Those of sources that were loaded are only
+        computed when they're needed.
+
+        """
+        hashes = instance._ik.get('source_hashes')
+        if hashes is None:
+            hashes = dict(
+                (attname, hash_source(value)) for attname, value in
+                instance._ik.get('initial_sources', {}).items())
+        return hashes
+
     def get_source_fields(self, instance):
         """
-        Returns a list of the source fields for the given instance.
+        Returns a set of the source fields for the given instance.
 
         """
-        return set(src.image_field
-                   for src in self._source_groups
-                   if isinstance(instance, src.model_class))
+        return self.get_class_source_fields(instance.__class__)
+
+    def get_class_source_fields(self, model_class):
+        """
+        Returns a set of the source fields of a model class. It's looked up
+        once per class (until a source group is added), since it's needed
+        whenever any model instance is created.
+
+        """
+        try:
+            return self._class_source_fields[model_class]
+        except KeyError:
+            fields = frozenset(src.image_field
+                               for src in self._source_groups
+                               if issubclass(model_class, src.model_class))
+            self._class_source_fields[model_class] = fields
+            return fields
 
     @ik_model_receiver
     def post_save_receiver(self, sender, instance=None, created=False, update_fields=None, raw=False, **kwargs):
         if not raw:
             self.init_instance(instance)
-            old_hashes = instance._ik.get('source_hashes', {}).copy()
+            old_hashes = self.get_source_hashes(instance)
             new_hashes = self.update_source_hashes(instance)
             for attname in self.get_source_fields(instance):
                 if update_fields and attname not in update_fields:
                     continue
 
+                # The sources of new rows may be names of files that are
+                # already in storage, which hash the same as they were
+                # initialized with.
                 file = getattr(instance, attname)
-                if file and old_hashes.get(attname) != new_hashes[attname]:
+                if file and (created or
+                             old_hashes.get(attname) != new_hashes[attname]):
                     self.dispatch_signal(source_saved, file, sender, instance,
                                          attname)
 
     @ik_model_receiver
     def post_init_receiver(self, sender, instance=None, **kwargs):
+        # Only the values the source fields were initialized with are kept
+        # (deferred fields aren't loaded); they're hashed if the instance is
+        # saved.
         self.init_instance(instance)
-        source_fields = self.get_source_fields(instance)
-        local_fields = dict((field.name, field)
-                            for field in instance._meta.local_fields
-                            if field.name in source_fields)
-        instance._ik['source_hashes'] = dict(
-            (attname, hash(file_field))
-            for attname, file_field in local_fields.items())
+        values = instance.__dict__
+        instance._ik['initial_sources'] = dict(
+            (attname, values[attname])
+            for attname in self.get_source_fields(instance)
+            if attname in values)
 
     def dispatch_signal(self, signal, file, model_class, instance, attname):
         """
@@ -119,9 +173,20 @@ class ModelSignalRouter(object):
         important that we dispatch the signal for each.
 
         """
-        for source_group in self._source_groups:
-            if issubclass(model_class, source_group.model_class) and source_group.image_field == attname:
-                signal.send(sender=source_group, source=file)
+        source_groups = [
+            source_group for source_group in self._source_groups
+            if issubclass(model_class, source_group.model_class)
+            and source_group.image_field == attname]
+
+        # Each spec field has its own source group, so the specs of all of the
+        # groups share a single decoded copy of the source (and the results of
+        # the processors they start with, which the source group registry
+        # registers as it relays the signal to their strategies).
+        with share_source_image(file):
+            for source_group in source_groups:
+                get_source = getattr(source_group, 'get_source', None)
+                source = file if get_source is None else get_source(instance)
+                signal.send(sender=source_group, source=source)
 
 
 class ImageFieldSourceGroup(object):
@@ -147,6 +212,54 @@ class ImageFieldSourceGroup(object):
                 yield getattr(instance, self.image_field)
 
 
+class ImageSpecSourceGroup(object):
+    """
+    A source group that represents the generated files of an
+    ``ImageSpecField`` across all instances of a model and its subclasses, for
+    specs that are derived from another spec's output. Its signals are
+    dispatched when the image field at the start of the chain of specs
+    changes.
+
+    """
+    def __init__(self, model_class, spec_field):
+        self.model_class = model_class
+        self.spec_field = spec_field
+        signal_router.add(self)
+
+    @property
+    def image_field(self):
+        attname = self.spec_field
+        while True:
+            descriptor = _get_class_attr(self.model_class, attname)
+            source_field_name = getattr(descriptor, 'source_field_name', None)
+            if source_field_name is None:
+                return attname
+            attname = source_field_name
+
+    def get_source(self, instance):
+        """
+        Returns the (up-to-date) file generated by the spec for the instance.
+
+        """
+        # Forget the file cached by the descriptor, which may have been created
+        # for an earlier version of the image.
+        instance.__dict__.pop(self.spec_field, None)
+        return getattr(instance, self.spec_field)
+
+    def files(self):
+        for model in get_nonabstract_descendants(self.model_class):
+            for instance in model.objects.all().iterator():
+                yield getattr(instance, self.spec_field)
+
+
+def _get_class_attr(cls, name):
+    # Look up the attribute without invoking descriptors.
+    for klass in cls.__mro__:
+        if name in klass.__dict__:
+            return klass.__dict__[name]
+    return None
+
+
 class SourceGroupFilesGenerator(object):
     """
     A Python generator that yields cache file objects for source groups.
@@ -5,7 +5,7 @@ from django.utils.html import escape
 from django.utils.safestring import mark_safe
 
 from ..compat import parse_bits
-from ..cachefiles import ImageCacheFile
+from ..cachefiles import ImageCacheFile, use_prefetched_state
 from ..registry import generator_registry
 from ..lib import force_text
 
@@ -16,13 +16,25 @@ register = template.Library()
 ASSIGNMENT_DELIMETER = 'as'
 HTML_ATTRS_DELIMITER = '--'
 DEFAULT_THUMBNAIL_GENERATOR = 'imagekit:thumbnail'
+PREFETCHED_STATES_VARIABLE = 'imagekit_states'
 
 
 def get_cachefile(context, generator_id, generator_kwargs, source=None):
     generator_id = generator_id.resolve(context)
     kwargs = dict((k, v.resolve(context)) for k, v in generator_kwargs.items())
     generator = generator_registry.get(generator_id, **kwargs)
-    return ImageCacheFile(generator)
+    return create_cachefile(context, generator)
+
+
+def create_cachefile(context, generator):
+    """
+    Create a cache file for the generator, using the state of the file if it
+    was fetched ahead of time (with ``imagekit.cachefiles.prefetch_states()``)
+    and put in the context as ``imagekit_states``.
+
+    """
+    file = ImageCacheFile(generator)
+    return use_prefetched_state(file, context.get(PREFETCHED_STATES_VARIABLE))
 
 
 def parse_dimensions(dimensions):
@@ -36,6 +48,18 @@ def parse_dimensions(dimensions):
     return dict(width=width, height=height)
 
 
+def get_dimensions(file):
+    """
+    Returns the width and height attributes of an image, predicted without
+    generating or opening it when possible.
+
+    """
+    dimensions = file.predict_dimensions()
+    if dimensions is None:
+        dimensions = file.width, file.height
+    return dict(zip(('width', 'height'), dimensions))
+
+
 class GenerateImageAssignmentNode(template.Node):
 
     def __init__(self, variable_name, generator_id, generator_kwargs):
@@ -66,12 +90,15 @@ class GenerateImageTagNode(template.Node):
         attrs = dict((k, v.resolve(context)) for k, v in
                 self._html_attrs.items())
 
+        attrs['src'] = file.url
+
         # Only add width and height if neither is specified (to allow for
-        # proportional in-browser scaling).
-        if not 'width' in attrs and not 'height' in attrs:
-            attrs.update(width=file.width, height=file.height)
+        # proportional in-browser scaling). Placeholders for files that failed
+        # to generate don't have known dimensions.
+        if (not 'width' in attrs and not 'height' in attrs
+                and not file.get_placeholder_url()):
+            attrs.update(get_dimensions(file))
 
-        attrs['src'] = file.url
         attr_str = ' '.join('%s="%s"' % (escape(k), escape(v)) for k, v in
                 attrs.items())
         return mark_safe('<img %s />' % attr_str)
@@ -99,7 +126,7 @@ class ThumbnailAssignmentNode(template.Node):
         kwargs.update(parse_dimensions(self._dimensions.resolve(context)))
         generator = generator_registry.get(generator_id, **kwargs)
 
-        context[variable_name] = ImageCacheFile(generator)
+        context[variable_name] = create_cachefile(context, generator)
 
         return ''
 
@@ -122,17 +149,20 @@ class ThumbnailImageTagNode(template.Node):
         kwargs.update(dimensions)
         generator = generator_registry.get(generator_id, **kwargs)
 
-        file = ImageCacheFile(generator)
+        file = create_cachefile(context, generator)
 
         attrs = dict((k, v.resolve(context)) for k, v in
                 self._html_attrs.items())
 
+        attrs['src'] = file.url
+
         # Only add width and height if neither is specified (to allow for
-        # proportional in-browser scaling).
-        if not 'width' in attrs and not 'height' in attrs:
-            attrs.update(width=file.width, height=file.height)
+        # proportional in-browser scaling). Placeholders for files that failed
+        # to generate don't have known dimensions.
+        if (not 'width' in attrs and not 'height' in attrs
+                and not file.get_placeholder_url()):
+            attrs.update(get_dimensions(file))
 
-        attrs['src'] = file.url
         attr_str = ' '.join('%s="%s"' % (escape(k), escape(v)) for k, v in
                 attrs.items())
         return mark_safe('<img %s />' % attr_str)
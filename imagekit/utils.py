@@ -1,7 +1,12 @@
 from __future__ import unicode_literals
 import logging
+import os
 import re
-from tempfile import NamedTemporaryFile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from tempfile import NamedTemporaryFile, SpooledTemporaryFile
 from hashlib import md5
 
 from django.conf import settings
@@ -19,6 +24,8 @@ bad_memcached_key_chars = re.compile('[\u0000-\u001f\\s]+')
 
 _autodiscovered = False
 
+_shared_images = threading.local()
+
 def get_nonabstract_descendants(model):
     """ Returns all non-abstract descendants of the model. """
     if not model._meta.abstract:
@@ -143,6 +150,57 @@ def get_field_info(field_file):
     )
 
 
+def create_output_file():
+    """
+    Returns a file to write a generated image to. The file is kept in memory
+    until it grows larger than ``IMAGEKIT_OUTPUT_MAX_MEMORY_SIZE`` bytes, at
+    which point it's moved to a temporary file on disk.
+
+    """
+    return SpooledTemporaryFile(
+        max_size=settings.IMAGEKIT_OUTPUT_MAX_MEMORY_SIZE)
+
+
+def process_image(img, processors=None, format=None, autoconvert=True,
+                  options=None, outfile=None):
+    """
+    Like pilkit's ``process_image()``, but the image is written to ``outfile``
+    (by default, a file returned by ``create_output_file()``).
+
+    """
+    from pilkit.processors import ProcessorPipeline
+
+    original_format = img.format
+    img = ProcessorPipeline(processors or []).process(img)
+    format = format or img.format or original_format or 'JPEG'
+    if outfile is None:
+        outfile = create_output_file()
+    return save_image(img, outfile, format, options or {}, autoconvert)
+
+
+def get_content_size(content):
+    """
+    Returns the size of a file-like object without reading (and copying) its
+    contents.
+
+    """
+    getbuffer = getattr(content, 'getbuffer', None)
+    if getbuffer is not None:
+        buffer = getbuffer()
+        try:
+            return buffer.nbytes
+        finally:
+            # A BytesIO can't be resized while its buffer is exported.
+            release = getattr(buffer, 'release', None)
+            if release is not None:
+                release()
+    position = content.tell()
+    content.seek(0, os.SEEK_END)
+    size = content.tell()
+    content.seek(position)
+    return size
+
+
 def generate(generator):
     """
     Calls the ``generate()`` method of a generator instance, and then wraps the
@@ -153,12 +211,306 @@ def generate(generator):
     f = File(content)
     # The size of the File must be known or Django will try to open a file
     # without a name and raise an Exception.
-    f.size = len(content.read())
-    # After getting the size reset the file pointer for future reads.
+    f.size = get_content_size(content)
     content.seek(0)
     return f
 
 
+def copy_image(img):
+    """
+    Returns a copy of a PIL image that can be processed without affecting the
+    original. Unlike ``Image.copy()``, the copy keeps the format of the image
+    and, for JPEGs, access to its EXIF data, which processors may rely on.
+
+    """
+    new_img = img.copy()
+    new_img.format = img.format
+    getexif = getattr(img, '_getexif', None)
+    if getexif is not None:
+        new_img._getexif = getexif
+    return new_img
+
+
+@contextmanager
+def share_source_image(source):
+    """
+    A context manager within which image specs whose source is ``source``
+    process copies of a single decoded image instead of each decoding the
+    source file themselves. The source is only decoded if a spec needs it.
+
+    """
+    stack = _shared_images.__dict__.setdefault('stack', [])
+    if any(entry['source'] is source for entry in stack):
+        # The source is already being shared.
+        yield
+        return
+    entry = {'source': source, 'image': None, 'specs': [], 'spec_keys': set(),
+             'prefixes': None,
+             'intermediates': LRUCache(settings.IMAGEKIT_INTERMEDIATE_CACHE_SIZE)}
+    stack.append(entry)
+    try:
+        yield
+    finally:
+        stack.remove(entry)
+
+
+def _get_shared_entry(source):
+    for entry in reversed(getattr(_shared_images, 'stack', [])):
+        if entry['source'] is source:
+            return entry
+    return None
+
+
+def share_processor_prefixes(source, specs):
+    """
+    Tells the specs generated within ``share_source_image(source)`` about the
+    processors of ``specs``, so that the image produced by a list of
+    processors that starts several of them is only computed once (see
+    ``get_shared_intermediate()``). Specs created from the same registered
+    generator are only counted once.
+
+    """
+    entry = _get_shared_entry(source)
+    if entry is None or not settings.IMAGEKIT_INTERMEDIATE_CACHE_SIZE:
+        return
+    added = False
+    for spec in specs:
+        key = getattr(spec, '_ik_generator', (id(spec),))[0]
+        if key not in entry['spec_keys']:
+            entry['spec_keys'].add(key)
+            entry['specs'].append(spec)
+            added = True
+    if added:
+        # The shared prefixes are found when a spec is first generated.
+        entry['prefixes'] = None
+
+
+def _get_processor_keys(processors):
+    from .hashers import pickle
+    from .specs import get_processor_fingerprint
+
+    keys = []
+    for processor in processors:
+        try:
+            keys.append(pickle(get_processor_fingerprint(processor)))
+        except Exception:
+            # The processor can't be pickled, so it can't be compared.
+            keys.append(id(processor))
+    return keys
+
+
+def _find_shared_prefixes(specs):
+    prefixes = set()
+    keys = []
+    for spec in specs:
+        processors = getattr(spec, 'processors', None)
+        if isinstance(processors, (list, tuple)):
+            keys.append(_get_processor_keys(processors))
+    for i, a in enumerate(keys):
+        for b in keys[i + 1:]:
+            # The whole pipeline of a spec may be a prefix of another's, in
+            # which case its output is shared.
+            length = 0
+            while length < min(len(a), len(b)) and a[length] == b[length]:
+                length += 1
+            if length:
+                prefixes.add(tuple(a[:length]))
+    return prefixes
+
+
+class _StoreIntermediate(object):
+    # A processor that stores a copy of the image it's given.
+
+    def __init__(self, cache, key, format):
+        self.cache = cache
+        self.key = key
+        self.format = format
+
+    def process(self, img):
+        intermediate = copy_image(img)
+        intermediate.format = self.format
+        self.cache.set(self.key, intermediate)
+        return img
+
+
+def get_shared_intermediate(source, processors, check=None):
+    """
+    Returns an image to run ``processors`` on and the processors to run,
+    within ``share_source_image(source)``; ``None`` otherwise. If other specs
+    sharing the source start with the same processors (see
+    ``share_processor_prefixes()``), the image they produce is kept in a
+    bounded cache, and the longest prefix found in it is skipped. ``check`` is
+    called with the source image as with ``get_shared_source_image()``.
+
+    """
+    entry = _get_shared_entry(source)
+    if entry is None:
+        return None
+    processors = list(processors or [])
+    if not entry['specs'] or not processors:
+        img = get_shared_source_image(source, check=check)
+        return None if img is None else (img, processors)
+
+    if entry['prefixes'] is None:
+        entry['prefixes'] = _find_shared_prefixes(entry['specs'])
+    keys = _get_processor_keys(processors)
+    cache = entry['intermediates']
+
+    for length in range(len(processors), 0, -1):
+        prefix = tuple(keys[:length])
+        if prefix not in entry['prefixes']:
+            continue
+        intermediate = cache.get(prefix)
+        if intermediate is not None:
+            if check is not None and not check(entry['image']):
+                return None
+            img, start = copy_image(intermediate), length
+            break
+    else:
+        img = get_shared_source_image(source, check=check)
+        if img is None:
+            return None
+        start = 0
+
+    # Store the images produced by the shared prefixes that haven't been
+    # cached yet.
+    format = entry['image'].format
+    remaining = []
+    for length in range(start + 1, len(processors) + 1):
+        remaining.append(processors[length - 1])
+        prefix = tuple(keys[:length])
+        if prefix in entry['prefixes']:
+            remaining.append(_StoreIntermediate(cache, prefix, format))
+    return img, remaining
+
+
+def get_shared_source_image(source, check=None):
+    """
+    Returns a copy of the decoded image shared for ``source`` (see
+    ``share_source_image()``), or ``None`` if it isn't being shared. If given,
+    ``check`` is called with the image before it's decoded (when only its
+    header has been read); if it returns ``False``, the image isn't decoded
+    and ``None`` is returned.
+
+    """
+    for entry in reversed(getattr(_shared_images, 'stack', [])):
+        if entry['source'] is source:
+            img = entry['image']
+            if img is None:
+                closed = source.closed
+                if closed:
+                    source.open()
+                try:
+                    img = open_image(source)
+                    if check is not None and not check(img):
+                        return None
+                    img.load()
+                finally:
+                    if closed:
+                        source.close()
+                entry['image'] = img
+            elif check is not None and not check(img):
+                return None
+            return copy_image(img)
+    return None
+
+
+def generate_all(source, generator_ids, force=False):
+    """
+    Generates the files of several generators (typically specs) that share a
+    source, decoding the source image only once (and running the processors
+    that they start with only once). Returns the cache files.
+
+    """
+    from .cachefiles import ImageCacheFile, prefetch_states
+    from .registry import generator_registry
+
+    files = [ImageCacheFile(generator_registry.get(id, source=source))
+             for id in generator_ids]
+    prefetch_states(files)
+    with share_source_image(source):
+        share_processor_prefixes(source, [file.generator for file in files])
+        for file in files:
+            file.generate(force=force)
+    return files
+
+
+def get_source_digest(source):
+    """
+    Returns a hex digest of the contents of ``source``, computed with the
+    ``IMAGEKIT_HASH_FUNCTION`` hash. The digest is remembered by the file
+    object and, for files that have been saved, in the cache (by name, size
+    and modification time, so that files that are overwritten get a new
+    digest) so that each file is only read once.
+
+    """
+    name = getattr(source, 'name', None)
+    remembered = getattr(source, '_ik_digest', None)
+    if remembered is not None and remembered[0] == name:
+        return remembered[1]
+
+    key = digest = None
+    if name and getattr(source, '_committed', True):
+        version = _get_file_version(source)
+        if version is not None:
+            key = sanitize_cache_key('%sdigest:%s:%s:%s' % (
+                settings.IMAGEKIT_CACHE_PREFIX,
+                settings.IMAGEKIT_HASH_FUNCTION, name, version))
+            digest = get_cache().get(key)
+    if digest is None:
+        digest = _read_digest(source)
+        if key is not None:
+            get_cache().set(key, digest, settings.IMAGEKIT_CACHE_TIMEOUT)
+    remember_source_digest(source, digest)
+    return digest
+
+
+def _get_file_version(source):
+    # The size and modification time of a file in its storage, which change
+    # when it's overwritten, or ``None`` if the storage doesn't tell them.
+    storage = getattr(source, 'storage', None)
+    if storage is None:
+        return None
+    get_modified_time = (getattr(storage, 'get_modified_time', None)
+                         or getattr(storage, 'modified_time', None))
+    try:
+        return '%s:%s' % (storage.size(source.name),
+                          get_modified_time(source.name).isoformat())
+    except (AttributeError, NotImplementedError, TypeError,
+            EnvironmentError):
+        return None
+
+
+def remember_source_digest(source, digest):
+    """
+    Records the digest of ``source``'s contents (for example, one loaded from
+    the database) so that ``get_source_digest()`` doesn't need to compute it.
+
+    """
+    try:
+        source._ik_digest = (getattr(source, 'name', None), digest)
+    except AttributeError:
+        pass
+
+
+def _read_digest(source):
+    from .hashers import get_hash_function
+
+    hash = get_hash_function()()
+    closed = source.closed
+    if closed:
+        source.open()
+    try:
+        chunks = getattr(source, 'chunks', None) or File(source).chunks
+        for chunk in chunks():
+            hash.update(chunk)
+        source.seek(0)
+    finally:
+        if closed:
+            source.close()
+    return hash.hexdigest()
+
+
 def call_strategy_method(file, method_name):
     strategy = getattr(file, 'cachefile_strategy', None)
     fn = getattr(strategy, method_name, None)
@@ -189,3 +541,63 @@ def sanitize_cache_key(key):
 
         key = new_key
     return key
+
+
+class LRUCache(object):
+    """
+    A bounded, thread-safe, in-memory cache that discards the least recently
+    used entries once it holds ``max_size`` of them. If a ``timeout`` (in
+    seconds) is given, entries also expire that long after they're set (which
+    can be overridden per entry).
+
+    """
+    def __init__(self, max_size, timeout=None):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, expires = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires is not None and expires <= time.time():
+                self.misses += 1
+                return default
+            # Re-insert the entry to mark it as the most recently used.
+            self._data[key] = (value, expires)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, timeout=None):
+        if self.max_size <= 0:
+            return
+        timeout = timeout or self.timeout
+        expires = time.time() + timeout if timeout else None
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, expires)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._data),
+                'max_size': self.max_size,
+            }
@@ -41,7 +41,8 @@ setup(
     maintainer_email='bryan@revyver.com',
     license='BSD',
     url='http://github.com/matthewwithanm/django-imagekit/',
-    packages=find_packages(exclude=['*.tests', '*.tests.*', 'tests.*', 'tests']),
+    packages=find_packages(exclude=['*.tests', '*.tests.*', 'tests.*', 'tests',
+                                    'benchmarks', 'benchmarks.*']),
     zip_safe=False,
     include_package_data=True,
     tests_require=[
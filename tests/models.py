@@ -2,7 +2,7 @@ from django.db import models
 
 from imagekit import ImageSpec
 from imagekit.models import ProcessedImageField
-from imagekit.models import ImageSpecField
+from imagekit.models import ImageSpecField, ImageSpecManager, SourceDigestField
 from imagekit.processors import Adjust, ResizeToFill, SmartCrop
 
 
@@ -28,6 +28,40 @@ class Photo(models.Model):
             sharpness=1.1), SmartCrop(50, 50)], source='original_image',
             format='JPEG', options={'quality': 90})
 
+    objects = ImageSpecManager()
+
+
+class DerivedSpecModel(models.Model):
+    original_image = models.ImageField(upload_to='photos')
+
+    # Derived from a spec that's defined after it
+    thumbnail = ImageSpecField([ResizeToFill(20, 20)], source='medium',
+                               format='JPEG')
+
+    medium = ImageSpecField([ResizeToFill(100, 100)],
+                            source='original_image', format='JPEG')
+
+
+class DigestModel(models.Model):
+    original_image = models.ImageField(upload_to='photos')
+    original_image_digest = SourceDigestField(source='original_image')
+    thumbnail = ImageSpecField([ResizeToFill(20, 20)],
+                               source='original_image', format='JPEG')
+
+
+class DigestFirstModel(models.Model):
+    original_image_digest = SourceDigestField(source='original_image')
+    original_image = models.ImageField(upload_to='photos')
+
+
+class MetadataModel(models.Model):
+    original_image = models.ImageField(upload_to='photos')
+    thumbnail_metadata = models.TextField(blank=True, editable=False)
+    thumbnail = ImageSpecField([ResizeToFill(20, 10)],
+                               source='original_image', format='JPEG',
+                               cachefile_strategy='imagekit.cachefiles.strategies.Optimistic',
+                               metadata_field='thumbnail_metadata')
+
 
 class ProcessedImageFieldModel(models.Model):
     processed = ProcessedImageField([SmartCrop(50, 50)], format='JPEG',
@@ -0,0 +1,92 @@
+import mock
+from imagekit import generate_for_queryset, invalidate
+from imagekit.bulk import update_metadata
+from imagekit.cachefiles.backends import CacheFileState
+from nose.tools import eq_, assert_false, assert_true
+from .models import ConcreteImageModel, MetadataModel, Photo
+from .utils import clear_imagekit_cache, create_instance, create_photo
+
+
+def test_generate_for_queryset():
+    """
+    Ensure that the spec files of a queryset are generated in chunks, and that
+    existing files are skipped.
+
+    """
+    clear_imagekit_cache()
+    Photo.objects.all().delete()
+    for i in range(3):
+        create_photo('bulk-%s.jpg' % i)
+
+    eq_(generate_for_queryset(Photo.objects.all(), chunk_size=2), 6)
+    for photo in Photo.objects.all():
+        for file in [photo.thumbnail, photo.smartcropped_thumbnail]:
+            assert_true(file.storage.exists(file.name))
+    eq_(generate_for_queryset(Photo.objects.all(), ['tests:photo:thumbnail']),
+        0)
+
+
+def test_generate_for_queryset_workers():
+    """
+    Ensure that, with workers, the jobs of each source are run together in the
+    worker processes.
+
+    """
+    clear_imagekit_cache()
+    Photo.objects.all().delete()
+    for i in range(2):
+        create_photo('bulk-workers-%s.jpg' % i)
+
+    with mock.patch('imagekit.cachefiles.jobs.GenerationPool.map_batches',
+                    return_value=4) as map_batches, \
+            mock.patch('imagekit.cachefiles.jobs.GenerationPool.close'):
+        eq_(generate_for_queryset(Photo.objects.all(), workers=2), 4)
+    batches = list(map_batches.call_args[0][0])
+    eq_([len(jobs) for jobs in batches], [2, 2])
+    eq_(set(job['source'] for job in batches[0]), set([batches[0][0]['source']]))
+
+
+def test_invalidate():
+    """
+    Ensure that invalidating the files of a queryset forgets their states and
+    tells their strategies that the sources were saved.
+
+    """
+    clear_imagekit_cache()
+    ConcreteImageModel.objects.all().delete()
+    instances = [create_instance(ConcreteImageModel, 'bulk-%s.jpg' % i)
+                 for i in range(2)]
+    file = instances[0].abstract_class_spec
+    file.generate()
+    assert_true(file.storage.exists(file.name))
+    strategy = file.cachefile_strategy
+    count = strategy.on_source_saved_count
+
+    eq_(invalidate(ConcreteImageModel.objects.all()), 2)
+    eq_(strategy.on_source_saved_count, count + 2)
+    eq_(file.cachefile_backend.get_state(file, check_if_unknown=False),
+        CacheFileState.DOES_NOT_EXIST)
+    # The files are deleted, so they aren't found once the states expire.
+    assert_false(file.storage.exists(file.name))
+
+
+def test_generate_for_queryset_metadata():
+    """
+    Ensure that the metadata fields of the generated files are updated.
+
+    """
+    clear_imagekit_cache()
+    instance = create_instance(MetadataModel, 'bulk-metadata.jpg')
+    MetadataModel.objects.update(thumbnail_metadata='')
+    generate_for_queryset(MetadataModel.objects.all())
+    eq_(MetadataModel.objects.get(pk=instance.pk).thumbnail_metadata,
+        instance.thumbnail_metadata)
+
+    # The states of the files are looked up together.
+    backend = instance.thumbnail.cachefile_backend
+    instances = list(MetadataModel.objects.all())
+    cache = mock.Mock(**{'get_many.return_value': {}})
+    with mock.patch.object(backend, '_cache', cache):
+        update_metadata(instances, MetadataModel)
+    eq_(cache.get.call_count, 0)
+    eq_(cache.get_many.call_count, 1)
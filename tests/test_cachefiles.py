@@ -1,14 +1,20 @@
 import mock
+import threading
+import time
 from django.conf import settings
+from django.test.utils import override_settings
 from hashlib import md5
-from imagekit.cachefiles import ImageCacheFile, LazyImageCacheFile
-from imagekit.cachefiles.backends import Simple
+from imagekit.cachefiles import (ImageCacheFile, LazyImageCacheFile,
+                                  prefetch_states)
+from imagekit.cachefiles.backends import (Simple, CacheFileState, ThreadPool,
+                                         BaseAsync, batch_generation)
 from imagekit.lib import force_bytes
-from nose.tools import raises, eq_
+from imagekit.utils import generate
+from nose.tools import raises, eq_, assert_raises, assert_true
 from .imagegenerators import TestSpec
 from .utils import (assert_file_is_truthy, assert_file_is_falsy,
                     DummyAsyncCacheFileBackend, get_unique_image_file,
-                    get_image_file)
+                    get_image_file, pickleback)
 
 
 def test_no_source_falsiness():
@@ -113,3 +119,376 @@ def test_lazyfile_stringification():
     file.name = 'a.jpg'
     eq_(str(file), 'a.jpg')
     eq_(repr(file), '<ImageCacheFile: a.jpg>')
+
+
+def test_get_states_batches_lookups():
+    """
+    Ensure that the states of several files are looked up with a single cache
+    query and that only the unknown files hit the storage.
+
+    """
+    backend = Simple()
+    files = [ImageCacheFile(TestSpec(source=get_unique_image_file()),
+                            cachefile_backend=backend) for i in range(3)]
+    backend.set_state(files[0], CacheFileState.EXISTS)
+
+    storage = files[0].storage
+    with mock.patch.object(backend.cache, 'get_many',
+                           wraps=backend.cache.get_many) as get_many, \
+            mock.patch.object(storage, 'exists', return_value=False) as exists:
+        states = backend.get_states(files)
+
+    eq_(get_many.call_count, 1)
+    eq_(exists.call_count, 2)
+    eq_(states, [CacheFileState.EXISTS, CacheFileState.DOES_NOT_EXIST,
+                 CacheFileState.DOES_NOT_EXIST])
+    eq_(backend.exists_many(files), [True, False, False])
+
+
+def test_prefetched_states():
+    """
+    Ensure that states fetched ahead of time are used instead of querying the
+    cache.
+
+    """
+    backend = DummyAsyncCacheFileBackend()
+    file = ImageCacheFile(TestSpec(source=get_unique_image_file()),
+                          cachefile_backend=backend)
+    backend.set_state(file, CacheFileState.EXISTS)
+    eq_(prefetch_states([file]), {file.name: CacheFileState.EXISTS})
+
+    with mock.patch.object(backend.cache, 'get') as get:
+        assert_file_is_truthy(file)
+    eq_(get.called, False)
+
+
+def test_generation_lock_contention():
+    """
+    Ensure that a backend using the generation lock doesn't generate a file
+    while another process holds the lock for it.
+
+    """
+    backend = Simple()
+    backend.generation_lock = True
+    backend.generation_lock_wait = 0
+    file = ImageCacheFile(TestSpec(source=get_unique_image_file()),
+                          cachefile_backend=backend)
+    backend.set_state(file, CacheFileState.DOES_NOT_EXIST)
+    token = backend.acquire_lock(file)
+
+    with mock.patch.object(file, '_generate') as generate:
+        backend.generate_now(file)
+    eq_(generate.called, False)
+    eq_(backend.get_lock_stats().get('contended'), 1)
+
+    backend.release_lock(file, token)
+    with mock.patch.object(file, '_generate') as generate:
+        backend.generate_now(file)
+    eq_(generate.call_count, 1)
+    eq_(backend.cache.get(backend.get_lock_key(file)), None)
+
+
+@override_settings(IMAGEKIT_LOCAL_STATE_CACHE_SIZE=10)
+def test_local_state_cache():
+    """
+    Ensure that known-to-exist files are remembered in-process and that new
+    states invalidate the local cache.
+
+    """
+    backend = Simple()
+    file = ImageCacheFile(TestSpec(source=get_unique_image_file()),
+                          cachefile_backend=backend)
+    backend.set_state(file, CacheFileState.EXISTS)
+
+    with mock.patch.object(backend.cache, 'get') as get:
+        eq_(backend.get_state(file), CacheFileState.EXISTS)
+    eq_(get.called, False)
+    eq_(backend.get_local_cache_stats()['hits'], 1)
+
+    backend.set_state(file, CacheFileState.GENERATING)
+    eq_(backend.get_state(file), CacheFileState.GENERATING)
+
+
+def test_failed_generation_backoff():
+    """
+    Ensure that a file that fails to generate is marked as failed and isn't
+    retried until its backoff period is over.
+
+    """
+    backend = Simple()
+    file = ImageCacheFile(TestSpec(source=get_unique_image_file()),
+                          cachefile_backend=backend)
+    backend.set_state(file, CacheFileState.DOES_NOT_EXIST)
+
+    with mock.patch.object(file, '_generate', side_effect=SyntaxError) as generate:
+        assert_raises(SyntaxError, backend.generate_now, file)
+        backend.generate_now(file)
+    eq_(generate.call_count, 1)
+
+    record = backend.get_state_record(file)
+    eq_(record['state'], CacheFileState.FAILED)
+    eq_(record['attempts'], 1)
+    eq_(record['error'], '%s.%s' % (SyntaxError.__module__, SyntaxError.__name__))
+    assert_true(file.failed)
+
+    with override_settings(IMAGEKIT_FAILED_PLACEHOLDER_URL='/failed.png'):
+        eq_(file.url, '/failed.png')
+
+    # Forced retries count as attempts.
+    with mock.patch.object(file, '_generate', side_effect=SyntaxError):
+        assert_raises(SyntaxError, backend.generate_now, file, force=True)
+    eq_(backend.get_state_record(file)['attempts'], 2)
+
+
+def test_transient_generation_error():
+    """
+    Ensure that a file isn't marked as failed when generating it raises an
+    error that isn't one of the failure exceptions, like a storage error.
+
+    """
+    backend = Simple()
+    file = ImageCacheFile(TestSpec(source=get_unique_image_file()),
+                          cachefile_backend=backend)
+    backend.set_state(file, CacheFileState.DOES_NOT_EXIST)
+
+    with mock.patch.object(file, '_generate', side_effect=IOError) as generate:
+        assert_raises(IOError, backend.generate_now, file)
+        assert_raises(IOError, backend.generate_now, file)
+    eq_(generate.call_count, 2)
+    eq_(backend.get_state(file, check_if_unknown=False),
+        CacheFileState.DOES_NOT_EXIST)
+
+
+def test_overridden_get_state():
+    """
+    Ensure that backends that override ``get_state()`` are consulted through
+    it before generating files.
+
+    """
+    class Backend(Simple):
+        def get_state(self, file, check_if_unknown=True):
+            return CacheFileState.EXISTS
+
+    backend = Backend()
+    file = ImageCacheFile(TestSpec(source=get_unique_image_file()),
+                          cachefile_backend=backend)
+    with mock.patch.object(file, '_generate') as generate:
+        backend.generate_now(file)
+    eq_(generate.call_count, 0)
+
+
+def test_threadpool_backend():
+    """
+    Ensure that the thread pool backend generates files in the background and
+    doesn't schedule a file that's already pending.
+
+    """
+    backend = ThreadPool()
+    file = ImageCacheFile(TestSpec(source=get_unique_image_file()),
+                          cachefile_backend=backend)
+    with mock.patch.object(backend, 'generate_now') as generate_now:
+        backend.schedule_generation(file)
+        backend.schedule_generation(file)
+        backend.join()
+    eq_(generate_now.call_count, 1)
+
+    stats = backend.get_stats()
+    eq_(stats['processed'], 1)
+    eq_(stats['deduplicated'], 1)
+    eq_(stats['pending'], 0)
+
+    backend.shutdown()
+    pickleback(backend)
+
+
+def test_threadpool_backend_forced_generation():
+    """
+    Ensure that a forced generation upgrades the queued one for the same file.
+
+    """
+    backend = ThreadPool()
+    backend.workers = 1
+    busy = ImageCacheFile(TestSpec(source=get_unique_image_file()),
+                          cachefile_backend=backend)
+    file = ImageCacheFile(TestSpec(source=get_unique_image_file()),
+                          cachefile_backend=backend)
+    started, release = threading.Event(), threading.Event()
+
+    def generate_now(file, force=False):
+        started.set()
+        release.wait(5)
+
+    with mock.patch.object(backend, 'generate_now',
+                           side_effect=generate_now) as mocked:
+        backend.schedule_generation(busy)
+        started.wait(5)
+        backend.schedule_generation(file)
+        backend.schedule_generation(file, force=True)
+        release.set()
+        backend.join()
+    eq_(mocked.call_args_list[-1], mock.call(file, force=True))
+    backend.shutdown()
+
+
+def test_threadpool_backend_shutdown_timeout():
+    """
+    Ensure that shutting down doesn't wait past its timeout when the queue is
+    full.
+
+    """
+    backend = ThreadPool()
+    backend.workers = 1
+    backend.max_queue_size = 1
+    files = [ImageCacheFile(TestSpec(source=get_unique_image_file()),
+                            cachefile_backend=backend) for i in range(2)]
+    started, release = threading.Event(), threading.Event()
+
+    def generate_now(file, force=False):
+        started.set()
+        release.wait(5)
+
+    with mock.patch.object(backend, 'generate_now', side_effect=generate_now):
+        backend.schedule_generation(files[0])
+        started.wait(5)
+        backend.schedule_generation(files[1])
+        start = time.time()
+        backend.shutdown(timeout=0.1)
+        assert_true(time.time() - start < 1)
+        release.set()
+        backend.join()
+
+
+def test_batch_generation():
+    """
+    Ensure that files scheduled in a batch are handed to the backend together
+    when the outermost batch ends, and that files scheduled twice are only
+    scheduled once.
+
+    """
+    backend = BaseAsync()
+    files = [ImageCacheFile(TestSpec(source=get_unique_image_file()),
+                            cachefile_backend=backend) for i in range(2)]
+    with mock.patch.object(backend, 'schedule_batch') as schedule_batch:
+        with batch_generation(on_commit=False):
+            with batch_generation(on_commit=False):
+                for file in files + files:
+                    file.generate()
+            eq_(schedule_batch.call_count, 0)
+        schedule_batch.assert_called_once_with(files)
+
+
+def test_batch_generation_on_commit():
+    """
+    Ensure that batches are scheduled when the transaction is committed.
+
+    """
+    backend = BaseAsync()
+    file = ImageCacheFile(TestSpec(source=get_unique_image_file()),
+                          cachefile_backend=backend)
+    with mock.patch('django.db.transaction.on_commit') as on_commit:
+        with mock.patch.object(backend, 'schedule_batch') as schedule_batch:
+            with batch_generation():
+                file.generate()
+            eq_(schedule_batch.call_count, 0)
+            on_commit.call_args[0][0]()
+            schedule_batch.assert_called_once_with([file])
+
+
+def test_batch_generation_middleware_recovers():
+    """
+    Ensure that a batch that the old-style middleware began for a request
+    whose response it never saw doesn't leak into the next request.
+
+    """
+    from imagekit.middleware import BatchGenerationMiddleware
+
+    backend = BaseAsync()
+    files = [ImageCacheFile(TestSpec(source=get_unique_image_file()),
+                            cachefile_backend=backend) for i in range(2)]
+    middleware = BatchGenerationMiddleware()
+    with mock.patch.object(backend, 'schedule_batch') as schedule_batch:
+        middleware.process_request(None)
+        files[0].generate()
+        # The response of the first request never reaches the middleware.
+        middleware.process_request(None)
+        schedule_batch.assert_called_once_with([files[0]])
+        files[1].generate()
+        middleware.process_response(None, None)
+        eq_(schedule_batch.call_count, 2)
+        schedule_batch.assert_called_with([files[1]])
+
+        # Files aren't buffered after the request.
+        with mock.patch.object(backend, 'schedule_generation') as schedule:
+            files[1].generate()
+        eq_(schedule.call_count, 1)
+
+
+@override_settings(IMAGEKIT_OUTPUT_MAX_MEMORY_SIZE=1)
+def test_large_output_is_spooled():
+    """
+    Ensure that generated images larger than the memory limit are written to
+    disk, and that their size is known without reading them.
+
+    """
+    spec = TestSpec(source=get_unique_image_file())
+    content = generate(spec)
+    assert_true(content.file._rolled)
+    eq_(content.size, len(content.read()))
+
+
+@override_settings(IMAGEKIT_RETAIN_GENERATED_CONTENT=False)
+def test_generated_content_not_retained():
+    file = ImageCacheFile(TestSpec(source=get_unique_image_file()))
+    file.generate()
+    eq_(getattr(file, '_file', None), None)
+    assert_true(file.storage.exists(file.name))
+
+
+def test_dimensions_recorded_with_state():
+    """
+    Ensure that the dimensions and size of a generated file are recorded with
+    its state, so that they're known without opening the file.
+
+    """
+    source = get_unique_image_file()
+    file = ImageCacheFile(TestSpec(source=source))
+    file.generate()
+    size = file.storage.size(file.name)
+    record = file.cachefile_backend.get_state_record(file)
+    eq_((record['width'], record['height'], record['size']),
+        (file.width, file.height, size))
+
+    file = ImageCacheFile(TestSpec(source=source))
+    with mock.patch.object(file.storage, 'open') as open, \
+            mock.patch.object(file.storage, 'size') as storage_size:
+        eq_((file.width, file.height, file.size),
+            (record['width'], record['height'], size))
+    eq_(open.call_count + storage_size.call_count, 0)
+
+
+@override_settings(IMAGEKIT_URL_CACHE_TIMEOUT=60, IMAGEKIT_URL_CACHE_SHARED=True)
+def test_url_cache():
+    """
+    Ensure that the URLs of cache files are cached in the process and in the
+    shared cache, unless the spec disables it.
+
+    """
+    from imagekit.cachefiles import get_url_cache
+    from imagekit.utils import get_cache
+
+    get_url_cache().clear()
+    source = get_unique_image_file()
+    file = ImageCacheFile(TestSpec(source=source))
+    file.generate()
+    url = file.url
+    with mock.patch.object(file.storage, 'url') as storage_url:
+        eq_(ImageCacheFile(TestSpec(source=source)).url, url)
+        get_url_cache().clear()
+        eq_(ImageCacheFile(TestSpec(source=source)).url, url)
+        eq_(storage_url.call_count, 0)
+
+        spec = TestSpec(source=source)
+        spec.cachefile_url_timeout = 0
+        ImageCacheFile(spec).url
+        eq_(storage_url.call_count, 1)
+    get_cache().clear()
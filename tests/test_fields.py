@@ -1,14 +1,23 @@
+import json
+import mock
+import os
 from django import forms
 from django.core.files.base import File
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test.utils import override_settings
 from imagekit import forms as ikforms
+from imagekit.cachefiles.jobs import describe, load
+from imagekit.lib import Image
+from imagekit.signals import source_saved
+from imagekit.specs.sourcegroups import ImageSpecSourceGroup
 from imagekit.processors import SmartCrop
-from nose.tools import eq_
+from nose.tools import eq_, assert_true
 from . import imagegenerators  # noqa
 from .models import (ProcessedImageFieldModel,
                      ProcessedImageFieldWithSpecModel,
-                     ImageModel)
-from .utils import get_image_file
+                     ImageModel, DerivedSpecModel, DigestModel,
+                     DigestFirstModel)
+from .utils import get_image_file, create_instance, clear_imagekit_cache
 
 
 def test_model_processedimagefield():
@@ -47,3 +56,170 @@ def test_form_processedimagefield():
 
     eq_(instance.image.width, 50)
     eq_(instance.image.height, 50)
+
+
+def test_spec_derived_from_spec():
+    """
+    Ensure that a spec can use the file generated by another spec as its
+    source, and that the upstream file is generated first.
+
+    """
+    clear_imagekit_cache()
+    instance = create_instance(DerivedSpecModel, 'derived.jpg')
+    thumbnail, medium = instance.thumbnail, instance.medium
+    eq_(thumbnail.generator.source.name, medium.name)
+    # The name depends on the upstream file's name (and so on its hash).
+    assert_true(os.path.splitext(medium.name)[0] in thumbnail.name)
+
+    thumbnail.generate()
+    assert_true(medium.storage.exists(medium.name))
+    eq_(Image.open(thumbnail.storage.open(thumbnail.name)).size, (20, 20))
+
+    # The file can also be generated from a job.
+    job = describe(thumbnail)
+    eq_(job['source'][0], 'cachefile')
+    eq_(load(job).name, thumbnail.name)
+
+
+def test_derived_spec_source_saved():
+    """
+    Ensure that saving the image field dispatches ``source_saved`` to the
+    derived spec's source group, with the upstream file as the source.
+
+    """
+    receiver = mock.Mock()
+    source_saved.connect(receiver)
+    try:
+        instance = create_instance(DerivedSpecModel, 'derived-saved.jpg')
+    finally:
+        source_saved.disconnect(receiver)
+    sources = dict((kwargs['sender'].__class__, kwargs['source'])
+                   for args, kwargs in receiver.call_args_list)
+    eq_(sources[ImageSpecSourceGroup].name, instance.medium.name)
+
+
+@override_settings(
+    IMAGEKIT_SPEC_CACHEFILE_NAMER='imagekit.cachefiles.namers.source_digest')
+def test_identical_sources_share_cache_files():
+    """
+    Ensure that the digest of the source is stored when the model is saved,
+    and that sources with identical contents share their cache files.
+
+    """
+    clear_imagekit_cache()
+    first = create_instance(DigestModel, 'first.jpg')
+    second = create_instance(DigestModel, 'second.jpg')
+    eq_(len(first.original_image_digest), 32)
+    eq_(first.original_image_digest, second.original_image_digest)
+    eq_(first.thumbnail.name, second.thumbnail.name)
+    assert_true(first.original_image_digest in first.thumbnail.name)
+
+    # The stored digest is used rather than reading the file again.
+    instance = DigestModel.objects.get(pk=first.pk)
+    with mock.patch('imagekit.utils._read_digest') as read_digest:
+        eq_(instance.thumbnail.name, first.thumbnail.name)
+    eq_(read_digest.call_count, 0)
+
+
+def test_source_digest_field_declared_first():
+    """
+    Ensure that the digest is remembered under the name the source is saved
+    with, even if the digest field is declared before the source field.
+
+    """
+    from imagekit.utils import get_source_digest
+
+    instance = DigestFirstModel.objects.create(
+        original_image=File(get_image_file(), name='digest-first.jpg'))
+    with mock.patch('imagekit.utils._read_digest') as read_digest:
+        eq_(get_source_digest(instance.original_image),
+            instance.original_image_digest)
+    eq_(read_digest.call_count, 0)
+
+
+def test_overwritten_source_digest():
+    """
+    Ensure that a file that's overwritten under the same name gets a new
+    digest.
+
+    """
+    from django.core.files.base import ContentFile
+    from django.core.files.storage import default_storage
+    from imagekit.utils import get_source_digest
+
+    clear_imagekit_cache()
+    name = default_storage.save('overwritten.jpg', ContentFile(b'first'))
+    try:
+        digests = []
+        for content in [b'first', b'second!']:
+            if digests:
+                default_storage.delete(name)
+                eq_(default_storage.save(name, ContentFile(content)), name)
+            source = default_storage.open(name)
+            source.storage = default_storage
+            digests.append(get_source_digest(source))
+        assert digests[0] != digests[1]
+    finally:
+        default_storage.delete(name)
+
+
+def test_prefetch_specs():
+    """
+    Ensure that prefetching the spec files of a queryset generates the
+    missing ones and attaches them, with their states, to the instances.
+
+    """
+    from imagekit.cachefiles.backends import CachedFileBackend
+    from .models import Photo
+    from .utils import create_photo
+
+    clear_imagekit_cache()
+    Photo.objects.all().delete()
+    for i in range(3):
+        create_photo('prefetch-%s.jpg' % i)
+
+    photos = list(Photo.objects.prefetch_specs('thumbnail',
+                                               'smartcropped_thumbnail'))
+    eq_(len(photos), 3)
+    with mock.patch.object(CachedFileBackend, 'cache',
+                           new_callable=mock.PropertyMock) as cache:
+        for photo in photos:
+            for file in [photo.__dict__['thumbnail'],
+                         photo.__dict__['smartcropped_thumbnail']]:
+                assert_true(file.storage.exists(file.name))
+                assert_true(file.url)
+                eq_(file.width, 50)
+    eq_(cache.call_count, 0)
+
+
+def test_spec_metadata_field():
+    """
+    Ensure that the metadata of the generated file is stored on the row when
+    the source is saved, and that it's trusted when the instance is loaded.
+
+    """
+    from imagekit.cachefiles.backends import CachedFileBackend
+    from .models import MetadataModel
+
+    clear_imagekit_cache()
+    instance = create_instance(MetadataModel, 'metadata.jpg')
+    stored = MetadataModel.objects.get(pk=instance.pk)
+    eq_(stored.thumbnail_metadata, instance.thumbnail_metadata)
+    metadata = json.loads(stored.thumbnail_metadata)
+    eq_((metadata['width'], metadata['height']), (20, 10))
+
+    with mock.patch.object(CachedFileBackend, 'cache',
+                           new_callable=mock.PropertyMock) as cache, \
+            mock.patch('imagekit.specs.ImageSpec.get_hash_for') as get_hash:
+        eq_(stored.thumbnail.name, metadata['name'])
+        assert_true(stored.thumbnail.url)
+        eq_((stored.thumbnail.width, stored.thumbnail.height), (20, 10))
+        eq_(stored.thumbnail.size, metadata['size'])
+    eq_(cache.call_count, 0)
+    eq_(get_hash.call_count, 0)
+
+    # Metadata that doesn't match the source is ignored.
+    stored.thumbnail_metadata = json.dumps(dict(metadata, source='other.jpg'))
+    stored.__dict__.pop('thumbnail')
+    eq_(stored.thumbnail.name, metadata['name'])
+    assert_true(stored.thumbnail.__dict__.get('_prefetched_state') is None)
@@ -0,0 +1,96 @@
+from django.core.files import File
+from django.core.files.storage import default_storage
+from imagekit.cachefiles import ImageCacheFile
+import mock
+from imagekit.cachefiles import jobs
+from imagekit.cachefiles.jobs import (describe, load, run_batch,
+                                      GenerationPool)
+from imagekit.registry import generator_registry
+from nose.tools import eq_, assert_true
+from .utils import create_photo, clear_imagekit_cache
+
+
+def test_describe_spec_field_file():
+    """
+    Ensure that the file of an ImageSpecField is described by its model, primary
+    key and field, and can be rebuilt from that description.
+
+    """
+    clear_imagekit_cache()
+    photo = create_photo('jobs-describe.jpg')
+    job = describe(photo.thumbnail)
+    eq_(job['generator'], 'tests:photo:thumbnail')
+    eq_(job['source'], ('field', 'tests', 'Photo', photo.pk, 'original_image'))
+    eq_(job['name'], photo.thumbnail.name)
+
+    file = load(job)
+    eq_(file.name, photo.thumbnail.name)
+
+
+def test_obsolete_job():
+    clear_imagekit_cache()
+    photo = create_photo('jobs-obsolete.jpg')
+    job = describe(photo.thumbnail)
+    job['name'] = 'something/else.jpg'
+    eq_(load(job), None)
+
+
+def test_run_batch():
+    """
+    Ensure that batched jobs for the same source load the source once.
+
+    """
+    clear_imagekit_cache()
+    photo = create_photo('jobs-batch.jpg')
+    batch = [describe(photo.thumbnail), describe(photo.smartcropped_thumbnail)]
+    with mock.patch.object(jobs, 'load_source',
+                           wraps=jobs.load_source) as load_source:
+        eq_(run_batch(batch), 2)
+    eq_(load_source.call_count, 1)
+    assert_true(photo.thumbnail.storage.exists(photo.thumbnail.name))
+    assert_true(photo.smartcropped_thumbnail.storage.exists(
+        photo.smartcropped_thumbnail.name))
+
+
+def test_generation_pool():
+    """
+    Ensure that jobs are run in worker processes.
+
+    """
+    clear_imagekit_cache()
+    source = File(default_storage.open('reference.png'), name='reference.png')
+    source.storage = default_storage
+    generator = generator_registry.get('1pxsq', source=source)
+    file = ImageCacheFile(generator)
+    job = describe(file)
+    eq_(job['source'], ('storage', 'default', 'reference.png'))
+
+    pool = GenerationPool(processes=1)
+    try:
+        eq_(pool.map([job]), [True])
+    finally:
+        pool.close()
+    assert_true(file.storage.exists(file.name))
+
+
+def test_generation_pool_errors_without_error_callbacks():
+    """
+    Ensure that the callbacks of failed jobs are called when the pool doesn't
+    support error callbacks (as on Python 2).
+
+    """
+    class Pool(object):
+        def apply_async(self, func, args, callback=None, **kwargs):
+            if kwargs:
+                raise TypeError
+            callback(func(*args))
+
+    pool = GenerationPool(processes=1)
+    pool._pool = Pool()
+    callback = mock.Mock()
+    job = {'name': 'failed.jpg'}
+    with mock.patch.object(jobs, 'run', side_effect=IOError('gone')):
+        pool.submit(job, callback=callback)
+    eq_(callback.call_count, 1)
+    eq_(callback.call_args[0][0], job)
+    assert_true(callback.call_args[0][1])
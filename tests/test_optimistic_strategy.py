@@ -1,10 +1,13 @@
-from nose.tools import assert_true, assert_false
+import mock
+from nose.tools import assert_true, assert_false, eq_
 from imagekit.cachefiles import ImageCacheFile
 from mock import Mock
-from .utils import create_image
+from .utils import create_image, create_photo
 from django.core.files.storage import FileSystemStorage
+from django.db import transaction
 from imagekit.cachefiles.backends import Simple as SimpleCFBackend
-from imagekit.cachefiles.strategies import Optimistic as OptimisticStrategy
+from imagekit.cachefiles.strategies import (OnCommit as OnCommitStrategy,
+                                            Optimistic as OptimisticStrategy)
 
 
 class ImageGenerator(object):
@@ -47,3 +50,52 @@ def test_no_io_on_url():
     file.url
     assert_false(file.storage.exists.called)
     assert_false(file.storage.open.called)
+
+
+def test_on_commit_strategy():
+    """
+    Ensure that the files of saved sources are generated once each when the
+    transaction is committed, and not at all if it (or the savepoint they were
+    saved in) is rolled back.
+
+    """
+    photo = create_photo('on-commit.jpg')
+    strategy = OnCommitStrategy()
+    files = [photo.thumbnail, photo.smartcropped_thumbnail]
+    with mock.patch.object(ImageCacheFile, 'generate') as generate:
+        with transaction.atomic():
+            for file in files + files:
+                strategy.on_source_saved(file)
+            eq_(generate.call_count, 0)
+        eq_(generate.call_count, 2)
+
+        try:
+            with transaction.atomic():
+                strategy.on_source_saved(files[0])
+                raise ValueError
+        except ValueError:
+            pass
+        eq_(generate.call_count, 2)
+
+        with transaction.atomic():
+            strategy.on_source_saved(files[0])
+        eq_(generate.call_count, 3)
+
+        # The files of a savepoint that's rolled back aren't generated.
+        with transaction.atomic():
+            strategy.on_source_saved(files[0])
+            try:
+                with transaction.atomic():
+                    strategy.on_source_saved(files[1])
+                    raise ValueError
+            except ValueError:
+                pass
+        eq_(generate.call_count, 4)
+        with transaction.atomic():
+            with transaction.atomic():
+                strategy.on_source_saved(files[1])
+        eq_(generate.call_count, 5)
+
+        # Outside of transactions, files are generated right away.
+        strategy.on_source_saved(files[0])
+        eq_(generate.call_count, 6)
@@ -1,9 +1,11 @@
+import mock
 from django.core.files import File
 from imagekit.signals import source_saved
 from imagekit.specs.sourcegroups import ImageFieldSourceGroup
-from nose.tools import eq_
+from imagekit.utils import generate_all, open_image
+from nose.tools import eq_, assert_true
 from . models import AbstractImageModel, ImageModel, ConcreteImageModel
-from .utils import get_image_file
+from .utils import get_image_file, create_photo, clear_imagekit_cache
 
 
 def make_counting_receiver(source_group):
@@ -53,3 +55,174 @@ def test_abstract_model_signals():
     source_saved.connect(receiver)
     ConcreteImageModel.objects.create(original_image=File(get_image_file()))
     eq_(receiver.count, 1)
+
+
+def test_generate_all_decodes_once():
+    """
+    Ensure that generating several specs with the same source decodes the
+    source image only once.
+
+    """
+    clear_imagekit_cache()
+    photo = create_photo('generate-all.jpg')
+    with mock.patch('imagekit.utils.open_image',
+                    wraps=open_image) as shared_open, \
+            mock.patch('imagekit.specs.open_image',
+                       wraps=open_image) as spec_open:
+        files = generate_all(photo.original_image, [
+            'tests:photo:thumbnail', 'tests:photo:smartcropped_thumbnail'])
+    eq_(shared_open.call_count + spec_open.call_count, 1)
+    for file in files:
+        assert_true(file.storage.exists(file.name))
+
+
+def test_generate_all_shares_processor_prefixes():
+    """
+    Ensure that the processors that several specs start with are only run
+    once, and that the files are the same as when they're run for each spec.
+
+    """
+    from imagekit.processors import Adjust
+
+    clear_imagekit_cache()
+    photo = create_photo('shared-prefix.jpg')
+    ids = ['tests:photo:thumbnail', 'tests:photo:smartcropped_thumbnail']
+    with mock.patch.object(Adjust, 'process', autospec=True,
+                           side_effect=Adjust.process) as process:
+        files = generate_all(photo.original_image, ids)
+    eq_(process.call_count, 1)
+
+    for file in files:
+        with file.storage.open(file.name) as shared:
+            expected = file.generator.generate()
+            eq_(shared.read(), expected.read())
+
+
+def test_whole_pipeline_shared():
+    """
+    Ensure that the output of a spec whose processors start another spec's is
+    shared, and that specs that decode JPEGs at a reduced scale don't use the
+    full-size image shared with other specs.
+
+    """
+    from django.core.files.base import ContentFile
+    from imagekit.lib import Image, StringIO
+    from imagekit.processors import Adjust, ResizeToFit
+    from imagekit.specs import ImageSpec
+    from imagekit.utils import share_processor_prefixes, share_source_image
+
+    class Thumbnail(ImageSpec):
+        processors = [ResizeToFit(50, 50)]
+        format = 'JPEG'
+
+    class SharpenedThumbnail(Thumbnail):
+        processors = [ResizeToFit(50, 50), Adjust(sharpness=1.5)]
+
+    content = StringIO()
+    Image.new('RGB', (800, 600)).save(content, 'JPEG')
+    source = ContentFile(content.getvalue(), name='whole-pipeline.jpg')
+
+    for fast_decode, resizes, drafts in [(False, 1, 0), (True, 2, 2)]:
+        specs = [Thumbnail(source=source), SharpenedThumbnail(source=source)]
+        for spec in specs:
+            spec.fast_decode = fast_decode
+        with mock.patch.object(ResizeToFit, 'process', autospec=True,
+                               side_effect=ResizeToFit.process) as process, \
+                mock.patch.object(ImageSpec, 'draft', autospec=True,
+                                  side_effect=ImageSpec.draft) as draft:
+            with share_source_image(source):
+                share_processor_prefixes(source, specs)
+                for spec in specs:
+                    spec.generate()
+        eq_(process.call_count, resizes)
+        eq_(draft.call_count, drafts)
+
+
+def test_processor_prefixes_registered_once():
+    """
+    Ensure that specs created from the same generator are only registered once
+    for a shared source, so that they don't share prefixes with themselves.
+
+    """
+    from imagekit.registry import generator_registry
+    from imagekit.utils import (_get_shared_entry, share_processor_prefixes,
+                                share_source_image)
+
+    photo = create_photo('registered-once.jpg')
+    source = photo.original_image
+    ids = ['tests:photo:thumbnail', 'tests:photo:smartcropped_thumbnail']
+    with share_source_image(source):
+        for i in range(2):
+            share_processor_prefixes(source, [
+                generator_registry.get(id, source=source) for id in ids])
+        eq_(len(_get_shared_entry(source)['specs']), 2)
+
+
+def test_source_saved_only_when_changed():
+    """
+    Ensure that saving a loaded instance only dispatches the source_saved
+    signal if its source changed.
+
+    """
+    source_group = ImageFieldSourceGroup(ImageModel, 'image')
+    receiver = make_counting_receiver(source_group)
+    source_saved.connect(receiver)
+    try:
+        pk = ImageModel.objects.create(image=File(get_image_file())).pk
+        eq_(receiver.count, 1)
+
+        instance = ImageModel.objects.get(pk=pk)
+        instance.save()
+        eq_(receiver.count, 1)
+
+        instance.image = File(get_image_file(), name='other.jpg')
+        instance.save()
+        eq_(receiver.count, 2)
+    finally:
+        source_saved.disconnect(receiver)
+
+
+def test_source_saved_for_existing_file():
+    """
+    Ensure that creating an instance whose source is the name of a file that's
+    already in storage dispatches the source_saved signal.
+
+    """
+    from django.core.files.storage import default_storage
+
+    name = default_storage.save('existing.jpg', File(get_image_file()))
+    source_group = ImageFieldSourceGroup(ImageModel, 'image')
+    receiver = make_counting_receiver(source_group)
+    source_saved.connect(receiver)
+    try:
+        ImageModel.objects.create(image=name)
+        eq_(receiver.count, 1)
+    finally:
+        source_saved.disconnect(receiver)
+        default_storage.delete(name)
+
+
+class StubSourceGroup(object):
+    # Unlike ImageFieldSourceGroup, it isn't added to the global router.
+    def __init__(self, model_class, image_field):
+        self.model_class = model_class
+        self.image_field = image_field
+
+
+def test_source_fields_looked_up_per_class():
+    from imagekit.specs.sourcegroups import ModelSignalRouter
+    from django.contrib.auth.models import Group
+    from django.db.models.signals import post_init, post_save
+
+    router = ModelSignalRouter()
+    router.add(StubSourceGroup(AbstractImageModel, 'original_image'))
+    eq_(router.get_class_source_fields(ConcreteImageModel),
+        frozenset(['original_image']))
+    eq_(router.get_class_source_fields(Group), frozenset())
+    try:
+        router.add(StubSourceGroup(Group, 'name'))
+        eq_(router.get_class_source_fields(Group), frozenset(['name']))
+    finally:
+        for signal in [post_init, post_save]:
+            signal.disconnect(sender=Group,
+                              dispatch_uid='ik_spec_field_receivers')
@@ -0,0 +1,297 @@
+import mock
+from django.core.files.base import ContentFile
+from django.test.utils import override_settings
+from imagekit.exceptions import SourceTooLarge
+from imagekit.lib import Image, StringIO
+from imagekit.processors import (Adjust, ProcessorPipeline, Reflection,
+                                 ResizeToFill, ResizeToFit, SmartCrop)
+from imagekit.processors.sizes import get_scale
+from imagekit.specs import ImageSpec, get_source_limit_stats
+from nose.tools import eq_, assert_raises
+
+
+def create_jpeg(size):
+    content = StringIO()
+    Image.new('RGB', size, (128, 64, 32)).save(content, 'JPEG')
+    return ContentFile(content.getvalue(), name='large.jpg')
+
+
+def test_get_scale():
+    eq_(get_scale([ResizeToFill(100, 50)], (1000, 1000)), 0.1)
+    eq_(get_scale([ResizeToFit(100, 50)], (1000, 1000)), 0.05)
+    eq_(get_scale([Adjust(contrast=1.2), ResizeToFit(100)], (1000, 500)), 0.1)
+    eq_(get_scale([SmartCrop(100, 100), ResizeToFit(10)], (1000, 1000)), 1.0)
+    eq_(get_scale([ResizeToFill(2000, 2000)], (1000, 1000)), 1.0)
+
+
+class FastDecodeSpec(ImageSpec):
+    processors = [ResizeToFill(100, 100)]
+    format = 'JPEG'
+    fast_decode = True
+
+
+def test_fast_decode():
+    """
+    Ensure that JPEGs are decoded at a reduced scale, but no smaller than
+    twice the size needed by the processors.
+
+    """
+    spec = FastDecodeSpec(source=create_jpeg((2000, 2000)))
+    with mock.patch.object(spec, 'generate_from_image',
+                           wraps=spec.generate_from_image) as generate:
+        result = spec.generate()
+    eq_(generate.call_args[0][0].size, (250, 250))
+    eq_(Image.open(result).size, (100, 100))
+
+    spec.fast_decode = False
+    with mock.patch.object(spec, 'generate_from_image',
+                           wraps=spec.generate_from_image) as generate:
+        spec.generate()
+    eq_(generate.call_args[0][0].size, (2000, 2000))
+
+
+class LimitedSpec(ImageSpec):
+    processors = [ResizeToFill(100, 100)]
+    format = 'JPEG'
+    max_source_pixels = 1000 * 1000
+
+
+def test_oversized_source_rejected():
+    """
+    Ensure that sources exceeding a limit are rejected before being decoded.
+
+    """
+    before = get_source_limit_stats()
+    spec = LimitedSpec(source=create_jpeg((2000, 1000)))
+    with mock.patch.object(spec, 'generate_from_image') as generate:
+        assert_raises(SourceTooLarge, spec.generate)
+    eq_(generate.call_count, 0)
+    stats = get_source_limit_stats()
+    eq_(stats['pixels'], before.get('pixels', 0) + 1)
+    eq_(stats['reject'], before.get('reject', 0) + 1)
+
+
+@override_settings(IMAGEKIT_OVERSIZED_SOURCE_ACTION='draft')
+def test_oversized_source_drafted():
+    """
+    Ensure that oversized JPEGs can be decoded at a scale that fits the limit.
+
+    """
+    spec = LimitedSpec(source=create_jpeg((2000, 1000)))
+    with mock.patch.object(spec, 'generate_from_image',
+                           wraps=spec.generate_from_image) as generate:
+        spec.generate()
+    eq_(generate.call_args[0][0].size, (1000, 500))
+
+    spec.max_source_pixels = None
+    spec.max_working_set = 1000 * 1000
+    with mock.patch.object(spec, 'generate_from_image',
+                           wraps=spec.generate_from_image) as generate:
+        spec.generate()
+    eq_(generate.call_args[0][0].size, (500, 250))
+
+
+class Source(object):
+    def __init__(self, name):
+        self.name = name
+
+
+def test_cached_hash_is_stable():
+    """
+    Ensure that the cached fingerprint gives the same hash as pickling the
+    whole spec, so that existing file names don't change.
+
+    """
+    from hashlib import md5
+    from imagekit.hashers import _dumps
+    from imagekit.generatorlibrary import Thumbnail
+
+    for name in ['a.jpg', u'photos/\xe9t\xe9.png', "it's \"quoted\"\n"]:
+        for spec in [FastDecodeSpec(source=Source(name)),
+                     Thumbnail(100, 50, source=Source(name))]:
+            eq_(spec.get_fingerprint_key() is not None, True)
+            expected = md5(_dumps([name, spec.processors, spec.format,
+                                   spec.options, spec.autoconvert]))
+            eq_(spec.get_hash(), expected.hexdigest())
+
+
+@override_settings(IMAGEKIT_HASH_FUNCTION='blake2b')
+def test_hash_function_setting():
+    spec = FastDecodeSpec(source=Source('a.jpg'))
+    eq_(len(spec.get_hash()), 32)
+    eq_(spec.get_hash(), FastDecodeSpec(source=Source('a.jpg')).get_hash())
+    assert spec.get_hash() != FastDecodeSpec(source=Source('b.jpg')).get_hash()
+
+
+class FingerprintedResize(ResizeToFit):
+    def fingerprint(self):
+        return ('resize-to-fit', self.width, self.height)
+
+
+class FingerprintedSpec(ImageSpec):
+    processors = [FingerprintedResize(100, 100)]
+
+
+def test_processor_fingerprint():
+    spec = FingerprintedSpec(source=Source('a.jpg'))
+    data = spec.get_fingerprint_data('a.jpg')
+    eq_(data[1], [('resize-to-fit', 100, 100)])
+    other = FingerprintedSpec(source=Source('a.jpg'))
+    other.processors = [FingerprintedResize(200, 100)]
+    eq_(other.get_fingerprint_key(), None)
+    assert spec.get_hash() != other.get_hash()
+
+
+def test_optimize_processors():
+    from imagekit.processors import Crop, Resize, ResizeToCover, Transpose
+    from imagekit.processors.optimize import optimize
+
+    adjust = Adjust(color=0.5)
+    crop = Crop(10, 10)
+    eq_(optimize([adjust, crop]), [crop, adjust])
+    eq_(optimize([Adjust(contrast=1.2), crop])[0].__class__, Adjust)
+
+    resize = Resize(50, 20)
+    eq_(optimize([ResizeToCover(100, 100), resize]), [resize])
+    eq_(len(optimize([ResizeToCover(100, 100),
+                      Resize(50, 20, upscale=False)])), 2)
+    # The second resize may enlarge the output of the first.
+    eq_(len(optimize([ResizeToFit(100, 100), resize])), 2)
+    eq_(len(optimize([ResizeToCover(10, 10), resize])), 2)
+
+    transpose = Transpose(Transpose.ROTATE_90)
+    resize, last = optimize([transpose, ResizeToFill(100, 50)])
+    eq_((resize.width, resize.height, last), (50, 100, transpose))
+    eq_(optimize([Transpose(), ResizeToFill(100, 50)])[0].__class__,
+        Transpose)
+    # Transpositions also swap the axes.
+    transpose = Transpose(getattr(Image, 'Transpose', Image).TRANSPOSE)
+    resize, last = optimize([transpose, ResizeToFill(100, 50)])
+    eq_((resize.width, resize.height, last), (50, 100, transpose))
+    eq_(optimize([Transpose(-1), ResizeToFill(100, 50)])[0].__class__,
+        Transpose)
+
+
+class OptimizedSpec(ImageSpec):
+    processors = [Adjust(color=0.5), SmartCrop(100, 100)]
+    optimize_processors = True
+
+
+class UnoptimizedSpec(OptimizedSpec):
+    optimize_processors = False
+
+
+@override_settings(IMAGEKIT_OPTIMIZER_DEBUG=True)
+def test_optimized_spec_output():
+    from imagekit.processors import Crop, Transpose
+    from imagekit.processors.optimize import get_difference
+
+    source = create_jpeg((400, 300))
+    for processors in [[Adjust(color=0.5), Crop(100, 100)],
+                       [Transpose(Transpose.ROTATE_270),
+                        ResizeToFill(100, 50)],
+                       [Transpose(getattr(Image, 'Transpose', Image).TRANSVERSE),
+                        ResizeToFill(100, 50)]]:
+        images = []
+        for cls in [OptimizedSpec, UnoptimizedSpec]:
+            spec = cls(source=source)
+            spec.processors = processors
+            images.append(Image.open(spec.generate()))
+        eq_(images[0].size, images[1].size)
+        assert get_difference(*images) < 2.0
+
+
+class BadlyOptimizedResize(ResizeToFit):
+    def optimize_with(self, next):
+        # Wrong on purpose: drops the next processor.
+        return [self]
+
+
+@override_settings(IMAGEKIT_OPTIMIZER_DEBUG=True)
+def test_optimizer_check():
+    """
+    Ensure that in debug mode, the output of the original processors is used
+    if the optimized ones produce a different image.
+
+    """
+    spec = OptimizedSpec(source=create_jpeg((400, 300)))
+    spec.processors = [BadlyOptimizedResize(100, 100), ResizeToFill(20, 20)]
+    with mock.patch('imagekit.specs.get_logger') as get_logger:
+        eq_(Image.open(spec.generate()).size, (20, 20))
+    eq_(get_logger.return_value.warning.call_count, 1)
+
+
+def test_get_output_size():
+    """
+    Ensure that the predicted output sizes of the resizing processors match
+    those of the images they produce.
+
+    """
+    from imagekit.processors import (Crop, Resize, ResizeToCover,
+                                     SmartResize, Thumbnail, Transpose)
+    from imagekit.processors.sizes import get_output_size
+
+    pipelines = [
+        [Resize(50, 20)],
+        [Resize(500, 20, upscale=False)],
+        [ResizeToFit(100, 100)],
+        [ResizeToFit(width=70)],
+        [ResizeToFit(500, 500, upscale=False)],
+        [ResizeToFit(100, 100, mat_color=(0, 0, 0))],
+        [ResizeToCover(100, 100)],
+        [ResizeToFill(100, 40)],
+        [SmartResize(30, 90)],
+        [Thumbnail(100, 100)],
+        [Thumbnail(width=80)],
+        [Crop(120, 500)],
+        [Transpose(Transpose.ROTATE_90), ResizeToFill(100, 40)],
+        [Transpose(getattr(Image, 'Transpose', Image).TRANSPOSE),
+         ResizeToFit(80, 80)],
+        [Adjust(color=0.5), Thumbnail(60, 60, crop=False)],
+    ]
+    for size in [(300, 200), (200, 301), (50, 40)]:
+        img = Image.new('RGB', size)
+        for processors in pipelines:
+            expected = ProcessorPipeline(processors).process(img).size
+            eq_(get_output_size(processors, size), expected)
+    eq_(get_output_size([Transpose(), ResizeToFit(10, 10)], (30, 20)), None)
+    eq_(get_output_size([SmartCrop(10, 10), Reflection()], (30, 20)), None)
+
+
+class ImageFieldSource(object):
+    def __init__(self, name, width, height):
+        self.name = name
+        self.field = mock.Mock(width_field='width', height_field='height')
+        self.instance = mock.Mock(width=width, height=height)
+
+
+def test_predict_dimensions():
+    spec = FastDecodeSpec(source=ImageFieldSource('a.jpg', 400, 200))
+    eq_(spec.predict_dimensions(), (100, 100))
+    spec = OptimizedSpec(source=ImageFieldSource('a.jpg', 400, 200))
+    spec.processors = [ResizeToFit(100, 100)]
+    eq_(spec.predict_dimensions(), (100, 50))
+    eq_(FastDecodeSpec(source=Source('a.jpg')).predict_dimensions(), None)
+
+
+def test_predict_dimensions_of_drafted_jpegs():
+    """
+    Ensure that the reduced scale at which specs with ``fast_decode`` decode
+    JPEGs is taken into account.
+
+    """
+    spec = FastDecodeSpec(source=ImageFieldSource('a.jpg', 1162, 1552))
+    spec.processors = [ResizeToFit(width=100)]
+    eq_(spec.predict_dimensions(), (100, 133))
+    spec.source = ImageFieldSource('a.png', 1162, 1552)
+    eq_(spec.predict_dimensions(), (100, 134))
+    spec.source = ImageFieldSource('a', 1162, 1552)
+    eq_(spec.predict_dimensions(), None)
+    spec.processors = [ResizeToFill(100, 100)]
+    eq_(spec.predict_dimensions(), (100, 100))
+
+    for size in [(1162, 1552), (4000, 3001), (801, 799)]:
+        img = Image.open(create_jpeg(size))
+        spec.processors = [ResizeToFit(width=90)]
+        spec.draft(img)
+        eq_(spec.get_draft_size(size), img.size)
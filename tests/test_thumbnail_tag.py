@@ -1,5 +1,7 @@
+import mock
 from django.template import TemplateSyntaxError
 from nose.tools import eq_, raises, assert_not_equal
+from imagekit.registry import generator_registry
 from . import imagegenerators  # noqa
 from .utils import render_tag, get_html_attrs, clear_imagekit_cache
 
@@ -69,3 +71,60 @@ def test_alternate_generator():
     clear_imagekit_cache()
     html = render_tag(ttag)
     eq_(html, '1')
+
+
+def test_img_tag_predicts_dimensions():
+    """
+    Ensure that the dimensions of a thumbnail are predicted from those of its
+    source, without reading the thumbnail (which isn't even generated here).
+
+    """
+    from django.core.files.images import ImageFile
+    from django.template import Context, Template
+    from imagekit.cachefiles import ImageCacheFile
+    from .utils import get_image_file
+
+    clear_imagekit_cache()
+    img = ImageFile(get_image_file())
+    width, height = img.width, img.height
+    template = Template("{% load imagekit %}{% thumbnail '100x' img %}")
+    with mock.patch.object(ImageCacheFile, 'generate'), \
+            mock.patch.object(ImageCacheFile, '_get_image_dimensions') as get:
+        html = template.render(Context({'img': img}))
+    eq_(get.call_count, 0)
+    assert 'width="100"' in html
+    assert 'height="%d"' % round(100.0 * height / width) in html
+
+
+def test_img_tag_dimensions_of_drafted_jpeg():
+    """
+    Ensure that the predicted dimensions of thumbnails of JPEGs take the
+    reduced scale at which they're decoded (which rounds their size) into
+    account.
+
+    """
+    from django.core.files.base import ContentFile
+    from django.core.files.images import ImageFile
+    from django.template import Context, Template
+    from imagekit.cachefiles import ImageCacheFile
+    from imagekit.lib import Image, StringIO
+
+    clear_imagekit_cache()
+    content = StringIO()
+    Image.new('RGB', (1162, 1552), (128, 64, 32)).save(content, 'JPEG')
+    img = ImageFile(ContentFile(content.getvalue()), name='drafted.jpg')
+    img.width  # The source's dimensions are known.
+    template = Template("{% load imagekit %}{% thumbnail '100x' img %}")
+    with mock.patch.object(ImageCacheFile, 'generate'), \
+            mock.patch.object(ImageCacheFile, '_get_image_dimensions') as get:
+        html = template.render(Context({'img': img}))
+    eq_(get.call_count, 0)
+    assert 'width="100"' in html
+    assert 'height="133"' in html
+
+    # That's the size of the thumbnail that's generated.
+    img = ImageFile(ContentFile(content.getvalue()), name='drafted.jpg')
+    thumbnail = ImageCacheFile(generator_registry.get(
+        'imagekit:thumbnail', source=img, width=100))
+    thumbnail.generate()
+    eq_(Image.open(thumbnail.storage.open(thumbnail.name)).size, (100, 133))